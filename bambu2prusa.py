@@ -0,0 +1,286 @@
+###
+# bambu2prusa.py
+# Headless command line for converting Bambu 3mf files to Prusa 3mf files.
+# Whole files are spread across a process pool, e.g.
+#   python bambu2prusa.py convert in/*.3mf -o out/ -j 8
+# Each file is reported as OK or FAILED and the exit code is non-zero if any file failed.
+# A re-export of a project converted before only reconverts its changed model files with
+#   python bambu2prusa.py convert new.3mf -o out/ --previous-input old.3mf --previous-output out_old/old.3mf
+# "serve" runs the same conversion as a local HTTP service, see service.py, and "watch" converts
+# the files dropped into a directory, see watch.py.
+# @License: GPL 3.0
+###
+import os
+import sys
+import glob
+import argparse
+import logging
+from converter import convert_file
+from conversion_cache import ConversionCache
+from instrumentation import JsonLinesSink
+from selection import ObjectSelection
+from compression import Compression
+from incremental import PreviousConversion
+from layout import Layout, parse_bed_size
+from limits import ResourceLimits, parse_size
+
+
+def collect_inputs(paths):
+    # expand directories to the 3mf files they contain; plain files are taken as given
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            inputs.extend(sorted(glob.glob(os.path.join(path, "*.3mf"))))
+        else:
+            inputs.append(path)
+    return inputs
+
+
+def plan_outputs(inputs, output_dir):
+    # (jobs, rejected results) for converting inputs into output_dir. Inputs sharing a basename would
+    # write the same output, and an output that is its own input would be overwritten while it is
+    # read, so such inputs are reported as failed instead of converted
+    outputs = {}
+    for input_file in inputs:
+        output_file = os.path.join(output_dir, os.path.basename(input_file))
+        outputs.setdefault(os.path.normcase(os.path.abspath(output_file)), []).append((input_file, output_file))
+    jobs = []
+    rejected = []
+    for pairs in outputs.values():
+        for input_file, output_file in pairs:
+            if len(pairs) > 1:
+                others = ", ".join(other for other, _ in pairs if other is not input_file)
+                rejected.append((input_file, output_file, False, f"Output {output_file} would also be written by {others}", None))
+            elif os.path.exists(output_file) and os.path.samefile(input_file, output_file):
+                rejected.append((input_file, output_file, False, f"Output {output_file} is the input file itself", None))
+            else:
+                jobs.append(input_file)
+    return jobs, rejected
+
+
+def convert_job(input_file, output_file, settings):
+    # runs in a worker process; exceptions are turned into messages so they always pickle
+    cache = settings.get("cache")
+    before = cache.stats() if cache is not None else {}
+    try:
+        models = convert_file(input_file, output_file, **settings)
+        message = f"{len(models)} model files"
+        ok = True
+    except Exception as e:
+        message = f"{type(e).__name__}: {e}"
+        ok = False
+    # only this job's share of the cache counters, in case the cache object is shared between jobs
+    cache_stats = {name: value - before[name] for name, value in cache.stats().items()} if cache is not None else None
+    return input_file, output_file, ok, message, cache_stats
+
+
+def conversion_settings(args):
+    # converter attributes shared by every job of a run
+    settings = {"model_workers": args.model_jobs, "model_pool": args.model_pool,
+                "compression": Compression(args.compression, args.compress_level, args.compress_jobs)}
+    if args.no_layout:
+        settings["layout"] = None
+    else:
+        bed_width, bed_depth = parse_bed_size(args.bed_size)
+        settings["layout"] = Layout(bed_width, bed_depth, args.spacing, keep_transforms=not args.rearrange)
+    settings["limits"] = resource_limits(args)
+    if args.workspace_dir:
+        settings["workspace_root"] = args.workspace_dir
+    if args.in_memory_workspace:
+        settings["workspace_in_memory"] = True
+    if args.cache_dir:
+        settings["cache"] = ConversionCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    if args.passthrough:
+        settings["passthrough"] = tuple(args.passthrough)
+    if args.dedup:
+        settings["deduplicate"] = True
+    if args.no_validate:
+        settings["validate"] = False
+    if args.report:
+        settings["report_file"] = args.report
+    if args.metrics:
+        settings["instrumentation"] = JsonLinesSink(args.metrics, trace_memory=args.trace_memory)
+    return settings
+
+
+def resource_limits(args):
+    # sizes are given in MB; 0 turns a limit off
+    return ResourceLimits(parse_size(args.max_total_size), parse_size(args.max_entry_size),
+                          args.max_entries or None, parse_size(args.max_parse_memory))
+
+
+def run_convert(args):
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        print("No input files found", file=sys.stderr)
+        return 2
+    if bool(args.previous_input) != bool(args.previous_output):
+        print("--previous-input and --previous-output must be given together", file=sys.stderr)
+        return 2
+    if args.previous_input and len(inputs) != 1:
+        print("An incremental conversion takes exactly one input file", file=sys.stderr)
+        return 2
+    if args.previous_input and args.dedup:
+        print("--dedup can't be combined with an incremental conversion", file=sys.stderr)
+        return 2
+    os.makedirs(args.output, exist_ok=True)
+    settings = conversion_settings(args)
+    selection = ObjectSelection(args.object_id, args.object_name, args.plate)
+    if selection:
+        settings["selection"] = selection
+    if args.previous_input:
+        settings["previous"] = PreviousConversion(args.previous_input, args.previous_output)
+    # every output path is resolved before anything is converted
+    accepted, rejected = plan_outputs(inputs, args.output)
+    jobs = [(input_file, os.path.join(args.output, os.path.basename(input_file)), settings) for input_file in accepted]
+
+    failures = report(rejected)
+    if args.jobs == 1:
+        results = (convert_job(*job) for job in jobs)
+        failures += report(results)
+    else:
+        # the pool and the service are imported where they are used, to keep start-up short for
+        # single-file runs (see "python benchmark.py --startup")
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            futures = [pool.submit(convert_job, *job) for job in jobs]
+            failures += report(future.result() for future in as_completed(futures))
+    print(f"{len(inputs) - failures} converted, {failures} failed")
+    return 1 if failures else 0
+
+
+def run_serve(args):
+    import asyncio
+    from service import ConversionService
+    service = ConversionService(conversion_settings(args), workers=args.jobs, queue_size=args.queue,
+                                timeout=args.timeout, max_upload=args.max_upload * 1024 * 1024, upload_timeout=args.upload_timeout)
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix_socket))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def run_watch(args):
+    from watch import FolderWatcher
+    if not os.path.isdir(args.input_dir):
+        print(f"{args.input_dir} is not a directory", file=sys.stderr)
+        return 2
+    try:
+        watcher = FolderWatcher(args.input_dir, args.output, conversion_settings(args), workers=args.jobs,
+                                interval=args.interval, settle=args.settle, state_file=args.state)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    try:
+        counters = watcher.run(once=args.once)
+    except KeyboardInterrupt:
+        return 0
+    return 1 if counters["failed"] else 0
+
+
+def report(results):
+    failures = 0
+    cache_totals = {}
+    for input_file, output_file, ok, message, cache_stats in results:
+        if ok:
+            print(f"OK      {input_file} -> {output_file} ({message})")
+        else:
+            failures += 1
+            print(f"FAILED  {input_file}: {message}", file=sys.stderr)
+        # each job works on its own copy of the cache, so the counters are summed here
+        for name, value in (cache_stats or {}).items():
+            cache_totals[name] = cache_totals.get(name, 0) + value
+    if cache_totals:
+        print("cache: " + ", ".join(f"{value} {name}" for name, value in cache_totals.items()))
+    return failures
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="bambu2prusa", description="Convert Bambu Studio 3mf files to PrusaSlicer 3mf files.")
+    parser.add_argument("-v", "--verbose", action="count", default=0, help="log progress (-v) or debug output (-vv)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert = subparsers.add_parser("convert", help="convert 3mf files into an output directory")
+    convert.add_argument("inputs", nargs="+", help="Bambu 3mf files or directories containing them")
+    convert.add_argument("-o", "--output", required=True, help="directory the converted files are written to")
+    convert.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of files converted in parallel (default: CPU count)")
+    add_conversion_options(convert)
+    convert.add_argument("--object-id", action="append", default=[], help="only convert this object id (repeatable)")
+    convert.add_argument("--object-name", action="append", default=[], help="only convert objects or parts with this name; wildcards allowed (repeatable)")
+    convert.add_argument("--plate", action="append", default=[], help="only convert the objects on this Bambu plate number (repeatable)")
+    convert.add_argument("--previous-input", help="earlier version of the input; model files unchanged since it are copied from --previous-output")
+    convert.add_argument("--previous-output", help="the converted file of --previous-input")
+    convert.set_defaults(func=run_convert)
+
+    serve = subparsers.add_parser("serve", help="run a local HTTP service that converts uploaded 3mf files")
+    serve.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    serve.add_argument("--port", type=int, default=8080, help="port to listen on (default: 8080)")
+    serve.add_argument("--unix-socket", help="listen on this unix socket instead of a TCP port")
+    serve.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of conversion worker processes (default: CPU count)")
+    serve.add_argument("--queue", type=int, default=8, help="conversions allowed to wait for a worker before answering 429 (default: 8)")
+    serve.add_argument("--timeout", type=float, default=120, help="seconds before a conversion is answered with 504 (default: 120)")
+    serve.add_argument("--upload-timeout", type=float, default=60, help="seconds a client may take to send its request before it is answered with 408 (default: 60)")
+    serve.add_argument("--max-upload", type=int, default=256, help="largest accepted upload in MB (default: 256)")
+    add_conversion_options(serve)
+    serve.set_defaults(func=run_serve)
+
+    watch = subparsers.add_parser("watch", help="convert 3mf files as they appear in a directory")
+    watch.add_argument("input_dir", help="directory to watch for Bambu 3mf files")
+    watch.add_argument("-o", "--output", required=True, help="directory the converted files are written to")
+    watch.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of files converted in parallel (default: CPU count)")
+    watch.add_argument("--interval", type=float, default=2.0, help="seconds between scans of the directory (default: 2)")
+    watch.add_argument("--settle", type=float, default=5.0, help="seconds a file must stay unchanged before it is converted (default: 5)")
+    watch.add_argument("--state", help="state index of converted files (default: .bambu2prusa-watch.json in the output directory)")
+    watch.add_argument("--once", action="store_true", help="convert the new and changed files present now and exit")
+    add_conversion_options(watch)
+    watch.set_defaults(func=run_watch)
+    return parser
+
+
+def add_conversion_options(parser):
+    # converter options shared by "convert", "serve" and "watch"
+    parser.add_argument("--model-jobs", type=int, default=1, help="number of model files converted in parallel within each 3mf (default: 1)")
+    parser.add_argument("--model-pool", choices=("process", "thread"), default="process", help="pool used for --model-jobs (default: process)")
+    parser.add_argument("--compression", choices=("deflate", "stored"), default="deflate", help="zip method of the output; stored is fastest for a local handoff to PrusaSlicer (default: deflate)")
+    parser.add_argument("--compress-level", type=int, choices=range(10), metavar="0-9", help="deflate level, 1 fastest, 9 smallest (default: zlib's 6)")
+    parser.add_argument("--compress-jobs", type=int, default=1, help="threads deflating each large model entry in blocks (default: 1)")
+    parser.add_argument("--bed-size", default="250x210", help="bed the objects are arranged on, WIDTHxDEPTH in mm (default: 250x210)")
+    parser.add_argument("--spacing", type=float, default=5.0, help="gap between arranged objects in mm (default: 5)")
+    parser.add_argument("--rearrange", action="store_true", help="arrange every object, also the ones Bambu Studio placed")
+    parser.add_argument("--no-layout", action="store_true", help="give every object the same fixed transform, as older versions did")
+    parser.add_argument("--dedup", action="store_true", help="write each distinct mesh once and its copies as further instances of it")
+    parser.add_argument("--passthrough", action="append", default=[], metavar="PATTERN", help="copy input entries matching this pattern, e.g. 'Metadata/*.png', into the output unchanged (repeatable)")
+    parser.add_argument("--max-total-size", type=float, default=8192, metavar="MB", help="largest uncompressed size of an input 3mf, 0 for no limit (default: 8192)")
+    parser.add_argument("--max-entry-size", type=float, default=4096, metavar="MB", help="largest uncompressed size of one entry of an input 3mf, 0 for no limit (default: 4096)")
+    parser.add_argument("--max-entries", type=int, default=10000, help="most entries an input 3mf may have, 0 for no limit (default: 10000)")
+    parser.add_argument("--max-parse-memory", type=float, default=64, metavar="MB", help="longest run of model text without markup the parser accepts, 0 for no limit (default: 64)")
+    parser.add_argument("--workspace-dir", help="directory the per-job scratch directories are created in (default: the system temporary directory)")
+    parser.add_argument("--in-memory-workspace", action="store_true", help="keep the per-job scratch directories on a tmpfs such as /dev/shm")
+    parser.add_argument("--no-validate", action="store_true", help="don't fail jobs whose output counts of objects, vertices and triangles differ from the input")
+    parser.add_argument("--report", help="append a validation report of every job to this JSON-lines file")
+    parser.add_argument("--cache-dir", help="directory of a conversion cache reused across runs")
+    parser.add_argument("--cache-size", type=int, default=1024, help="conversion cache size limit in MB (default: 1024)")
+    parser.add_argument("--metrics", help="append per-stage timing and memory records to this JSON-lines file")
+    parser.add_argument("--trace-memory", action="store_true", help="include tracemalloc peaks in the metrics (slower)")
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    levels = {0: logging.WARNING, 1: logging.INFO}
+    logging.basicConfig(level=levels.get(args.verbose, logging.DEBUG))
+    if getattr(args, "jobs", 1) < 1 or getattr(args, "model_jobs", 1) < 1 or getattr(args, "compress_jobs", 1) < 1:
+        print("--jobs, --model-jobs and --compress-jobs must be at least 1", file=sys.stderr)
+        return 2
+    if hasattr(args, "bed_size"):
+        try:
+            Layout(*parse_bed_size(args.bed_size), args.spacing)
+            resource_limits(args)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+###
+# benchmark.py
+# Benchmark harness for the Bambu -> Prusa conversion.
+# Generates a synthetic Bambu-style 3mf at a chosen scale, times each stage of the conversion
+# and writes throughput (MB/s, triangles/s) and peak RSS to JSON so runs can be compared across versions.
+#   python benchmark.py --models 8 --objects 4 --triangles 50000 --paint 0.3 -o bench.json
+# Every pipeline is measured in a fresh interpreter so that peak RSS belongs to that pipeline alone.
+# --startup instead measures interpreter start-up and import time of the entry points with -X importtime:
+#   python benchmark.py --startup --repeat 10
+# @License: GPL 3.0
+###
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import zipfile
+import argparse
+import platform
+import tempfile
+import subprocess
+from instrumentation import peak_rss_mb
+
+# paint codes as Bambu Studio writes them into paint_color / paint_seam
+PAINT_CODES = ["4", "8", "0C", "1C", "2C", "3C", "4C", "5C", "6C", "7C", "8C", "9C", "AC"]
+
+BAMBU_MODEL_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                      '<model unit="millimeter" xml:lang="en-US" xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02" '
+                      'xmlns:BambuStudio="http://schemas.bambulab.com/package/2021" '
+                      'xmlns:p="http://schemas.microsoft.com/3dmanufacturing/production/2015/06" requiredextensions="p">\n'
+                      ' <metadata name="BambuStudio:3mfVersion">1</metadata>\n'
+                      ' <resources>\n')
+
+PIPELINES = ("stages", "stream")
+# modules whose import time --startup measures; none of them may pull in tkinter
+STARTUP_MODULES = ("converter", "bambu2prusa", "main_str")
+
+
+def write_bambu_object(out, object_id, triangles, paint, seam, rng):
+    # a zig-zag strip of triangles, which gives triangles + 2 vertices
+    out.write(f'  <object id="{object_id}" p:UUID="{object_id:08x}-61cb-4c03-9d28-80fed5dfa1dc" type="model">\n   <mesh>\n    <vertices>\n')
+    for index in range(triangles + 2):
+        out.write(f'     <vertex x="{index * 0.25 % 180:.6g}" y="{(index % 2) * 0.5 + object_id:.6g}" z="{rng.random() * 20:.6g}"/>\n')
+    out.write('    </vertices>\n    <triangles>\n')
+    for index in range(triangles):
+        attributes = ""
+        if rng.random() < paint:
+            attributes += f' paint_color="{rng.choice(PAINT_CODES)}"'
+        if rng.random() < seam:
+            attributes += f' paint_seam="{rng.choice(PAINT_CODES)}"'
+        out.write(f'     <triangle v1="{index}" v2="{index + 1}" v3="{index + 2}"{attributes}/>\n')
+    out.write('    </triangles>\n   </mesh>\n  </object>\n')
+
+
+def generate_bambu_3mf(path, models=4, objects=2, triangles=10000, paint=0.3, seam=0.05, seed=1):
+    # writes a synthetic Bambu Studio 3mf and returns a description of what it contains
+    rng = random.Random(seed)
+    object_id = 1
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_out:
+        zip_out.writestr("[Content_Types].xml", '<?xml version="1.0" encoding="UTF-8"?>\n<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">\n'
+                         ' <Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>\n'
+                         ' <Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>\n'
+                         ' <Default Extension="png" ContentType="image/png"/>\n</Types>')
+        zip_out.writestr("_rels/.rels", '<?xml version="1.0" encoding="UTF-8"?>\n<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">\n'
+                         ' <Relationship Target="/3D/3dmodel.model" Id="rel-1" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>\n</Relationships>')
+        zip_out.writestr("Metadata/plate_1.png", bytes(rng.getrandbits(8) for _ in range(4096)))
+        components = []
+        for model_index in range(1, models + 1):
+            with zip_out.open(f"3D/Objects/object_{model_index}.model", 'w', force_zip64=True) as raw:
+                out = _TextWriter(raw)
+                out.write(BAMBU_MODEL_HEADER)
+                for _ in range(objects):
+                    write_bambu_object(out, object_id, triangles, paint, seam, rng)
+                    components.append((model_index, object_id))
+                    object_id += 1
+                # Bambu also keeps non-printable helper objects; the converter has to drop them
+                out.write(f'  <object id="{object_id}" type="other">\n   <mesh><vertices/><triangles/></mesh>\n  </object>\n')
+                object_id += 1
+                out.write(' </resources>\n <build/>\n</model>\n')
+                out.flush()
+        main_model = [BAMBU_MODEL_HEADER]
+        # one top-level object per part, named in model_settings.config and spread over two plates
+        settings = ['<?xml version="1.0" encoding="UTF-8"?>\n<config>\n']
+        plates = {1: [], 2: []}
+        build = []
+        for index, (model_index, component_id) in enumerate(components):
+            main_model.append(f'  <object id="{object_id}" type="model"><components><component p:path="/3D/Objects/object_{model_index}.model" objectid="{component_id}"/></components></object>\n')
+            settings.append(f'  <object id="{object_id}">\n    <metadata key="name" value="object_{object_id}"/>\n'
+                            f'    <part id="{component_id}" subtype="normal_part">\n      <metadata key="name" value="part_{component_id}"/>\n    </part>\n  </object>\n')
+            plates[1 + index % 2].append(object_id)
+            # Bambu Studio places every instance with a build item
+            build.append(f'  <item objectid="{object_id}" transform="1 0 0 0 1 0 0 0 1 {20 + 30 * (index % 8)} {20 + 30 * (index // 8)} 0" printable="1"/>\n')
+            object_id += 1
+        main_model.append(' </resources>\n <build>\n' + "".join(build) + ' </build>\n</model>\n')
+        for plate, object_ids in plates.items():
+            settings.append(f'  <plate>\n    <metadata key="plater_id" value="{plate}"/>\n')
+            for instance_id in object_ids:
+                settings.append(f'    <model_instance>\n      <metadata key="object_id" value="{instance_id}"/>\n      <metadata key="instance_id" value="0"/>\n    </model_instance>\n')
+            settings.append('  </plate>\n')
+        settings.append('</config>\n')
+        zip_out.writestr("3D/3dmodel.model", "".join(main_model))
+        zip_out.writestr("Metadata/model_settings.config", "".join(settings))
+    return {"models": models, "objects_per_model": objects, "triangles_per_object": triangles, "paint_fraction": paint,
+            "seam_fraction": seam, "triangles": models * objects * triangles, "input_bytes": os.path.getsize(path)}
+
+
+class _TextWriter:
+    # buffers str writes into large utf-8 blocks for a binary zip entry
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size > 1 << 20:
+            self.flush()
+
+    def flush(self):
+        self.raw.write("".join(self.parts).encode("utf-8"))
+        self.parts = []
+        self.size = 0
+
+
+def model_bytes(input_file):
+    with zipfile.ZipFile(input_file) as zip_ref:
+        return sum(info.file_size for info in zip_ref.infolist() if info.filename.startswith("3D/Objects/") and info.filename.endswith(".model"))
+
+
+def run_stages(input_file, output_file):
+    # the extract-to-disk pipeline, one timer per stage of bambu3mf2prusa3mf
+    from converter import Bambu2PrusaConverter
+    from pathlib import Path
+    from validation import ValidationReport
+    converter = Bambu2PrusaConverter()
+    converter.validation = ValidationReport(input_file, output_file)
+    stages = {"unzip": 0.0, "model_convert_re": 0.0, "inject": 0.0, "write": 0.0, "generate3mf_file": 0.0}
+    start = time.perf_counter()
+    extracted_path = converter.decompress_zip(input_file)
+    stages["unzip"] = time.perf_counter() - start
+    filenames = []
+    for bmodel_path in sorted(Path(extracted_path, "3D", "Objects").rglob("*.model")):
+        start = time.perf_counter()
+        filename, objects = converter.model_convert_re(bmodel_path)
+        stages["model_convert_re"] += time.perf_counter() - start
+        start = time.perf_counter()
+        prusa_model = converter.inject_bobject2pobject(objects)
+        stages["inject"] += time.perf_counter() - start
+        start = time.perf_counter()
+        converter.write_prusa_model(filename, prusa_model)
+        stages["write"] += time.perf_counter() - start
+        filenames.append(filename)
+        del objects, prusa_model
+    start = time.perf_counter()
+    converter.generate3mf_file(filenames, output_file)
+    stages["generate3mf_file"] = time.perf_counter() - start
+    converter.cleanup()
+    shutil.rmtree(extracted_path, ignore_errors=True)
+    # a stage that only logged an error would otherwise be timed as a success
+    converter.check_validation(output_file)
+    return stages
+
+
+def run_stream(input_file, output_file):
+    # the zip-to-zip streaming pipeline used by default
+    from converter import Bambu2PrusaConverter
+    converter = Bambu2PrusaConverter()
+    start = time.perf_counter()
+    converter.convert(input_file, output_file)
+    stages = {"convert_zip_stream": time.perf_counter() - start}
+    converter.cleanup()
+    return stages
+
+
+def run_pipeline(pipeline, input_file, triangles):
+    # runs one pipeline in this process and returns its measurements
+    output_file = os.path.join(tempfile.mkdtemp(), "out.3mf")
+    runner = {"stages": run_stages, "stream": run_stream}[pipeline]
+    stages = runner(input_file, output_file)
+    total = sum(stages.values())
+    megabytes = model_bytes(input_file) / (1024 * 1024)
+    result = {
+        "stages_s": {name: round(seconds, 4) for name, seconds in stages.items()},
+        "total_s": round(total, 4),
+        "mb_per_s": round(megabytes / total, 2) if total else None,
+        "triangles_per_s": round(triangles / total) if total and triangles else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "output_bytes": os.path.getsize(output_file),
+    }
+    os.remove(output_file)
+    os.rmdir(os.path.dirname(output_file))
+    return result
+
+
+def run_isolated(pipeline, input_file, triangles):
+    # a fresh interpreter per pipeline, so peak RSS is not inherited from a previous one
+    command = [sys.executable, os.path.abspath(__file__), "--run-pipeline", pipeline, "--input", input_file, "--triangles", str(triangles)]
+    completed = subprocess.run(command, capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+def parse_importtime(stderr):
+    # {module: (self microseconds, cumulative microseconds)} from -X importtime output
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def measure_interpreter(repeat=5):
+    # median wall time of a bare interpreter, the floor under every measure_startup() wall time
+    walls = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        walls.append(time.perf_counter() - start)
+    return round(sorted(walls)[repeat // 2] * 1000, 1)
+
+
+def measure_startup(module, repeat=5, top=10):
+    # median wall time of "python -X importtime -c 'import module'" over several fresh interpreters,
+    # the median import time of the module itself and the slowest imports it pulls in
+    here = os.path.dirname(os.path.abspath(__file__))
+    walls = []
+    imports = []
+    runs = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                   cwd=here, capture_output=True, text=True, check=True)
+        walls.append(time.perf_counter() - start)
+        modules = parse_importtime(completed.stderr)
+        imports.append(modules[module][1])
+        runs.append(modules)
+    median = sorted(range(repeat), key=lambda i: imports[i])[repeat // 2]
+    slowest = sorted(runs[median].items(), key=lambda item: item[1][0], reverse=True)[:top]
+    return {
+        "wall_ms": round(sorted(walls)[repeat // 2] * 1000, 1),
+        "import_ms": round(imports[median] / 1000, 1),
+        "modules": len(runs[median]),
+        "imports_tkinter": "tkinter" in runs[median],
+        "slowest_self_ms": {name: round(self_us / 1000, 2) for name, (self_us, cumulative_us) in slowest},
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the Bambu -> Prusa 3mf conversion on a synthetic project.")
+    parser.add_argument("--models", type=int, default=4, help="number of 3D/Objects/*.model files")
+    parser.add_argument("--objects", type=int, default=2, help="objects per model file")
+    parser.add_argument("--triangles", type=int, default=10000, help="triangles per object")
+    parser.add_argument("--paint", type=float, default=0.3, help="fraction of triangles with paint_color")
+    parser.add_argument("--seam", type=float, default=0.05, help="fraction of triangles with paint_seam")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--pipelines", nargs="+", choices=PIPELINES, default=list(PIPELINES))
+    parser.add_argument("--input", help="benchmark an existing 3mf instead of generating one")
+    parser.add_argument("-o", "--output", help="write the JSON results to this file")
+    parser.add_argument("--startup", action="store_true", help="measure start-up and import time of the entry points instead")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per module for --startup")
+    parser.add_argument("--run-pipeline", choices=PIPELINES, help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.run_pipeline:
+        print(json.dumps(run_pipeline(args.run_pipeline, args.input, args.triangles)))
+        return 0
+
+    from conversion_cache import CONVERTER_VERSION
+    if args.startup:
+        report = {
+            "converter_version": CONVERTER_VERSION,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "interpreter_wall_ms": measure_interpreter(args.repeat),
+            "startup": {module: measure_startup(module, args.repeat) for module in STARTUP_MODULES},
+        }
+        return write_report(report, args.output)
+
+    workdir = tempfile.mkdtemp()
+    try:
+        if args.input:
+            input_file = os.path.abspath(args.input)
+            scale = {"input_bytes": os.path.getsize(input_file), "triangles": None}
+        else:
+            input_file = os.path.join(workdir, "bambu.3mf")
+            start = time.perf_counter()
+            scale = generate_bambu_3mf(input_file, args.models, args.objects, args.triangles, args.paint, args.seam, args.seed)
+            scale["generate_s"] = round(time.perf_counter() - start, 4)
+        report = {
+            "converter_version": CONVERTER_VERSION,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "scale": scale,
+            "pipelines": {pipeline: run_isolated(pipeline, input_file, scale["triangles"] or 0) for pipeline in args.pipelines},
+        }
+    finally:
+        if not args.input and os.path.exists(os.path.join(workdir, "bambu.3mf")):
+            os.remove(os.path.join(workdir, "bambu.3mf"))
+        os.rmdir(workdir)
+    return write_report(report, args.output)
+
+
+def write_report(report, output=None):
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + "\n")
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
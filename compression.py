@@ -0,0 +1,226 @@
+###
+# compression.py
+# Output compression settings for the Prusa 3mf.
+# A Compression picks the zip method ("deflate" or "stored"), the deflate level (0-9, None for
+# zlib's default) and how many threads deflate each large entry. With workers > 1 an entry is cut
+# into blocks that are deflated concurrently (zlib releases the GIL) and written into the archive
+# in order, like pigz does: every block but the last ends on a sync flush, so the concatenation is
+# one valid deflate stream. RawEntryWriter writes such pre-compressed data as a regular zip entry,
+# and copy_raw_entry() uses it to move an entry from another archive across still compressed.
+# RawEntryWriter works on zipfile internals (RAW_WRITE_ATTRIBUTES); on a Python where one of them
+# is missing, entries are written through the public API instead (deflated on one thread, copied
+# entries inflated and deflated again). tests/test_compression.py checks the archives it writes.
+# @License: GPL 3.0
+###
+import time
+import zlib
+import shutil
+import struct
+import zipfile
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from mapped_zip import LOCAL_HEADER_SIZE, LOCAL_HEADER_SIGNATURE
+
+METHODS = {"deflate": zipfile.ZIP_DEFLATED, "stored": zipfile.ZIP_STORED}
+# zipfile's general purpose flag for sizes and CRC written after the data (non-seekable output)
+DATA_DESCRIPTOR_FLAG = 0x08
+DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+# the private parts of an archive RawEntryWriter and copy_raw_entry() use
+RAW_WRITE_ATTRIBUTES = ("_lock", "_writing", "_seekable", "_didModify", "_writecheck", "start_dir", "fp", "filelist", "NameToInfo")
+RAW_READ_ATTRIBUTES = ("_lock", "fp")
+
+
+def supports_raw_entries(zip_out, zip_ref=None):
+    # whether zip_out (and zip_ref, read from) have the internals for writing compressed bytes directly
+    if not hasattr(zipfile.ZipInfo, "FileHeader") or not all(hasattr(zip_out, name) for name in RAW_WRITE_ATTRIBUTES):
+        return False
+    return zip_ref is None or all(hasattr(zip_ref, name) for name in RAW_READ_ATTRIBUTES)
+
+
+class Compression:
+
+    def __init__(self, method="deflate", level=None, workers=1, block_size=1 << 20):
+        if method not in METHODS:
+            raise ValueError(f"Unknown compression method {method!r}, expected one of {', '.join(METHODS)}")
+        if level is not None and not 0 <= level <= 9:
+            raise ValueError(f"Compression level must be between 0 and 9, got {level}")
+        if workers < 1:
+            raise ValueError("Compression workers must be at least 1")
+        self.method = method
+        self.level = level
+        self.workers = workers
+        self.block_size = block_size
+
+    @property
+    def compress_type(self):
+        return METHODS[self.method]
+
+    @property
+    def parallel(self):
+        return self.workers > 1 and self.method == "deflate"
+
+    def describe(self):
+        text = self.method
+        if self.method == "deflate":
+            text += f" level {'default' if self.level is None else self.level}"
+            if self.parallel:
+                text += f" on {self.workers} threads"
+        return text
+
+    def open_zip(self, path):
+        # output archive whose writestr()/write() calls use these settings
+        return zipfile.ZipFile(path, 'w', self.compress_type, compresslevel=self.level)
+
+    def zip_info(self, arcname):
+        # entries written through zip_out.open() need their own timestamp and compression
+        info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+        info.compress_type = self.compress_type
+        info._compresslevel = self.level
+        return info
+
+    def write_file(self, zip_out, path, arcname):
+        # add a file from disk; large files are deflated block-parallel when workers > 1
+        if not self.parallel or not supports_raw_entries(zip_out):
+            zip_out.write(path, arcname)
+            return
+        info = zipfile.ZipInfo.from_file(path, arcname)
+        if info.file_size <= self.block_size:
+            zip_out.write(path, arcname)
+            return
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with open(path, 'rb') as f:
+            self.write_blocks(zip_out, info, iter(lambda: f.read(self.block_size), b""))
+
+    def write_blocks(self, zip_out, info, blocks):
+        # deflate the blocks of one entry on worker threads, at most two per worker in flight,
+        # and append the results to the entry in order
+        level = zlib.Z_DEFAULT_COMPRESSION if self.level is None else self.level
+        logging.debug(f"Deflating {info.filename} on {self.workers} threads")
+        crc = 0
+        file_size = 0
+        writer = RawEntryWriter(zip_out, info, zip64=info.file_size * 1.05 > zipfile.ZIP64_LIMIT)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                pending = deque()
+                previous = None
+                for block in blocks:
+                    if previous is not None:
+                        pending.append(pool.submit(deflate_block, previous, level, False))
+                    crc = zlib.crc32(block, crc)
+                    file_size += len(block)
+                    previous = block
+                    while len(pending) >= 2 * self.workers:
+                        writer.write(pending.popleft().result())
+                pending.append(pool.submit(deflate_block, previous or b"", level, True))
+                while pending:
+                    writer.write(pending.popleft().result())
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close(crc, file_size)
+
+
+def deflate_block(data, level, last):
+    # raw deflate (no zlib header, as zip stores it); non-final blocks end byte-aligned on a sync flush
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def copy_raw_entry(zip_ref, info, zip_out, arcname=None, chunk_size=1 << 20):
+    # copy an entry of zip_ref into zip_out as its compressed bytes: a new local header is written and
+    # the data is copied unchanged, with the CRC and sizes taken from the source's central directory
+    if info.flag_bits & 0x1:
+        raise ValueError(f"Can't copy encrypted entry {info.filename}")
+    logging.debug(f"Copying {info.filename} into the output without recompressing")
+    target = zipfile.ZipInfo(arcname or info.filename, date_time=info.date_time)
+    target.compress_type = info.compress_type
+    target.external_attr = info.external_attr
+    zip64 = max(info.file_size, info.compress_size) > zipfile.ZIP64_LIMIT
+    if not supports_raw_entries(zip_out, zip_ref):
+        logging.debug(f"Raw zip writes are not supported on this Python, recompressing {info.filename}")
+        with zip_ref.open(info) as source, zip_out.open(target, 'w', force_zip64=zip64) as dest:
+            shutil.copyfileobj(source, dest, chunk_size)
+        return target
+    writer = RawEntryWriter(zip_out, target, zip64=zip64)
+    try:
+        # zipfile's own readers seek before every read, so the shared handle can be used directly
+        with zip_ref._lock:
+            fp = zip_ref.fp
+            fp.seek(info.header_offset)
+            header = fp.read(LOCAL_HEADER_SIZE)
+            if len(header) != LOCAL_HEADER_SIZE or header[:4] != LOCAL_HEADER_SIGNATURE:
+                raise zipfile.BadZipFile(f"Bad local file header for {info.filename}")
+            name_length, extra_length = struct.unpack_from("<HH", header, 26)
+            fp.seek(name_length + extra_length, 1)
+            remaining = info.compress_size
+            while remaining:
+                chunk = fp.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise zipfile.BadZipFile(f"Entry {info.filename} runs past the end of the archive")
+                writer.write(chunk)
+                remaining -= len(chunk)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close(info.CRC, info.file_size)
+    return target
+
+
+class RawEntryWriter:
+    # writes already compressed data as an entry of zip_out. zipfile only compresses on its own, so
+    # this mirrors ZipFile._open_to_write() and _ZipWriteFile.close() on the archive's internals;
+    # info needs filename, date_time and compress_type, close() supplies the CRC and size
+
+    def __init__(self, zip_out, info, zip64=False):
+        self.zip_out = zip_out
+        self.info = info
+        self.zip64 = zip64
+        self.compress_size = 0
+        with zip_out._lock:
+            if zip_out._writing:
+                raise ValueError("Can't write to the ZIP file while there is another write handle open on it.")
+            info.CRC = 0
+            info.compress_size = 0
+            info.flag_bits = 0 if zip_out._seekable else DATA_DESCRIPTOR_FLAG
+            if not info.external_attr:
+                info.external_attr = 0o600 << 16
+            if zip_out._seekable:
+                zip_out.fp.seek(zip_out.start_dir)
+            info.header_offset = zip_out.fp.tell()
+            zip_out._writecheck(info)
+            zip_out._didModify = True
+            zip_out.fp.write(info.FileHeader(zip64))
+            zip_out._writing = True
+
+    def write(self, data):
+        self.zip_out.fp.write(data)
+        self.compress_size += len(data)
+
+    def close(self, crc, file_size):
+        zip_out = self.zip_out
+        info = self.info
+        try:
+            info.CRC = crc
+            info.file_size = file_size
+            info.compress_size = self.compress_size
+            if not self.zip64 and max(file_size, self.compress_size) > zipfile.ZIP64_LIMIT:
+                raise zipfile.LargeZipFile(f"{info.filename} needs ZIP64 extensions")
+            if info.flag_bits & DATA_DESCRIPTOR_FLAG:
+                fmt = '<LLQQ' if self.zip64 else '<LLLL'
+                zip_out.fp.write(struct.pack(fmt, DATA_DESCRIPTOR_SIGNATURE, crc, self.compress_size, file_size))
+                zip_out.start_dir = zip_out.fp.tell()
+            else:
+                # rewrite the local header now that the CRC and sizes are known
+                zip_out.start_dir = zip_out.fp.tell()
+                zip_out.fp.seek(info.header_offset)
+                zip_out.fp.write(info.FileHeader(self.zip64))
+                zip_out.fp.seek(zip_out.start_dir)
+            zip_out.filelist.append(info)
+            zip_out.NameToInfo[info.filename] = info
+        finally:
+            zip_out._writing = False
+
+    def abort(self):
+        # leave the archive writable; the partial entry is not listed in the central directory
+        self.zip_out._writing = False
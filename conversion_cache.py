@@ -0,0 +1,210 @@
+###
+# conversion_cache.py
+# On-disk, size-bounded LRU cache of converted Prusa model parts.
+# Entries are keyed by the input .model entry plus the converter version and a variant string that
+# covers anything else that changes the output. Re-uploaded projects and shared library parts
+# then skip the parse/rewrite/serialize work entirely. A file is keyed by the sha256 of its bytes.
+# An archive entry is looked up by its zip CRC32 and size, but those are only a pre-filter (CRC32
+# collisions are easy to make, and the service shares one cache between uploads): its entries also
+# carry the blake2b digest of the input, taken while the input streams through the converter, and a
+# candidate is only used once the entry's own digest matches.
+# @License: GPL 3.0
+###
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+
+# bump whenever the converted model output changes so stale entries are never reused
+CONVERTER_VERSION = "2"
+
+
+def entry_digest(source):
+    # blake2b of everything left in a binary file object
+    digest = hashlib.blake2b(digest_size=32)
+    for block in iter(lambda: source.read(1 << 20), b""):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+class ConversionCache:
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def key_for_entry(self, info, variant=""):
+        # the zip already carries a CRC32 and the size of every entry; the key is only a pre-filter,
+        # entries stored under it are told apart by their digest (see get() and DigestReader)
+        return self._key(f"crc32-{info.CRC:08x}-{info.file_size}", variant)
+
+    def key_for_file(self, path, variant=""):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return self._key(f"sha256-{digest.hexdigest()}", variant)
+
+    def _key(self, content, variant):
+        suffix = hashlib.sha1(variant.encode("utf-8")).hexdigest()[:12] if variant else "default"
+        return f"v{CONVERTER_VERSION}-{content}-{suffix}"
+
+    def _path(self, key, digest=None):
+        if digest is not None:
+            key = f"{key}-{digest}"
+        return os.path.join(self.directory, key + ".model")
+
+    def get(self, key, open_source=None):
+        # returns the path of the cached converted model, or None on a miss. For a key_for_entry()
+        # key, open_source() opens the input entry: when entries are stored under the key, the input
+        # is hashed and only the entry with its digest is used
+        digest = None
+        if open_source is not None:
+            prefix = f"{key}-"
+            with os.scandir(self.directory) as it:
+                candidate = any(entry.name.startswith(prefix) and entry.name.endswith(".model") for entry in it)
+            if not candidate:
+                return self._miss(key)
+            with open_source() as source:
+                digest = entry_digest(source)
+        path = self._path(key, digest)
+        try:
+            # refresh the timestamp so the entry counts as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return self._miss(key)
+        self.hits += 1
+        logging.debug(f"Conversion cache hit: {key}")
+        return path
+
+    def _miss(self, key):
+        self.misses += 1
+        logging.debug(f"Conversion cache miss: {key}")
+        return None
+
+    def writer(self, key):
+        # file object for a new entry; call commit() once it has been completely written, or
+        # discard() if the conversion failed
+        return CacheWriter(self, key)
+
+    def store_file(self, key, path, digest=None):
+        # add an already converted model file to the cache; digest: the input's, for key_for_entry() keys
+        cache_file = self.writer(key)
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, cache_file.file)
+        cache_file.commit(digest)
+
+    def _commit(self, key, temp_path, digest=None):
+        os.replace(temp_path, self._path(key, digest))
+        self.stores += 1
+        self.evict()
+
+    def evict(self):
+        # remove least recently used entries until the cache fits in max_bytes
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".model"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "stores": self.stores, "evictions": self.evictions}
+
+
+class CacheWriter:
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        # written next to the final entry so the commit is an atomic rename
+        fd, self.temp_path = tempfile.mkstemp(dir=cache.directory, suffix=".tmp")
+        self.file = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def commit(self, digest=None):
+        # digest: the input's, for key_for_entry() keys
+        self.file.close()
+        self.cache._commit(self.key, self.temp_path, digest)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class TeeWriter:
+    # writes everything to two binary file objects, e.g. the output zip entry and a cache entry
+
+    def __init__(self, first, second):
+        self.first = first
+        self.second = second
+
+    def write(self, data):
+        self.second.write(data)
+        return self.first.write(data)
+
+    def flush(self):
+        self.first.flush()
+        self.second.flush()
+
+
+class DigestReader:
+    # binary file object hashing what is read from source, so a cache entry gets its input's digest
+    # without a second pass over the input
+
+    def __init__(self, source):
+        self.source = source
+        self.digest = hashlib.blake2b(digest_size=32)
+
+    @property
+    def name(self):
+        return getattr(self.source, "name", "stream")
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        self.digest.update(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def hexdigest(self):
+        # the digest of the whole input; whatever the converter left unread is hashed first
+        for block in iter(lambda: self.read(1 << 20), b""):
+            pass
+        return self.digest.hexdigest()
+
+    def close(self):
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
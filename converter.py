@@ -0,0 +1,851 @@
+###
+# converter.py
+# GUI-free conversion core for turning Bambu 3mf files into Prusa 3mf files.
+# Bambu2PrusaConverter holds the whole pipeline (unzip, model conversion, packaging);
+# the tkinter GUI in main_str.py and the command line in bambu2prusa.py are built on it.
+# @License: GPL 3.0
+###
+import io
+import os
+import shutil
+import fnmatch
+import zipfile
+import time
+import logging
+import contextlib
+import lxml.etree as ET
+from pathlib import Path
+from templates import templates
+from conversion_cache import TeeWriter, DigestReader
+from instrumentation import NO_INSTRUMENTATION
+from selection import directory_entries
+from mapped_zip import MappedArchive
+from compression import Compression, copy_raw_entry
+from model_stream import BLOCK_SIZE, CORE_NS, DEFAULT_TRANSFORM, convert_model_stream
+from object_index import IndexedObject, LazyModel, build_object_index
+from layout import Layout
+from dedup import plan_deduplication, merge_transforms
+from limits import ResourceLimits
+from workspace import Workspace
+from validation import ValidationError, ValidationReport, append_report
+
+# templates live next to this file so conversions work from any working directory
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "3mf_template")
+
+
+class Bambu2PrusaConverter:
+
+    def __init__(self):
+        logging.debug("Initializing Bambu2PrusaConverter")
+        self.input_file = ""
+        self.output_file = ""
+
+        # Define paths for templates and directories
+        self.template_paths = {}
+        self.template_paths['models_template'] = os.path.join(TEMPLATE_DIR, "3D", "3dmodel_template.xml")
+        self.template_paths['3D'] = os.path.join(TEMPLATE_DIR, "3D", "")
+        self.template_paths['.rels_template'] = os.path.join(TEMPLATE_DIR, "_rels", ".rels_template.xml")
+        self.template_paths['.rels'] = os.path.join(TEMPLATE_DIR, "_rels", "")
+        self.template_paths['Content_Types_template'] = os.path.join(TEMPLATE_DIR, "[Content_Types].xml")
+        self.template_paths['Metadata'] = os.path.join(TEMPLATE_DIR, "Metadata", "")
+
+        # the current job's Workspace and the output tree inside it, both created on first use;
+        # zip-to-zip conversions rarely need them. Workspaces go in workspace_root, or on a tmpfs
+        # with workspace_in_memory, and are removed by cleanup()
+        self.workspace = None
+        self.workspace_root = None
+        self.workspace_in_memory = False
+        self._temp_3mf_dir = None
+        # convert zip-to-zip without extracting to the temporary directory
+        self.zip_stream = True
+        # number of model files converted concurrently within one 3mf, on a "process" or "thread" pool
+        self.model_workers = 1
+        self.model_pool = "process"
+        # read STORED model entries from a memory map of the input instead of through zipfile
+        self.mmap_stored = True
+        # how the output archive is compressed (method, level, deflate threads)
+        self.compression = Compression()
+        # optional ConversionCache of converted model parts
+        self.cache = None
+        # receives per-stage measurements; the default does nothing
+        self.instrumentation = NO_INSTRUMENTATION
+        self.job_input = None
+        # optional ObjectSelection limiting the conversion to some objects/plates, and its
+        # per-model-file resolution for the current job
+        self.selection = None
+        self.object_filters = {}
+        # places the objects on the bed (None gives every object the default transform), and its
+        # build item transforms per model file for the current job
+        self.layout = Layout()
+        self.transforms = {}
+        # convert each distinct mesh once; its copies become further build items of the first one
+        self.deduplicate = False
+        # optional PreviousConversion whose unchanged model parts are copied instead of converted
+        # (zip-to-zip conversions only)
+        self.previous = None
+        # patterns of input entries (e.g. "Metadata/*.png") carried over into the output unchanged
+        self.passthrough = ()
+        # indent the models written by write_prusa_model; off, since re-indenting millions of
+        # triangles costs time and only makes the output larger
+        self.pretty_print = False
+        # size, entry count and parse memory limits every job is checked against (None for no limits)
+        self.limits = ResourceLimits()
+        # compare the counts read and written for every model file and fail the job when they differ;
+        # the report of each job is appended to report_file (JSON lines) when it is set
+        self.validate = True
+        self.report_file = None
+        self.validation = None
+
+        self.bambu_model_paths = []
+        #contains output object file names and the object ids within those files
+        self.prusa_model_paths = {}
+
+    @property
+    def temp_3mf_dir(self):
+        if self._temp_3mf_dir is None:
+            self._temp_3mf_dir = self.job_workspace().subdir("output")
+        return self._temp_3mf_dir
+
+    @temp_3mf_dir.setter
+    def temp_3mf_dir(self, path):
+        self._temp_3mf_dir = path
+
+    def job_workspace(self):
+        if self.workspace is None:
+            self.workspace = Workspace(self.workspace_root, self.workspace_in_memory)
+        return self.workspace
+
+    def stage(self, name, **fields):
+        # measurement block for one pipeline stage, tagged with the file being converted
+        return self.instrumentation.stage(name, input=self.job_input, **fields)
+
+    def set_status(self, text):
+        # status updates go to the log; the GUI overrides this to show them in its status label
+        logging.debug(f"Status: {text}")
+
+    def decompress_zip(self, input_file=None):
+        # Decompress the zip file to a temporary directory
+        logging.debug("Decompressing zip file")
+        if input_file == None:
+            input_file = self.input_file
+        # Check if input file is provided
+        if not input_file:
+            self.set_status("Please provide both input and output files.")
+            return
+        # Extract into the job's workspace, which cleanup() removes along with everything in it
+        tempdir = self.job_workspace().subdir("input")
+
+        # Unzip the input file
+        with self.stage("decompress", bytes_in=os.path.getsize(input_file)) as stage, zipfile.ZipFile(input_file, 'r') as zip_ref:
+            if self.limits is None:
+                zip_ref.extractall(tempdir)
+            else:
+                self.extract_limited(zip_ref, tempdir, os.path.basename(input_file))
+            stage.set(bytes_out=sum(info.file_size for info in zip_ref.infolist()), entries=len(zip_ref.infolist()))
+        # return the temporary directory path that contains the extracted files
+        return tempdir
+
+    def extract_limited(self, zip_ref, target_dir, name):
+        # extractall() with the resource limits: the declared sizes are checked first, then every
+        # entry is copied through a limited reader while the job total is kept
+        self.limits.check_archive(zip_ref.infolist(), name)
+        total = 0
+        for info in zip_ref.infolist():
+            # like extractall, absolute paths become relative and "." and ".." parts are dropped
+            parts = [part for part in info.filename.split("/") if part not in ("", ".", "..")]
+            if not parts:
+                continue
+            target = os.path.join(target_dir, *parts)
+            if info.is_dir():
+                os.makedirs(target, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with self.limits.reader(zip_ref.open(info), info.filename, parsed=False) as source, open(target, 'wb') as f:
+                while True:
+                    data = source.read(BLOCK_SIZE)
+                    if not data:
+                        break
+                    total += len(data)
+                    self.limits.check_total(total)
+                    f.write(data)
+            
+    def bambu3mf2prusa3mf(self, input_file=None, output_file=None, extracted_path=None):
+        logging.debug("Converting Bambu 3mf to Prusa 3mf")
+        # Check if input and output files are provided
+        try:
+            if input_file == None:
+                input_file = self.input_file
+            if output_file == None:
+                output_file = self.output_file
+
+            if not input_file or not output_file:
+                self.set_status("Please provide both input and output files.")
+                return False
+            if not self.convert(input_file, output_file, extracted_path):
+                return False
+            self.set_status(f"Output file created: {os.path.basename(output_file)}")
+            logging.info(f"Output file created: {os.path.basename(output_file)}")
+            return True
+        except Exception as e:
+            logging.error(f"An error occurred during processing: {e}")
+            self.set_status(f"Error: {e}")
+            return False
+        finally:
+            # Clean up the temporary directory
+            self.cleanup()
+
+    def convert(self, input_file, output_file, extracted_path=None):
+        # Runs the conversion and lets errors propagate; returns the names of the converted model files,
+        # which is empty when the input has none
+        self.job_input = input_file
+        self.validation = ValidationReport(input_file, output_file) if self.validate else None
+        target = output_file
+        if os.path.exists(output_file) and os.path.samefile(input_file, output_file):
+            # saving over the input: the input is still read while the output is written, so the
+            # output goes to a file beside it that replaces the input only once the job succeeded
+            output_file = os.path.join(os.path.dirname(os.path.abspath(target)), f".{os.path.basename(target)}.{os.getpid()}.part")
+        try:
+            with self.stage("job", output=target) as stage:
+                prusamodel_filenames = self.convert_models(input_file, output_file, extracted_path)
+                stage.set(models=len(prusamodel_filenames), bytes_out=os.path.getsize(output_file) if os.path.exists(output_file) else 0)
+            if prusamodel_filenames:
+                self.check_validation(output_file)
+                if output_file != target:
+                    os.replace(output_file, target)
+        finally:
+            if output_file != target and os.path.exists(output_file):
+                os.remove(output_file)
+        return prusamodel_filenames
+
+    def check_validation(self, output_file):
+        # report the current job and fail it, removing its output, when the output doesn't match the input
+        if self.validation is None:
+            return
+        with self.stage("validate", models=len(self.validation.models)) as stage:
+            problems = self.validation.problems()
+            stage.set(ok=not problems)
+            if self.report_file:
+                append_report(self.report_file, self.validation)
+        if problems:
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            raise ValidationError(f"The output doesn't match {os.path.basename(self.validation.input_file)}: {'; '.join(problems)}")
+
+    def validated(self, entry, stats):
+        # record a converted model file in the job's report; returns whether its output matches its input
+        if self.validation is None:
+            return True
+        return self.validation.add(entry, stats)
+
+    def record_reuse(self, entry, source):
+        if self.validation is not None:
+            self.validation.add_reused(entry, source)
+
+    def validation_failed(self, entry, message):
+        # a model file that could not be converted completely; errors the legacy pipeline only logs
+        if self.validation is not None:
+            self.validation.add_error(entry, message)
+
+    def convert_models(self, input_file, output_file, extracted_path=None):
+        #if we haven't specified an extracted path, stream the models straight from the input zip into the output zip
+        if extracted_path==None and self.zip_stream:
+            return self.convert_zip_stream(input_file, output_file)
+
+        #otherwise work from a decompressed copy of the input
+        if extracted_path==None:
+            extracted_path = self.decompress_zip(input_file)
+        objects_path = os.path.join(extracted_path,"3D","Objects")
+        # Check if the objects directory exists
+        if os.path.exists(objects_path):
+            # Parse all .model files
+            self.bambu_model_paths = list(Path(objects_path).rglob("*.model"))
+        if not self.bambu_model_paths:
+            logging.error("No model files found")
+            return []
+        if self.selection:
+            names, open_entry = directory_entries(extracted_path)
+            open_entry = self.limited_opener(open_entry)
+            self.object_filters = self.resolve_selection(names, open_entry)
+            self.bambu_model_paths = [path for path in self.bambu_model_paths if self.entry_name(extracted_path, path) in self.object_filters]
+        if self.layout is not None or self.deduplicate:
+            names, open_entry = directory_entries(extracted_path)
+            planned = self.plan_objects(names, self.limited_opener(open_entry), [self.entry_name(extracted_path, path) for path in self.bambu_model_paths])
+            self.bambu_model_paths = [path for path in self.bambu_model_paths if self.entry_name(extracted_path, path) in planned]
+
+        # Convert each model file to Prusa format in a single streaming pass
+        prusamodel_filenames = []
+        objects_dir = os.path.join(self.temp_3mf_dir, "3D", "Objects")
+        os.makedirs(objects_dir, exist_ok=True)
+        for bmodel_path in self.bambu_model_paths:
+            filename = os.path.basename(bmodel_path)
+            pmodel_path = os.path.join(objects_dir, filename)
+            entry_name = self.entry_name(extracted_path, bmodel_path)
+            object_filter = self.object_filter(entry_name)
+            transforms = self.transforms.get(entry_name)
+            cache_key = self.cache.key_for_file(bmodel_path, self.cache_variant(object_filter, transforms)) if self.cache is not None else None
+            cached_path = self.cache.get(cache_key) if cache_key is not None else None
+            with self.stage("convert_model", entry=filename, bytes_in=os.path.getsize(bmodel_path), cached=cached_path is not None) as stage:
+                if cached_path is not None:
+                    shutil.copyfile(cached_path, pmodel_path)
+                    self.record_reuse(entry_name, "cache")
+                else:
+                    stats = {}
+                    with open(bmodel_path, 'rb') as f:
+                        source = f if self.limits is None else self.limits.reader(f, entry_name)
+                        convert_model_stream(source, pmodel_path, self.template_paths['models_template'], stats, object_filter, transforms)
+                    stage.set(**stats)
+                    # only outputs that passed validation go into the cache
+                    if self.validated(entry_name, stats) and cache_key is not None:
+                        self.cache.store_file(cache_key, pmodel_path)
+                stage.set(bytes_out=os.path.getsize(pmodel_path))
+            prusamodel_filenames.append(filename)
+
+        # carried over entries are copied next to the converted models and zipped with them
+        names = directory_entries(extracted_path)[0] if self.passthrough else []
+        for name in self.passthrough_names(names):
+            target = os.path.join(self.temp_3mf_dir, *name.split("/"))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(os.path.join(extracted_path, *name.split("/")), target)
+
+        # Write the final Prusa model files
+        self.generate3mf_file(prusamodel_filenames, output_file)
+        return prusamodel_filenames
+
+    def convert_zip_stream(self, input_file, output_file):
+        logging.debug("Streaming Bambu 3mf entries into Prusa 3mf")
+        # Model entries are read from the input zip, converted as they stream and written straight
+        # into the output zip, so nothing is extracted to or re-read from disk
+        with zipfile.ZipFile(input_file, 'r') as zip_ref, MappedArchive(input_file) as archive, self.open_previous(output_file):
+            model_infos = [info for info in zip_ref.infolist() if info.filename.startswith("3D/Objects/") and info.filename.endswith(".model")]
+            if not model_infos:
+                logging.error("No model files found")
+                return []
+            # declared sizes are checked before anything is inflated; entries are read through
+            # limited readers from here on
+            if self.limits is not None:
+                self.limits.check_archive(zip_ref.infolist(), os.path.basename(input_file))
+            open_entry = self.limited_opener(zip_ref.open)
+            if self.selection:
+                # only model entries holding a selected object are read at all
+                self.object_filters = self.resolve_selection(zip_ref.namelist(), open_entry)
+                model_infos = [info for info in model_infos if info.filename in self.object_filters]
+            if self.layout is not None or self.deduplicate:
+                planned = self.plan_objects(zip_ref.namelist(), open_entry, [info.filename for info in model_infos])
+                model_infos = [info for info in model_infos if info.filename in planned]
+            if self.previous is not None:
+                self.previous.variants = self.plan_previous()
+            prusamodel_filenames = []
+            try:
+                with self.compression.open_zip(output_file) as zip_out, self.template_archive() as template_zip:
+                    copy_raw_entry(template_zip, template_zip.getinfo("[Content_Types].xml"), zip_out)
+                    if self.model_workers > 1 and len(model_infos) > 1:
+                        prusamodel_filenames = self.convert_models_parallel(input_file, zip_ref, model_infos, zip_out)
+                    else:
+                        for info in model_infos:
+                            filename = os.path.basename(info.filename)
+                            self.stream_model_entry(zip_ref, info, zip_out, f"3D/Objects/{filename}", archive)
+                            prusamodel_filenames.append(filename)
+                    self.write_package_parts(zip_out, prusamodel_filenames, template_zip)
+                    self.copy_passthrough(zip_ref, zip_out)
+            except Exception:
+                # don't leave a half-written archive behind
+                if os.path.exists(output_file):
+                    os.remove(output_file)
+                raise
+            if self.previous is not None:
+                logging.info(f"Reused {self.previous.reused} entries of {self.previous.output_file}")
+        logging.info(f"Streamed {len(prusamodel_filenames)} models into {output_file}")
+        return prusamodel_filenames
+
+    def open_previous(self, output_file):
+        # the previous conversion is read while the new output is written, so they can't be the same file
+        if self.previous is None:
+            return contextlib.nullcontext()
+        # a deduplicated model file holds the build items of copies in other files, so it can't be
+        # reused just because its own input entry is unchanged
+        if self.deduplicate:
+            raise ValueError("Deduplication can't be combined with an incremental conversion")
+        if os.path.exists(output_file) and os.path.samefile(output_file, self.previous.output_file):
+            raise ValueError("The previous output can't be overwritten by the incremental conversion")
+        return self.previous
+
+    def plan_previous(self):
+        # {model entry: variant} the previous input gets with this job's settings. Build item
+        # transforms come from 3D/3dmodel.model and the layout of every object, so an entry whose own
+        # bytes are unchanged is only reused when its selection and transforms are unchanged too
+        zip_ref = self.previous.input_zip
+        names = zip_ref.namelist()
+        open_entry = self.limited_opener(zip_ref.open)
+        model_entries = [name for name in names if name.startswith("3D/Objects/") and name.endswith(".model")]
+        current = (self.object_filters, self.transforms)
+        try:
+            with self.stage("plan_previous", models=len(model_entries)):
+                if self.selection:
+                    self.object_filters = self.selection.resolve(names, open_entry)
+                    model_entries = [entry for entry in model_entries if entry in self.object_filters]
+                self.transforms = {}
+                if self.layout is not None:
+                    model_entries = self.plan_objects(names, open_entry, model_entries)
+                return {entry: self.cache_variant(self.object_filter(entry), self.transforms.get(entry)) for entry in model_entries}
+        finally:
+            self.object_filters, self.transforms = current
+
+    def previous_entry(self, info, arcname):
+        # the previous output's entry to copy for info, or None when it has to be converted
+        if self.previous is None:
+            return None
+        return self.previous.converted_entry(info, arcname, self.cache_variant(self.object_filter(info.filename), self.transforms.get(info.filename)))
+
+    def stream_model_entry(self, zip_ref, info, zip_out, arcname, archive=None):
+        # convert one model entry straight into the output zip, reusing or filling the conversion cache
+        with self.stage("convert_model", entry=info.filename, bytes_in=info.file_size) as stage:
+            self._stream_model_entry(zip_ref, info, zip_out, arcname, stage, archive)
+            stage.set(bytes_out=zip_out.getinfo(arcname).file_size)
+
+    def _stream_model_entry(self, zip_ref, info, zip_out, arcname, stage, archive=None):
+        previous_info = self.previous_entry(info, arcname)
+        stage.set(reused=previous_info is not None)
+        if previous_info is not None:
+            self.previous.copy(previous_info, zip_out, arcname)
+            self.record_reuse(info.filename, "previous")
+            return
+        object_filter = self.object_filter(info.filename)
+        transforms = self.transforms.get(info.filename)
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key_for_entry(info, self.cache_variant(object_filter, transforms))
+            cached_path = self.cache.get(cache_key, lambda: self.limited_opener(zip_ref.open)(info))
+            stage.set(cached=cached_path is not None)
+            if cached_path is not None:
+                self.compression.write_file(zip_out, cached_path, arcname)
+                self.record_reuse(info.filename, "cache")
+                return
+        stats = {}
+        source = archive.open(zip_ref, info) if archive is not None and self.mmap_stored else zip_ref.open(info)
+        digest_source = None
+        if cache_key is not None:
+            # the cache entry is stored under the digest of the input
+            source = digest_source = DigestReader(source)
+        if self.limits is not None:
+            source = self.limits.reader(source, info.filename)
+        if self.compression.parallel:
+            # converted into a part file first, so that its blocks can be deflated concurrently
+            part_path = os.path.join(self.temp_3mf_dir, "part.model")
+            with source as bmodel, open(part_path, 'wb') as pmodel:
+                self.convert_entry(bmodel, pmodel, cache_key, object_filter, stats, transforms, info.filename, digest_source)
+            self.compression.write_file(zip_out, part_path, arcname)
+            os.remove(part_path)
+        else:
+            # the converted entry is about the size of the input one; zip64 must be chosen before writing
+            force_zip64 = info.file_size >= zipfile.ZIP64_LIMIT // 2
+            with source as bmodel, zip_out.open(self.zip_entry(arcname), 'w', force_zip64=force_zip64) as pmodel:
+                self.convert_entry(bmodel, pmodel, cache_key, object_filter, stats, transforms, info.filename, digest_source)
+        stage.set(**stats)
+
+    def convert_entry(self, bmodel, pmodel, cache_key, object_filter, stats, transforms=None, entry=None, digest_source=None):
+        # convert one model from bmodel into pmodel, filling the cache entry cache_key if there is one;
+        # the conversion is recorded in the job's report as entry. digest_source: the DigestReader under
+        # bmodel, for cache keys that need the input's digest
+        if cache_key is None:
+            convert_model_stream(bmodel, pmodel, self.template_paths['models_template'], stats, object_filter, transforms)
+            self.validated(entry, stats)
+            return
+        cache_file = self.cache.writer(cache_key)
+        try:
+            convert_model_stream(bmodel, TeeWriter(pmodel, cache_file), self.template_paths['models_template'], stats, object_filter, transforms)
+        except Exception:
+            cache_file.discard()
+            raise
+        # an output that failed validation is not kept for later jobs
+        if self.validated(entry, stats):
+            cache_file.commit(digest_source.hexdigest() if digest_source is not None else None)
+        else:
+            cache_file.discard()
+
+    def cache_variant(self, object_filter=None, transforms=None):
+        # everything besides the input entry that shapes a converted model goes into the cache key
+        variant = templates.read_bytes(self.template_paths['models_template']).decode("utf-8")
+        if object_filter is not None:
+            variant += "\nobjects:" + ",".join(sorted(object_filter))
+        if transforms:
+            variant += "\ntransforms:" + ";".join(f"{object_id}={','.join(values)}" for object_id, values in sorted(transforms.items()))
+        return variant
+
+    def plan_objects(self, names, open_entry, model_entries):
+        # build item transforms and, with deduplication, the objects to convert per model entry for
+        # the current job; returns the model entries that still have objects to convert. Layout and
+        # deduplication share one scan of each model entry
+        self.transforms = {}
+        indexes = {}
+
+        def index(entry, bounds=False):
+            if entry not in indexes:
+                with open_entry(entry) as f:
+                    indexes[entry] = build_object_index(f, bounds=bounds, digest=self.deduplicate)
+            return indexes[entry]
+
+        if self.layout is not None:
+            self.transforms = self.plan_layout(names, open_entry, model_entries, index)
+        if not self.deduplicate:
+            return model_entries
+        with self.stage("dedup", models=len(model_entries)) as stage:
+            keep, duplicates = plan_deduplication(model_entries, index, self.object_filters if self.selection else None)
+            merge_transforms(self.transforms, duplicates)
+            stage.set(objects=sum(len(ids) for ids in keep.values()), duplicates=len(duplicates))
+        # duplicates are left out like unselected objects
+        self.object_filters = keep
+        return [entry for entry in model_entries if keep[entry]]
+
+    def plan_layout(self, names, open_entry, model_entries, index=None):
+        # build item transforms per model entry for the current job
+        with self.stage("layout", models=len(model_entries)) as stage:
+            plan = self.layout.plan(names, open_entry, model_entries, self.object_filters if self.selection else None, index)
+            stage.set(objects=sum(len(ids) for ids in plan.values()))
+        return plan
+
+    def resolve_selection(self, names, open_entry):
+        # {model entry name: object ids to keep}; an empty result means nothing can be converted
+        object_filters = self.selection.resolve(names, open_entry)
+        if not object_filters:
+            raise ValueError(f"No objects match the selection ({self.selection.describe()})")
+        return object_filters
+
+    def limited_opener(self, open_entry):
+        # open_entry(name) reading through the resource limits
+        if self.limits is None:
+            return open_entry
+        return self.limits.opener(open_entry)
+
+    def object_filter(self, entry_name):
+        # ids to keep from one model entry, or None to keep every object
+        if not self.selection and not self.deduplicate:
+            return None
+        return self.object_filters.get(entry_name)
+
+    def entry_name(self, root, path):
+        return os.path.relpath(path, root).replace(os.sep, "/")
+
+    def convert_models_parallel(self, input_file, zip_ref, model_infos, zip_out):
+        logging.debug(f"Converting {len(model_infos)} model files on {self.model_workers} {self.model_pool} workers")
+        # Each worker converts one model entry into its own file in the temporary directory; the results
+        # are added to the output zip in input order as they complete, so the archive and the rels stay deterministic
+        objects_dir = os.path.join(self.temp_3mf_dir, "3D", "Objects")
+        os.makedirs(objects_dir, exist_ok=True)
+        # imported here: concurrent.futures.process pulls in multiprocessing, which single-worker runs never need
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        pool_class = ProcessPoolExecutor if self.model_pool == "process" else ThreadPoolExecutor
+        prusamodel_filenames = []
+        with pool_class(max_workers=self.model_workers) as pool:
+            jobs = []
+            for index, info in enumerate(model_infos):
+                # parts unchanged since the previous conversion or already in the conversion cache
+                # are not sent to the pool at all
+                filename = os.path.basename(info.filename)
+                previous_info = self.previous_entry(info, f"3D/Objects/{filename}")
+                if previous_info is not None:
+                    jobs.append((info, None, None, previous_info, None))
+                    continue
+                object_filter = self.object_filter(info.filename)
+                transforms = self.transforms.get(info.filename)
+                cache_key = self.cache.key_for_entry(info, self.cache_variant(object_filter, transforms)) if self.cache is not None else None
+                cached_path = self.cache.get(cache_key, lambda: self.limited_opener(zip_ref.open)(info)) if cache_key is not None else None
+                if cached_path is not None:
+                    jobs.append((info, cache_key, cached_path, None, None))
+                    continue
+                # the index keeps parts with the same basename from different folders apart
+                part_path = os.path.join(objects_dir, f"{index}_{filename}")
+                jobs.append((info, cache_key, None, None, pool.submit(convert_model_entry, input_file, info.filename, part_path, self.template_paths['models_template'], object_filter, self.mmap_stored, transforms, self.limits, cache_key is not None)))
+            for info, cache_key, cached_path, previous_info, future in jobs:
+                filename = os.path.basename(info.filename)
+                if previous_info is not None:
+                    self.previous.copy(previous_info, zip_out, f"3D/Objects/{filename}")
+                    self.record_reuse(info.filename, "previous")
+                    self.instrumentation.record("convert_model", input=self.job_input, entry=info.filename, bytes_in=info.file_size, reused=True)
+                elif cached_path is not None:
+                    self.compression.write_file(zip_out, cached_path, f"3D/Objects/{filename}")
+                    self.record_reuse(info.filename, "cache")
+                    self.instrumentation.record("convert_model", input=self.job_input, entry=info.filename, bytes_in=info.file_size, cached=True)
+                else:
+                    part_path, stats, wall_s, digest = future.result()
+                    # the conversion ran in a worker, so its own timing is reported
+                    self.instrumentation.record("convert_model", input=self.job_input, entry=info.filename, bytes_in=info.file_size,
+                                                bytes_out=os.path.getsize(part_path), wall_s=wall_s, worker=self.model_pool, **stats)
+                    self.compression.write_file(zip_out, part_path, f"3D/Objects/{filename}")
+                    if self.validated(info.filename, stats) and cache_key is not None:
+                        self.cache.store_file(cache_key, part_path, digest)
+                    os.remove(part_path)
+                prusamodel_filenames.append(filename)
+        return prusamodel_filenames
+
+    def write_package_parts(self, zip_out, final_prusamodels, template_zip):
+        logging.debug("Writing 3mf package parts into zip")
+        with self.stage("package", models=len(final_prusamodels)):
+            self._write_package_parts(zip_out, final_prusamodels, template_zip)
+
+    def _write_package_parts(self, zip_out, final_prusamodels, template_zip):
+        ###--_rels/.rels---###
+        # an incremental conversion keeps the previous relationships unless the model files changed
+        if self.previous is None or not self.previous.copy_rels(zip_out, final_prusamodels):
+            with zip_out.open(self.zip_entry("_rels/.rels"), 'w') as rels_file:
+                self.build_rels(final_prusamodels).write(rels_file, encoding='utf-8', xml_declaration=True, pretty_print=True)
+        # Add the Metadata files if they exist, already compressed in the template archive
+        for info in template_zip.infolist():
+            if info.filename.startswith("Metadata/"):
+                copy_raw_entry(template_zip, info, zip_out)
+
+    def template_archive(self):
+        # [Content_Types].xml and the Metadata templates, compressed once per process with this
+        # conversion's settings instead of once per output
+        entries = [("[Content_Types].xml", self.template_paths['Content_Types_template'], "content_types")]
+        entries += [(f"Metadata/{file}", os.path.join(self.template_paths['Metadata'], file), None) for file in templates.listdir(self.template_paths['Metadata'])]
+        return zipfile.ZipFile(io.BytesIO(templates.archive(entries, self.compression)))
+
+    def passthrough_names(self, names):
+        # input entries matching the passthrough patterns
+        return [name for name in names if any(fnmatch.fnmatchcase(name, pattern) for pattern in self.passthrough)]
+
+    def copy_passthrough(self, zip_ref, zip_out):
+        # carry input entries such as thumbnails and textures over as their compressed bytes; entries
+        # the conversion wrote itself are not replaced
+        names = [name for name in self.passthrough_names(zip_ref.namelist()) if name not in zip_out.NameToInfo]
+        if not names:
+            return
+        with self.stage("passthrough", entries=len(names)) as stage:
+            copied = 0
+            for name in names:
+                copied += copy_raw_entry(zip_ref, zip_ref.getinfo(name), zip_out).compress_size
+            stage.set(bytes_in=copied, bytes_out=copied)
+
+    def zip_entry(self, arcname):
+        return self.compression.zip_info(arcname)
+
+    def build_rels(self, final_prusamodels):
+        # Create the relationships file with one relationship per model
+        rels_ET = templates.rels_copy(self.template_paths['.rels_template'])
+        rels_tree = rels_ET.getroot()
+        relationship_number = 1
+        for model in final_prusamodels:
+            # Add a relationship for the model
+            rel = ET.fromstring(f'<Relationship Target="/3D/Objects/{model}" Id="rel-{relationship_number}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/3dmodel"/>')
+            relationship_number += 1
+            rels_tree.append(rel)
+        return rels_ET
+
+    def model_convert_re(self, bmodel_path):
+        logging.debug(f"Processing model file: {bmodel_path}")
+        # Check if the file exists
+        if not os.path.exists(bmodel_path):
+            logging.error(f"File not found: {bmodel_path}")
+            return None, None
+        
+        relevant_objects = {}
+        # index the bambu model file; objects are only parsed and converted when they are written
+        try:
+            #scan the model file in a single forward pass, keeping only the objects of type "model";
+            #these are the only object types that are allowed in prusa format
+            logging.debug("Indexing XML content")
+            for indexed in build_object_index(str(bmodel_path)):
+                logging.debug(f"Object type {indexed.object_type} | id {indexed.object_id}: ")
+                if indexed.object_type == "model":
+                    relevant_objects[indexed.object_id] = indexed
+
+        except FileNotFoundError:
+            logging.error(f"Error: File '{bmodel_path}' not found.")
+            return
+        except Exception as e:
+            logging.error(f"An error occurred: {e}")
+            # the objects after the error are missing, so the job fails validation
+            self.validation_failed(os.path.basename(bmodel_path), f"indexing failed: {e}")
+
+        # take only the basename of the bmodel_path to use as the filename in the prusa model
+        model_filename = os.path.basename(bmodel_path)
+
+        return model_filename, relevant_objects
+        
+    def inject_bobject2pobject(self, bobjects, transforms=None):
+        logging.debug("Injecting Bambu objects into Prusa model template")
+        if not bobjects:
+            logging.warning("No objects to inject into the template. Will use empty template.")
+        #inject object into template file
+        try:
+            logging.debug("Injecting objects into the Prusa model template")
+            #take a private copy of the cached template
+            model = templates.model_copy(self.template_paths['models_template'])
+            resources = model.find("{*}resources")
+            build = model.find("{*}build")
+            # add a build item per object; indexed objects stay in the index until the model is written,
+            # objects given as elements are appended to the tree directly
+            indexed_objects = []
+            with self.stage("inject", objects=len(bobjects or {})):
+                for bobject in bobjects:
+                    logging.debug(f"Adding object {bobject} to the model")
+                    if isinstance(bobjects[bobject], IndexedObject):
+                        indexed_objects.append(bobjects[bobject])
+                    else:
+                        resources.append(bobjects[bobject])
+                    # transforms: build item transforms per object id, as planned by the layout
+                    for transform in (transforms or {}).get(bobject) or [DEFAULT_TRANSFORM]:
+                        ET.SubElement(build, f"{{{CORE_NS}}}item", objectid=bobject, transform=transform, printable="1")
+            return LazyModel(model, indexed_objects)
+
+        except FileNotFoundError as e:
+            logging.error(f"Error: File '{self.template_paths['models_template']}' not found.")
+            self.set_status(f"Error reading {self.template_paths['models_template']}: {e}")
+            return
+        except Exception as e:
+            logging.error(f"An error occurred: {e}")
+
+    def compress_zip(self, ifolder_path, output_file=None):
+        logging.debug("Compressing files into zip")
+        # Check if the input folder path is provided
+        if not ifolder_path:
+            self.set_status("No input folder provided for compression.")
+            return
+        if output_file is None:
+            output_file = self.output_file
+        # Re-zip contents into the output file
+        with self.stage("compress", compression=self.compression.describe()) as stage, self.compression.open_zip(output_file) as zip_out:
+            for foldername, subfolders, filenames in os.walk(ifolder_path):
+                for filename in filenames:
+                    file_path = os.path.join(foldername, filename)
+                    arcname = os.path.relpath(file_path, ifolder_path)
+                    self.compression.write_file(zip_out, file_path, arcname)
+            stage.set(entries=len(zip_out.filelist), bytes_in=sum(info.file_size for info in zip_out.filelist), bytes_out=sum(info.compress_size for info in zip_out.filelist))
+        logging.info(f"Compressed files into {output_file}")
+        self.set_status(f"Output file created: {os.path.basename(output_file)}")
+
+    def write_prusa_model(self, filename, prusa_model, zip_out=None):
+        logging.debug("Writing Prusa object")
+        # The model is serialized incrementally with lxml xmlfile: header and metadata, then each
+        # object, then the build, into the temporary directory or, given zip_out, straight into
+        # the output zip; the whole document is never held in memory as one string
+        try:
+            ###--3D/Objects/3dmodel.xml---###
+            if prusa_model == None or prusa_model == []:
+                logging.warning("Prusa model is empty, writing empty object.")
+                #return
+            if not isinstance(prusa_model, LazyModel):
+                # a plain model tree, e.g. from an older caller, is written the same way
+                root = prusa_model.getroot() if hasattr(prusa_model, "getroot") else prusa_model
+                prusa_model = LazyModel(root, [])
+            # the counts read and written are taken while the model is written
+            stats = {}
+            with self.stage("write", entry=filename) as stage:
+                if zip_out is not None:
+                    arcname = f"3D/Objects/{filename}"
+                    # the written model is about the size of the indexed objects; zip64 must be chosen before writing
+                    force_zip64 = sum(indexed.end - indexed.start for indexed in prusa_model.objects) >= zipfile.ZIP64_LIMIT // 2
+                    with zip_out.open(self.zip_entry(arcname), 'w', force_zip64=force_zip64) as f:
+                        # objects are parsed from the input one at a time as they are written
+                        prusa_model.write(f, pretty_print=self.pretty_print, stats=stats)
+                    stage.set(bytes_out=zip_out.getinfo(arcname).file_size)
+                else:
+                    # Create the 3D Objects directory and write the model file into it
+                    objects_dir = os.path.join(self.temp_3mf_dir, "3D", "Objects")
+                    os.makedirs(objects_dir, exist_ok=True)
+                    model_path = os.path.join(objects_dir, filename)
+                    prusa_model.write(model_path, pretty_print=self.pretty_print, stats=stats)
+                    stage.set(bytes_out=os.path.getsize(model_path))
+                stage.set(**stats)
+            self.validated(filename, stats)
+        except Exception as e:
+            logging.error(f"An error occurred while writing Prusa object: {e}")
+            self.validation_failed(filename, f"writing failed: {e}")
+
+    def generate3mf_file(self, final_prusamodels, output_file=None):
+        logging.debug("Generating 3mf file structure")
+        # Check if the output file is provided
+        if output_file is None:
+            output_file = self.output_file
+        if not output_file:
+            self.set_status("Please provide an output file.")
+            return
+        # Check if there are any models to generate the 3mf file structure
+        if not final_prusamodels:
+            logging.error("No models to generate 3mf file structure.")
+            self.set_status("No models to generate 3mf file structure.")
+            return
+        try:
+            # Create the temporary directory for the 3mf file structure
+            self.set_status("Generating 3mf file structure...")
+            tempdir = self.temp_3mf_dir
+            # Create the necessary directories
+            rels_dir = os.path.join(tempdir, "_rels")
+            os.makedirs(rels_dir, exist_ok=True)
+            metadata_dir = os.path.join(tempdir, "Metadata")
+            os.makedirs(metadata_dir, exist_ok=True)
+
+
+            ###--[Content-Types].xml---###
+            # Copy the template files to the output directory
+            with open(os.path.join(tempdir, "[Content_Types].xml"), 'wb') as f:
+                f.write(templates.read_bytes(self.template_paths['Content_Types_template'], "content_types"))
+
+
+            ###--_rels/.rels---###
+            # Create the relationships file
+            rels_ET = self.build_rels(final_prusamodels)
+            # Write the relationships file
+            rels_path = os.path.join(rels_dir, ".rels")
+            rels_ET.write(rels_path, encoding='utf-8', xml_declaration=True, pretty_print=True)
+
+            # Add the Metadata files if they exist
+            for file in templates.listdir(self.template_paths['Metadata']):
+                with open(os.path.join(tempdir, "Metadata", file), 'wb') as f:
+                    f.write(templates.read_bytes(os.path.join(self.template_paths['Metadata'], file)))
+
+            self.compress_zip(tempdir, output_file)
+        except Exception as e:
+            logging.error(f"An error occurred while generating 3mf file structure: {e}")
+
+    def cleanup(self):
+        logging.debug("Cleaning up temporary files")
+        # Clear the temporary directory and reset the model paths
+        self.bambu_model_paths = []
+        self.prusa_model_paths = {}
+        self.transforms = {}
+        # Clean up the temporary directory and the job's workspace; the next conversion creates
+        # new ones when it needs them
+        if self._temp_3mf_dir is not None and os.path.exists(self._temp_3mf_dir):
+            shutil.rmtree(self._temp_3mf_dir)
+        self._temp_3mf_dir = None
+        if self.workspace is not None:
+            self.workspace.close()
+            self.workspace = None
+        self.set_status("Temporary files cleaned up.")
+
+
+def convert_model_entry(input_file, entry_name, output_path, template_path, object_filter=None, mmap_stored=True, transforms=None, limits=None, digest=False):
+    # convert one model entry of a 3mf into a standalone Prusa model file; runs in a pool worker,
+    # which opens its own handle on the input zip. With digest, the blake2b digest of the input
+    # entry is returned as well (for the conversion cache), otherwise None
+    start = time.perf_counter()
+    stats = {}
+    with zipfile.ZipFile(input_file, 'r') as zip_ref, MappedArchive(input_file) as archive:
+        info = zip_ref.getinfo(entry_name)
+        source = digest_source = archive.open(zip_ref, info) if mmap_stored else zip_ref.open(info)
+        if digest:
+            source = digest_source = DigestReader(source)
+        if limits is not None:
+            source = limits.reader(source, entry_name)
+        with source as bmodel:
+            convert_model_stream(bmodel, output_path, template_path, stats, object_filter, transforms)
+            digest = digest_source.hexdigest() if digest else None
+    return output_path, stats, round(time.perf_counter() - start, 6), digest
+
+
+def convert_file(input_file, output_file, **settings):
+    # convert a single file without any GUI; raises on failure so callers can report it.
+    # settings are converter attributes, e.g. model_workers=4 or cache=ConversionCache(...)
+    converter = Bambu2PrusaConverter()
+    for name, value in settings.items():
+        if not hasattr(converter, name):
+            raise TypeError(f"Unknown conversion setting: {name}")
+        setattr(converter, name, value)
+    try:
+        prusamodel_filenames = converter.convert(input_file, output_file)
+    finally:
+        converter.cleanup()
+    if not prusamodel_filenames:
+        raise ValueError(f"No model files found in {input_file}")
+    return prusamodel_filenames
@@ -0,0 +1,51 @@
+###
+# dedup.py
+# Mesh deduplication across the model files of a project.
+# Bambu projects often hold the same mesh many times (40 copies of one earring, parts duplicated
+# across 3D/Objects/*.model). Every object is fingerprinted by the digest of its content in the
+# object index, i.e. its vertices and triangles (paint included) as written. Only the first object
+# with a given fingerprint is converted; the others are left out of the output and become extra
+# build items of that object, so PrusaSlicer shows them as instances of one mesh. Objects without
+# triangles (component assemblies, empty helpers) are never merged, since equal content doesn't
+# mean the same shape for them.
+# @License: GPL 3.0
+###
+import logging
+from model_stream import DEFAULT_TRANSFORM
+
+
+def plan_deduplication(model_entries, index, object_filters=None):
+    # index(entry): [IndexedObject, ...] of a model entry, with digests; object_filters: {entry: ids}
+    # or None for every object. returns ({entry: ids to convert}, {(entry, id): (entry, id) of the
+    # object that is converted in its place})
+    first = {}
+    keep = {}
+    duplicates = {}
+    for entry in model_entries:
+        ids = set()
+        for indexed in index(entry):
+            if indexed.object_type != "model":
+                continue
+            if object_filters is not None and indexed.object_id not in object_filters.get(entry, ()):
+                continue
+            if not indexed.triangles or indexed.digest is None:
+                ids.add(indexed.object_id)
+                continue
+            original = first.setdefault(indexed.digest, (entry, indexed.object_id))
+            if original == (entry, indexed.object_id):
+                ids.add(indexed.object_id)
+            else:
+                duplicates[(entry, indexed.object_id)] = original
+        keep[entry] = ids
+    logging.debug(f"Deduplication kept {sum(len(ids) for ids in keep.values())} objects, merged {len(duplicates)} copies")
+    return keep, duplicates
+
+
+def merge_transforms(transforms, duplicates):
+    # move the build items of every duplicate to the object converted in its place;
+    # transforms: {entry: {object id: [transform, ...]}}, changed in place
+    for (entry, object_id), (original_entry, original_id) in duplicates.items():
+        moved = transforms.get(entry, {}).pop(object_id, None) or [DEFAULT_TRANSFORM]
+        items = transforms.setdefault(original_entry, {}).setdefault(original_id, [DEFAULT_TRANSFORM])
+        items.extend(moved)
+    return transforms
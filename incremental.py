@@ -0,0 +1,89 @@
+###
+# incremental.py
+# Incremental re-conversion of an updated project.
+# A PreviousConversion is the input and output pair of an earlier conversion of the same project.
+# Model entries whose CRC and size are unchanged since that input are not converted again: the
+# converted entry is copied out of the previous output as raw compressed bytes (no inflate, no
+# deflate), and _rels/.rels is copied as well when the set of model files is the same. Only the
+# changed model files go through the converter. An entry is only reused when its variant (object
+# selection, build item transforms, template), planned for the previous input with the current
+# settings, is unchanged as well: moving an item in Bambu Studio only changes 3D/3dmodel.model, and
+# the automatic layout of one object depends on all the others. The previous output has to come
+# from the same settings; reused entries keep the compression they were written with.
+# @License: GPL 3.0
+###
+import os
+import zipfile
+import logging
+from compression import copy_raw_entry
+
+RELS = "_rels/.rels"
+
+
+class PreviousConversion:
+
+    def __init__(self, input_file, output_file):
+        self.input_file = input_file
+        self.output_file = output_file
+        # opened for the duration of one conversion, so the object can be pickled to pool workers
+        self.input_zip = None
+        self.output_zip = None
+        self.reused = 0
+        # {model entry: variant} of the previous input, set by the converter for the current job;
+        # None compares entry bytes only
+        self.variants = None
+
+    def __enter__(self):
+        logging.debug(f"Opening previous conversion {self.input_file} -> {self.output_file}")
+        try:
+            self.input_zip = zipfile.ZipFile(self.input_file, 'r')
+            self.output_zip = zipfile.ZipFile(self.output_file, 'r')
+        except BaseException:
+            self.close()
+            raise
+        self.reused = 0
+        self.variants = None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        for archive in (self.input_zip, self.output_zip):
+            if archive is not None:
+                archive.close()
+        self.input_zip = None
+        self.output_zip = None
+
+    def _getinfo(self, archive, name):
+        try:
+            return archive.getinfo(name)
+        except KeyError:
+            return None
+
+    def converted_entry(self, info, arcname, variant=None):
+        # the previous output's entry for arcname if the input entry and its variant are unchanged,
+        # otherwise None
+        before = self._getinfo(self.input_zip, info.filename)
+        if before is None or before.CRC != info.CRC or before.file_size != info.file_size:
+            return None
+        if self.variants is not None and self.variants.get(info.filename) != variant:
+            return None
+        return self._getinfo(self.output_zip, arcname)
+
+    def copy(self, previous_info, zip_out, arcname=None):
+        copy_raw_entry(self.output_zip, previous_info, zip_out, arcname)
+        self.reused += 1
+
+    def model_filenames(self):
+        return {os.path.basename(name) for name in self.output_zip.namelist() if name.startswith("3D/Objects/") and name.endswith(".model")}
+
+    def copy_rels(self, zip_out, final_prusamodels):
+        # reuse the previous relationships when they cover the same model files; returns False when
+        # they have to be regenerated
+        rels = self._getinfo(self.output_zip, RELS)
+        if rels is None or set(final_prusamodels) != self.model_filenames():
+            return False
+        self.copy(rels, zip_out)
+        return True
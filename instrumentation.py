@@ -0,0 +1,163 @@
+###
+# instrumentation.py
+# Structured per-stage measurements for the conversion pipeline.
+# The converter wraps decompress, per-model convert, inject, write and compress in
+# instrumentation.stage(...) blocks. The default Instrumentation does nothing (one shared
+# no-op object per stage), JsonLinesSink appends one JSON object per finished stage with wall
+# time, bytes in/out, object/triangle counts and RSS/tracemalloc peaks, and CallbackInstrumentation
+# hands the same records to a function.
+# @License: GPL 3.0
+###
+import os
+import sys
+import json
+import time
+import threading
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class _NullStage:
+    # returned by the no-op instrumentation; every method does nothing
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+NULL_STAGE = _NullStage()
+
+
+class Instrumentation:
+    # no-op default; subclasses override emit() to receive finished stage records
+
+    enabled = False
+
+    def stage(self, name, **fields):
+        return NULL_STAGE
+
+    def record(self, name, **fields):
+        # report a stage that was measured elsewhere, e.g. in a pool worker
+        pass
+
+    def emit(self, record):
+        pass
+
+
+class _Stage:
+
+    def __init__(self, instrumentation, name, fields):
+        self.instrumentation = instrumentation
+        self.record = {"stage": name}
+        self.record.update(fields)
+
+    def set(self, **fields):
+        # add counters that are only known once the stage has run, e.g. bytes_out or triangles
+        self.record.update(fields)
+
+    def __enter__(self):
+        if self.instrumentation.trace_memory:
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.record["wall_s"] = round(time.perf_counter() - self.start, 6)
+        self.record["ok"] = exc_type is None
+        if exc_type is not None:
+            self.record["error"] = f"{exc_type.__name__}: {exc}"
+        if self.instrumentation.trace_memory:
+            self.record["tracemalloc_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        self.record["rss_peak_mb"] = peak_rss_mb()
+        self.instrumentation.emit(self.record)
+        return False
+
+
+class RecordingInstrumentation(Instrumentation):
+    # base for instrumentation that measures stages; trace_memory turns on tracemalloc, which is
+    # precise for Python allocations but slows the conversion down noticeably
+
+    enabled = True
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stage(self, name, **fields):
+        return _Stage(self, name, fields)
+
+    def record(self, name, **fields):
+        record = {"stage": name}
+        record.update(fields)
+        record["rss_peak_mb"] = peak_rss_mb()
+        self.emit(record)
+
+
+class CallbackInstrumentation(RecordingInstrumentation):
+
+    def __init__(self, callback, trace_memory=False):
+        super().__init__(trace_memory)
+        self.callback = callback
+
+    def emit(self, record):
+        self.callback(record)
+
+
+class JsonLinesSink(RecordingInstrumentation):
+    # appends one JSON line per record; the file is opened lazily so the sink can be pickled into
+    # worker processes, and each line is a single append so processes can share one file
+
+    def __init__(self, path, trace_memory=False):
+        super().__init__(trace_memory)
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_lock"] = None
+        state["_fd"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def emit(self, record):
+        record.setdefault("time", round(time.time(), 3))
+        record.setdefault("pid", os.getpid())
+        line = (json.dumps(record, default=str) + "\n").encode("utf-8")
+        with self._lock:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            os.write(self._fd, line)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# shared default used by converters that were not given any instrumentation
+NO_INSTRUMENTATION = Instrumentation()
@@ -0,0 +1,227 @@
+###
+# layout.py
+# Build-plate layout of the converted objects.
+# Every object written to a Prusa model gets a build item, and a Layout decides its transform before
+# the conversion starts. Objects Bambu Studio already placed keep their place: the transform of the
+# component that references them in 3D/3dmodel.model is combined with the transform of the build item
+# of its top-level object, once per instance. The other objects are arranged on the bed. Their
+# bounding boxes come from a byte-level scan of the vertex coordinates (see object_index.py), and
+# they are packed on shelves, deepest first, each into the fullest shelf it still fits on. Sorting
+# and the shelf search are O(n log n), so hundreds of objects are placed at once; objects that don't
+# fit go on further beds to the right of the first. When Bambu placed some of the objects, the
+# footprints of those are kept free: a shelf is split around them, or moved past them.
+# @License: GPL 3.0
+###
+import bisect
+import logging
+import lxml.etree as ET
+from selection import MAIN_MODEL, MESH_ELEMENTS, read_components
+from model_stream import local_name, release
+from object_index import build_object_index
+
+IDENTITY = (1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0)
+# gap between beds when the objects need more than one
+BED_GAP = 20.0
+
+
+class Layout:
+
+    def __init__(self, bed_width=250.0, bed_depth=210.0, spacing=5.0, keep_transforms=True):
+        if bed_width <= 0 or bed_depth <= 0 or spacing < 0:
+            raise ValueError("Bed size must be positive and spacing not negative")
+        self.bed_width = bed_width
+        self.bed_depth = bed_depth
+        self.spacing = spacing
+        # use Bambu's build transforms for the objects it placed
+        self.keep_transforms = keep_transforms
+
+    def describe(self):
+        return f"{self.bed_width:g}x{self.bed_depth:g} bed, {self.spacing:g} spacing"
+
+    def plan(self, names, open_entry, model_entries, object_filters=None, index=None):
+        # names: entry names of the project; open_entry(name): binary file object for an entry;
+        # model_entries: the model files being converted; object_filters: {entry: ids} or None;
+        # index(entry, bounds): the entry's indexed objects, when the caller keeps them for reuse.
+        # returns {model entry name: {object id: [transform string, ...]}}; objects left out keep
+        # the default transform
+        if index is None:
+            indexes = {}
+
+            def index(entry, bounds):
+                if entry not in indexes:
+                    with open_entry(entry) as f:
+                        indexes[entry] = build_object_index(f, bounds=bounds)
+                return indexes[entry]
+
+        # {entry: {object id: [transform, ...]}} of the objects Bambu placed, and the entries holding
+        # objects the main model references without placing them
+        placed = {}
+        partly_placed = set()
+        if self.keep_transforms and MAIN_MODEL in names:
+            components = read_components(open_entry)
+            for (path, object_id), transforms in read_build_transforms(open_entry, components).items():
+                if path in model_entries:
+                    placed.setdefault(path, {})[object_id] = transforms
+            for parts in components.values():
+                for path, object_id, transform in parts:
+                    if path in placed and object_id not in placed[path]:
+                        partly_placed.add(path)
+        plan = {entry: {object_id: [format_transform(transform) for transform in transforms] for object_id, transforms in objects.items()}
+                for entry, objects in placed.items()}
+
+        def selected(entry, indexed):
+            if indexed.object_type != "model" or indexed.bounds is None:
+                return False
+            return object_filters is None or indexed.object_id in object_filters.get(entry, ())
+
+        # the objects of model files Bambu placed nothing or only part of from are arranged here
+        boxes = []
+        for entry in model_entries:
+            if entry in placed and entry not in partly_placed:
+                continue
+            for indexed in index(entry, bounds=True):
+                if indexed.object_id not in placed.get(entry, ()) and selected(entry, indexed):
+                    boxes.append((entry, indexed.object_id, indexed.bounds))
+        margin = self.spacing / 2
+        obstacles = []
+        if boxes:
+            for entry, objects in placed.items():
+                for indexed in index(entry, bounds=True):
+                    if indexed.object_id in objects and selected(entry, indexed):
+                        for transform in objects[indexed.object_id]:
+                            x0, y0, x1, y1 = footprint(indexed.bounds, transform)
+                            obstacles.append((x0 - margin, y0 - margin, x1 + margin, y1 + margin))
+        positions = self.pack([(bounds[3] - bounds[0], bounds[4] - bounds[1]) for entry, object_id, bounds in boxes], obstacles)
+        for (entry, object_id, bounds), (x, y) in zip(boxes, positions):
+            # the box's lower corner goes to its place on the bed and the object sits on the bed
+            translation = (x + margin - bounds[0], y + margin - bounds[1], -bounds[2])
+            plan.setdefault(entry, {})[object_id] = [format_transform(IDENTITY[:9] + translation)]
+        logging.debug(f"Layout ({self.describe()}) placed {len(boxes)} objects, kept Bambu's transforms for {sum(len(ids) for ids in plan.values()) - len(boxes)}")
+        return plan
+
+    def pack(self, sizes, obstacles=()):
+        # [(x, y)] lower corners for boxes of the given [(width, depth)], spacing included;
+        # obstacles: [(x0, y0, x1, y1)] areas of the first bed that are already taken
+        positions = [None] * len(sizes)
+        # (free width, shelf) for every open shelf, sorted so the fullest shelf that fits is found by bisection
+        free = []
+        shelf_x = []
+        shelf_y = []
+        bed = 0
+        bed_y = 0.0
+        for index in sorted(range(len(sizes)), key=lambda i: sizes[i][1], reverse=True):
+            width = sizes[index][0] + self.spacing
+            depth = sizes[index][1] + self.spacing
+            slot = bisect.bisect_left(free, (width, -1))
+            if slot < len(free):
+                room, shelf = free.pop(slot)
+                positions[index] = (shelf_x[shelf], shelf_y[shelf])
+                shelf_x[shelf] += width
+                bisect.insort(free, (room - width, shelf))
+                continue
+            # open a shelf; shelves are as deep as their first box, the deepest one they get. Where
+            # the row crosses obstacles it is split into a shelf per free segment
+            while True:
+                if bed_y > 0 and bed_y + depth > self.bed_depth:
+                    bed += 1
+                    bed_y = 0.0
+                blocking = [obstacle for obstacle in (obstacles if bed == 0 else ()) if obstacle[1] < bed_y + depth and obstacle[3] > bed_y]
+                segments = free_segments(self.bed_width, blocking)
+                fitting = [segment for segment in segments if segment[1] - segment[0] >= width]
+                if fitting or not blocking:
+                    break
+                # nothing fits beside the obstacles; try again above the lowest one
+                bed_y = min(obstacle[3] for obstacle in blocking)
+            first = fitting[0] if fitting else segments[0]
+            x = bed * (self.bed_width + BED_GAP)
+            positions[index] = (x + first[0], bed_y)
+            for start, end in segments:
+                if (start, end) == first:
+                    start += width
+                shelf = len(shelf_x)
+                shelf_x.append(x + start)
+                shelf_y.append(bed_y)
+                bisect.insort(free, (end - start, shelf))
+            bed_y += depth
+        return positions
+
+
+def free_segments(bed_width, obstacles):
+    # [(start, end)] of the bed's width left free by the x ranges of the obstacles, in order
+    segments = []
+    start = 0.0
+    for x0, y0, x1, y1 in sorted(obstacles):
+        if x0 > start:
+            segments.append((start, min(x0, bed_width)))
+        start = max(start, x1)
+        if start >= bed_width:
+            break
+    if start < bed_width:
+        segments.append((start, bed_width))
+    return [segment for segment in segments if segment[1] > segment[0]] or [(bed_width, bed_width)]
+
+
+def footprint(bounds, transform):
+    # (x0, y0, x1, y1) on the bed of a bounding box (x0, y0, z0, x1, y1, z1) moved by a transform
+    xs = []
+    ys = []
+    for x in (bounds[0], bounds[3]):
+        for y in (bounds[1], bounds[4]):
+            for z in (bounds[2], bounds[5]):
+                xs.append(x * transform[0] + y * transform[3] + z * transform[6] + transform[9])
+                ys.append(x * transform[1] + y * transform[4] + z * transform[7] + transform[10])
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def read_build_transforms(open_entry, components=None):
+    # {(model entry name, object id): [transform, ...]} for the objects Bambu placed, one transform
+    # per build item of the top-level object that references them; components: read_components()
+    # when the caller has them already
+    if components is None:
+        components = read_components(open_entry)
+    placed = {}
+    with open_entry(MAIN_MODEL) as f:
+        for event, elem in ET.iterparse(f, events=("end",), tag=("{*}item", "{*}object") + MESH_ELEMENTS, huge_tree=True):
+            if local_name(elem.tag) == "item":
+                item_transform = parse_transform(elem.get("transform"))
+                for path, object_id, transform in components.get(elem.get("objectid"), ()):
+                    placed.setdefault((path, object_id), []).append(compose(parse_transform(transform), item_transform))
+            release(elem)
+    return placed
+
+
+def parse_transform(text):
+    # 3mf transforms are 12 numbers, the 4x3 matrix row by row; missing means identity
+    if not text:
+        return IDENTITY
+    values = tuple(float(value) for value in text.split())
+    if len(values) != 12:
+        raise ValueError(f"Invalid transform {text!r}")
+    return values
+
+
+def compose(first, second):
+    # the transform applying first and then second; 3mf multiplies row vectors, so this is first x second
+    result = []
+    for row in range(4):
+        a = first[row * 3:row * 3 + 3]
+        for column in range(3):
+            value = sum(a[k] * second[k * 3 + column] for k in range(3))
+            if row == 3:
+                value += second[9 + column]
+            result.append(value)
+    return tuple(result)
+
+
+def format_transform(values):
+    # + 0.0 turns -0.0 into 0
+    return " ".join(f"{value + 0.0:.9g}" for value in values)
+
+
+def parse_bed_size(text):
+    # "250x210" -> (250.0, 210.0)
+    width, sep, depth = text.lower().partition("x")
+    try:
+        return float(width), float(depth)
+    except ValueError:
+        raise ValueError(f"Invalid bed size {text!r}, expected WIDTHxDEPTH in mm")
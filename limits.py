@@ -0,0 +1,135 @@
+###
+# limits.py
+# Resource limits of a conversion job.
+# A zip bomb or a 10 GB model must not fill the disk or get a worker killed for memory, so every
+# job checks the archive against ResourceLimits before anything is read: entry count, each entry's
+# uncompressed size and their total, all taken from the central directory. While entries are read,
+# LimitedReader keeps a running byte count per entry, and extraction a running total, so an entry
+# holding more than its ZipInfo claims is cut off as soon as it passes the limit. Readers also
+# bound parse memory: the converters keep at most one tag, text run or partial block of markup in
+# memory at a time, and the longest stretch of bytes without a "<" is what they may have to hold,
+# so a reader refuses stretches longer than max_parse_bytes (lxml runs with huge_tree and would
+# otherwise accept text nodes of any size).
+# @License: GPL 3.0
+###
+import re
+import logging
+
+MB = 1024 * 1024
+
+
+class LimitExceeded(ValueError):
+    pass
+
+
+class ResourceLimits:
+
+    def __init__(self, max_total_bytes=8192 * MB, max_entry_bytes=4096 * MB, max_entries=10000, max_parse_bytes=64 * MB):
+        # None turns a limit off
+        for name, value in (("total size", max_total_bytes), ("entry size", max_entry_bytes), ("entry count", max_entries), ("parse memory", max_parse_bytes)):
+            if value is not None and value <= 0:
+                raise ValueError(f"The {name} limit must be positive")
+        self.max_total_bytes = max_total_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.max_entries = max_entries
+        self.max_parse_bytes = max_parse_bytes
+
+    def describe(self):
+        def size(value):
+            return "unlimited" if value is None else f"{value / MB:g} MB"
+        entries = "unlimited" if self.max_entries is None else self.max_entries
+        return f"total {size(self.max_total_bytes)}, entry {size(self.max_entry_bytes)}, {entries} entries, parse {size(self.max_parse_bytes)}"
+
+    def check_archive(self, infos, name="archive"):
+        # check the declared sizes of every entry before any of them is inflated; returns the total
+        logging.debug(f"Checking {name} against the resource limits ({self.describe()})")
+        if self.max_entries is not None and len(infos) > self.max_entries:
+            raise LimitExceeded(f"{name} has {len(infos)} entries, the limit is {self.max_entries}")
+        total = 0
+        for info in infos:
+            self.check_entry(info.filename, info.file_size)
+            total += info.file_size
+        if self.max_total_bytes is not None and total > self.max_total_bytes:
+            raise LimitExceeded(f"{name} holds {total} bytes uncompressed, the limit is {self.max_total_bytes}")
+        return total
+
+    def check_entry(self, entry, size):
+        if self.max_entry_bytes is not None and size > self.max_entry_bytes:
+            raise LimitExceeded(f"{entry} is {size} bytes uncompressed, the limit is {self.max_entry_bytes}")
+
+    def check_total(self, total):
+        if self.max_total_bytes is not None and total > self.max_total_bytes:
+            raise LimitExceeded(f"The job inflated more than {self.max_total_bytes} bytes")
+
+    def reader(self, source, entry, parsed=True):
+        # parsed=False for entries that are only copied, such as thumbnails or G-code, which may
+        # have long stretches without "<"
+        return LimitedReader(source, self, entry, parsed)
+
+    def opener(self, open_entry):
+        # open_entry(name) whose file objects are limited readers
+        def open_limited(name):
+            return self.reader(open_entry(name), name)
+        return open_limited
+
+
+class LimitedReader:
+    # binary file object counting what is read from source against the limits
+
+    def __init__(self, source, limits, entry, parsed=True):
+        self.source = source
+        self.limits = limits
+        self.entry = entry
+        self.parsed = parsed
+        self.count = 0
+        # bytes since the last "<"
+        self.run = 0
+
+    @property
+    def name(self):
+        return getattr(self.source, "name", self.entry)
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        self.count += len(data)
+        self.limits.check_entry(self.entry, self.count)
+        if self.parsed and self.limits.max_parse_bytes is not None and self.longest_run(data) > self.limits.max_parse_bytes:
+            raise LimitExceeded(f"{self.entry} has more than {self.limits.max_parse_bytes} bytes without markup, the parse limit")
+        return data
+
+    def longest_run(self, data):
+        # the longest stretch without "<" that data adds, counting the one carried over from earlier reads
+        limit = self.limits.max_parse_bytes
+        first = data.find(b"<")
+        if first < 0:
+            self.run += len(data)
+            return self.run
+        longest = self.run + first
+        self.run = len(data) - data.rfind(b"<") - 1
+        longest = max(longest, self.run)
+        # a stretch between two "<" of this read is shorter than the read, so only a long read is searched
+        if longest <= limit and len(data) > limit and re.search(rb"[^<]{%d}" % (limit + 1), data):
+            longest = limit + 1
+        return longest
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_size(text):
+    # megabytes from the command line, 0 for no limit
+    value = float(text)
+    if value < 0:
+        raise ValueError(f"Invalid size {text!r}")
+    return int(value * MB) or None
@@ -1,6 +1,5 @@
 import os
 import shutil
-import tempfile
 import zipfile
 import re
 import io
@@ -8,6 +7,7 @@ import logging
 from tkinter import Tk, Label, Button, filedialog
 import lxml.etree as ET
 from pathlib import Path
+from workspace import Workspace
 
 class ZipProcessorGUI:
 
@@ -42,7 +42,12 @@ class ZipProcessorGUI:
         self.template_paths['Content_Types_template'] = "3mf_template/[Content_Types].xml"
         self.template_paths['Metadata'] = "3mf_template/Metadata/"
 
-        self.temp_3mf_dir = "temp_3mf"
+        # every run gets its own workspace for the extracted input and the output tree
+        # (temp_3mf_dir), removed when the run ends
+        self.workspace = None
+        self.temp_3mf_dir = None
+        # indent the written models; off by default, re-indenting millions of triangles is slow
+        self.pretty_print = False
 
         self.bambu_model_paths = []
         #contains output object file names and the object ids within those files
@@ -67,7 +72,9 @@ class ZipProcessorGUI:
             self.status_label.config(text="Please provide both input and output files.")
             return
 
-        tempdir = tempfile.TemporaryDirectory().name
+        if self.workspace is None:
+            self.workspace = Workspace()
+        tempdir = self.workspace.subdir("input")
 
         # Unzip the input file
         with zipfile.ZipFile(input_file, 'r') as zip_ref:
@@ -86,50 +93,57 @@ class ZipProcessorGUI:
             self.status_label.config(text="Please provide both input and output files.")
             return
 
-        if extracted_path==None:
-            extracted_path = self.decompress_zip(input_file)
-        objects_path = os.path.join(extracted_path,"3D","Objects")
-        if os.path.exists(objects_path):
-            # Parse all .model files
-            self.bambu_model_paths = list(Path(objects_path).rglob("*.model"))
-
-            if self.bambu_model_paths == None or self.bambu_model_paths == None:
-                logging.error("No model files found")
-                return 
-            
-        obj_IDs_Elements = []
-        for bmodel_path in self.bambu_model_paths:
-            filename, obj_IDs_Element = self.model_convert_re(bmodel_path)
-            obj_IDs_Elements.append([filename, obj_IDs_Element])
-
-        prusamodel_filenames = []
-        for filename, obj_IDs_Element in obj_IDs_Elements:
-            final_prusamodel = self.inject_bobject2pobject(obj_IDs_Element)
-            #final_prusamodels.append([filename, final_prusamodel])
-            #logging.debug(ET.tostring(final_prusamodel, pretty_print=True))
-            self.write_prusa_model(filename, final_prusamodel)
-            prusamodel_filenames.append(filename)
-
-        self.generate3mf_file(prusamodel_filenames)
+        self.workspace = Workspace()
+        self.temp_3mf_dir = self.workspace.subdir("output")
+        try:
+            if extracted_path==None:
+                extracted_path = self.decompress_zip(input_file)
+            objects_path = os.path.join(extracted_path,"3D","Objects")
+            if os.path.exists(objects_path):
+                # Parse all .model files
+                self.bambu_model_paths = list(Path(objects_path).rglob("*.model"))
+
+                if self.bambu_model_paths == None or self.bambu_model_paths == None:
+                    logging.error("No model files found")
+                    return 
+                
+            # convert, inject and write one model file at a time, so only one file's objects are in memory
+            prusamodel_filenames = []
+            for bmodel_path in self.bambu_model_paths:
+                filename, obj_IDs_Element = self.model_convert_re(bmodel_path)
+                final_prusamodel = self.inject_bobject2pobject(obj_IDs_Element)
+                #final_prusamodels.append([filename, final_prusamodel])
+                #logging.debug(ET.tostring(final_prusamodel, pretty_print=True))
+                self.write_prusa_model(filename, final_prusamodel)
+                prusamodel_filenames.append(filename)
+
+            self.generate3mf_file(prusamodel_filenames, output_file)
+        finally:
+            # the extracted input and the output tree go with the workspace
+            self.workspace.close()
+            self.workspace = None
+            self.temp_3mf_dir = None
 
     def model_convert_re(self, bmodel_path):
         logging.debug(f"Processing model file: {bmodel_path}")
         if not os.path.exists(bmodel_path):
             logging.error(f"File not found: {bmodel_path}")
             return None, None
+        relevant_objects = {}
         try:
             objects = {}
             #we don't know what encoding is used for the xml string, so we force it to utf-8
             with open(bmodel_path, encoding="utf-8") as f:
                 content = f.read()
-            temp = ET.parse(bmodel_path)
             rem_encoding = re.sub("encoding=\"[0-9A-Z\\-]*\"", "", content)
             rem_paint_color = rem_encoding.replace("paint_color", "slic3rpe:mmu_segmentation")
+            #the renamed attribute needs its prefix declared, or the model doesn't parse
+            if "xmlns:slic3rpe=" not in rem_paint_color:
+                rem_paint_color = re.sub(r"<model(?=[\s>])", "<model xmlns:slic3rpe=\"http://schemas.slic3r.org/3mf/2017/06\"", rem_paint_color, count=1)
             rem_paint_seam = re.sub("paint_seam=\"[0-9A-Z]*\"", "", rem_paint_color)
 
             bambu_tree = ET.fromstring(rem_paint_seam)
             objects = bambu_tree.findall(".//{*}resources/{*}object")
-            relevant_objects = {}
             for object in objects:
                 if object.attrib['type'] == "model":
                     relevant_objects[object.attrib['id']] = object
@@ -179,14 +193,14 @@ class ZipProcessorGUI:
                 build_element.append(item_element)
             return tree
 
-        except FileNotFoundError:
+        except FileNotFoundError as e:
             logging.error(f"Error: File '{self.template_paths['models_template']}' not found.")
             self.status_label.config(text=f"Error reading {self.template_paths['models_template']}: {e}")
             return
         except Exception as e:
             logging.error(f"An error occurred: {e}")
 
-    def compress_zip(self, ifolder_path, ofolder_path=None):
+    def compress_zip(self, ifolder_path, output_file=None):
         logging.debug("Compressing files into zip")
         if not ifolder_path:
             self.status_label.config(text="No input folder provided for compression.")
@@ -214,10 +228,31 @@ class ZipProcessorGUI:
             ###--3D/Objects/3dmodel.xml---###
             # Create the 3D Objects directory and copy the model files
             model_path = os.path.join(objects_dir, filename)
-            prusa_model.write(model_path, encoding='utf-8', xml_declaration=True, pretty_print=True)
+            self.stream_model(prusa_model.getroot(), model_path)
         except Exception as e:
             logging.error(f"An error occurred while writing Prusa object: {e}")
 
+    def stream_model(self, model, output):
+        # serialize the model incrementally to a path or binary file object: the <model> header and
+        # metadata, each object, then the build; pretty printing is optional and off by default
+        with ET.xmlfile(output, encoding="utf-8") as xf:
+            xf.write_declaration()
+            nsmap = dict(model.nsmap)
+            nsmap["xml"] = "http://www.w3.org/XML/1998/namespace"
+            with xf.element(model.tag, model.attrib, nsmap=nsmap):
+                for child in model:
+                    if isinstance(child.tag, str) and ET.QName(child).localname not in ("resources", "build"):
+                        xf.write(child, pretty_print=self.pretty_print)
+                for child in model:
+                    if not isinstance(child.tag, str) or ET.QName(child).localname != "resources":
+                        continue
+                    with xf.element(child.tag, child.attrib):
+                        for bobject in child:
+                            xf.write(bobject, pretty_print=self.pretty_print)
+                for child in model:
+                    if isinstance(child.tag, str) and ET.QName(child).localname == "build":
+                        xf.write(child, pretty_print=self.pretty_print)
+
     def generate3mf_file(self, final_prusamodels, output_file=None):
         logging.debug("Generating 3mf file structure")
         if output_file is None:
@@ -252,7 +287,7 @@ class ZipProcessorGUI:
             rels_tree = rels_ET.getroot()
             for model in final_prusamodels:
                 # Add a relationship for the model
-                rel = ET.fromstring(f'<Relationship Target="/3D/Objects/{model[0]}" Id="rel-{model[0]}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/3dmodel"/>')
+                rel = ET.fromstring(f'<Relationship Target="/3D/Objects/{model}" Id="rel-{model}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/3dmodel"/>')
                 rels_tree.append(rel)
             # Write the relationships file
             rels_path = os.path.join(rels_dir, ".rels")
@@ -0,0 +1,104 @@
+###
+# mapped_zip.py
+# Memory-mapped reading of STORED (uncompressed) zip entries.
+# For a STORED entry the bytes in the archive are the file itself, so instead of going through
+# zipfile's buffered reader the parser reads straight from a memoryview of the mapped archive at
+# the entry's data offset: no extraction, no read() syscalls and no buffering besides the single
+# parser-sized chunk lxml asks for (it only accepts bytes, so that chunk is the one copy). The CRC32
+# is still checked once the entry has been read to the end. DEFLATED and encrypted entries fall
+# back to zip_ref.open() and stream through inflate as before.
+# @License: GPL 3.0
+###
+import mmap
+import zlib
+import struct
+import zipfile
+import logging
+
+# local file header: signature, then filename and extra field lengths at offset 26
+LOCAL_HEADER_SIZE = 30
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+
+class MappedArchive:
+    # opens entries of one zip; the file is mapped on the first STORED entry
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def open(self, zip_ref, info):
+        # binary file object for the entry, read from the mapping when the entry is stored
+        if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1 or info.file_size == 0:
+            return zip_ref.open(info)
+        start = self.data_offset(info)
+        logging.debug(f"Reading stored entry {info.filename} from the mapped archive at offset {start}")
+        return MappedEntry(memoryview(self.mapping())[start:start + info.file_size], info)
+
+    def mapping(self):
+        if self._map is None:
+            self._file = open(self.path, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def data_offset(self, info):
+        # position of the entry's data, right after its local header
+        mapped = self.mapping()
+        offset = info.header_offset
+        if mapped[offset:offset + 4] != LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f"Bad local file header for {info.filename}")
+        name_length, extra_length = struct.unpack_from("<HH", mapped, offset + 26)
+        start = offset + LOCAL_HEADER_SIZE + name_length + extra_length
+        if start + info.file_size > len(mapped):
+            raise zipfile.BadZipFile(f"Entry {info.filename} runs past the end of the archive")
+        return start
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class MappedEntry:
+    # read-only file object over a memoryview slice; lxml only needs read()
+
+    def __init__(self, view, info):
+        self.view = view
+        self.name = info.filename
+        self.expected_crc = info.CRC
+        self.position = 0
+        self.crc = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def read(self, size=-1):
+        remaining = len(self.view) - self.position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        # copied out right away so no slice of the mapping outlives this call
+        chunk = self.view[self.position:self.position + size].tobytes()
+        self.position += size
+        self.crc = zlib.crc32(chunk, self.crc)
+        if self.position == len(self.view) and size and self.crc != self.expected_crc:
+            raise zipfile.BadZipFile(f"Bad CRC-32 for file {self.name!r}")
+        return chunk
+
+    def close(self):
+        # the slice has to be released before the mapping can be closed
+        self.view.release()
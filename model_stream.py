@@ -0,0 +1,424 @@
+###
+# model_stream.py
+# Streaming conversion of Bambu .model parts into Prusa .model parts.
+# The input document is fed to an lxml pull parser in a single forward pass and the
+# Prusa document is written with lxml xmlfile as the input is consumed. Every element
+# is released as soon as it has been written, so peak memory stays roughly constant
+# no matter how large the mesh is. The bulk of a mesh, runs of plain <vertex/> and
+# <triangle/> elements, is transcoded block by block at the byte level instead of
+# being parsed into one element per vertex or triangle.
+# @License: GPL 3.0
+###
+import os
+import re
+import logging
+import lxml.etree as ET
+from templates import templates
+
+CORE_NS = "http://schemas.microsoft.com/3dmanufacturing/core/2015/02"
+SLIC3RPE_NS = "http://schemas.slic3r.org/3mf/2017/06"
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+
+# Prusa attribute that replaces Bambu's paint_color on painted triangles
+MMU_SEGMENTATION = "{%s}mmu_segmentation" % SLIC3RPE_NS
+
+# transform given to every build item in the Prusa model
+DEFAULT_TRANSFORM = "0.799151571 0 0 0 0.799151571 0 0 0 0.799151571 184.67373 221.31425 1.61151839"
+
+
+def local_name(tag):
+    # strip the {namespace} part of a tag or attribute name
+    return tag[tag.rfind("}") + 1:]
+
+
+def prusa_tag(tag):
+    # Bambu elements are re-homed into the 3mf core namespace, like the <model> tag rewrite did
+    if tag[0] != "{" or tag.startswith("{%s}" % CORE_NS):
+        return "{%s}%s" % (CORE_NS, local_name(tag))
+    return tag
+
+
+def prusa_attrib(attrib):
+    # rename paint_color, drop paint_seam and any p:UUID; everything else is copied untouched
+    converted = {}
+    for name, value in attrib.items():
+        if name == "paint_color":
+            converted[MMU_SEGMENTATION] = value
+        elif name == "paint_seam" or (name[0] == "{" and name.endswith("}UUID")):
+            continue
+        else:
+            converted[name] = value
+    return converted
+
+
+# mesh containers whose children are copied in serialized chunks rather than element by element
+MESH_CONTAINERS = ("vertices", "triangles")
+# number of vertices/triangles serialized at once; bounds the memory held by the parser
+CHUNK_SIZE = 4096
+# bytes of input read per parser feed
+BLOCK_SIZE = 1 << 20
+
+# markers of the converted elements in the written bytes, counted by OutputCounter; the output is
+# always written unprefixed by lxml or by _transcode, so each marker appears once per element
+OUTPUT_MARKERS = {"objects": b"<object ", "vertices": b"<vertex ", "triangles": b"<triangle ", "painted": b' slic3rpe:mmu_segmentation="'}
+
+# byte level rewrites applied to serialized vertex/triangle chunks
+PAINT_SEAM_RE = re.compile(rb' paint_seam="[^"]*"')
+
+# unprefixed mesh container tags as they appear in the raw input
+MESH_START_RE = re.compile(rb"<(vertices|triangles)(?:\s[^>]*)?>")
+MESH_END_RE = {"vertices": re.compile(rb"</vertices\s*>"), "triangles": re.compile(rb"</triangles\s*>")}
+# runs of vertices/triangles exactly as Bambu Studio writes them; paint codes are hex digits.
+# Bambu Studio writes paint_supports, paint_seam, paint_color in that order; paint_color before
+# paint_seam is accepted as well
+NUMBER = rb'"[-+.eE0-9]+"'
+PAINT = rb'"[0-9A-F]+"'
+PLAIN_MESH_RE = {
+    "vertices": re.compile(rb'(?:\s*<vertex x=%s y=%s z=%s/>)*\s*' % (NUMBER, NUMBER, NUMBER)),
+    "triangles": re.compile(rb'(?:\s*<triangle v1="\d+" v2="\d+" v3="\d+"(?: paint_supports=%s)?(?:(?: paint_seam=%s)?(?: paint_color=%s)?|(?: paint_color=%s paint_seam=%s))/>)*\s*'
+                            % (PAINT, PAINT, PAINT, PAINT, PAINT)),
+}
+
+
+def release(elem):
+    # free an element that has been fully handled, along with any siblings before it
+    elem.clear(keep_tail=True)
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
+def _is_resource_object(elem):
+    parent = elem.getparent()
+    return local_name(elem.tag) == "object" and parent is not None and local_name(parent.tag) == "resources"
+
+
+def _is_mesh_container(tag):
+    return tag.startswith("{%s}" % CORE_NS) and local_name(tag) in MESH_CONTAINERS
+
+
+def _write_leaf(xf, tag, attrib, text):
+    with xf.element(tag, attrib):
+        if text and text.strip():
+            xf.write(text)
+
+
+def _transcode(chunk):
+    # paint_color becomes slic3rpe:mmu_segmentation and paint_seam is dropped, on serialized children
+    chunk = chunk.replace(b" paint_color=\"", b" slic3rpe:mmu_segmentation=\"")
+    return PAINT_SEAM_RE.sub(b"", chunk)
+
+
+def _write_chunk(xf, output, container, children):
+    # move the finished children into a detached wrapper and serialize them in one lxml call;
+    # the wrapper declares the core namespace as default so children come out unprefixed
+    wrapper = ET.Element(container.tag, nsmap={None: CORE_NS})
+    wrapper.extend(children)
+    chunk = ET.tostring(wrapper, encoding="utf-8")
+    # cut the wrapper start and end tags, keeping only the children
+    chunk = chunk[chunk.index(b">") + 1:chunk.rindex(b"</")]
+    xf.flush()
+    output.write(_transcode(chunk))
+
+
+def _is_plain_mesh_block(block, kind):
+    # the block may only hold whitespace and self-closing children in the canonical form Bambu
+    # Studio writes; other spellings (quotes, attribute order, namespaces, comments, entities)
+    # go through lxml instead
+    return PLAIN_MESH_RE[kind].fullmatch(block) is not None
+
+
+def _split_mesh_blocks(source):
+    # cut the raw input into (bytes, None) blocks of markup for the parser and (bytes, kind) blocks
+    # of the content of a <vertices> or <triangles> container; blocks end on ">", so each holds
+    # complete tags. Whether a container block really is one is decided by the parser's events.
+    buffer = b""
+    mesh = None
+    end = False
+    while not end:
+        data = source.read(BLOCK_SIZE)
+        end = not data
+        buffer += data
+        while buffer:
+            if mesh is None:
+                match = MESH_START_RE.search(buffer)
+                while match is not None and match.group(0).endswith(b"/>"):
+                    match = MESH_START_RE.search(buffer, match.end())
+                if match is None:
+                    # a trailing partial tag may still turn out to be a container start
+                    cut = len(buffer) if end else buffer.rfind(b"<")
+                    if cut > 0:
+                        yield buffer[:cut], None
+                        buffer = buffer[cut:]
+                    break
+                yield buffer[:match.end()], None
+                buffer = buffer[match.end():]
+                mesh = match.group(1).decode("ascii")
+            else:
+                match = MESH_END_RE[mesh].search(buffer)
+                cut = match.start() if match else (len(buffer) if end else buffer.rfind(b">") + 1)
+                if cut > 0:
+                    yield buffer[:cut], mesh
+                    buffer = buffer[cut:]
+                if match is None:
+                    break
+                mesh = None
+
+
+class _ObjectCopier:
+    # event handling for stream_objects(): writes the objects being copied into the xmlfile writer
+    # element by element, except for mesh children, which are written in serialized chunks or,
+    # when a block of them is plain enough, straight from the input bytes
+
+    def __init__(self, xf, output, stats, object_filter):
+        self.xf = xf
+        self.output = output
+        self.stats = stats
+        self.object_filter = object_filter
+        self.object_ids = []
+        # stack of [tag, attrib, open element context] for the object subtree being copied;
+        # a context is only opened once the element turns out to have children
+        self.stack = []
+        self.skipping = 0
+        # depth below the <vertices>/<triangles> element currently being chunked, 0 when outside one
+        self.in_mesh = 0
+        self.pending = 0
+        self.mesh_kind = None
+        self.container = None
+        # "copy" or "skip" while inside a mesh container whose children may bypass the parser
+        self.raw_mesh = None
+
+    def accepts_raw(self, kind):
+        # raw blocks are only taken between two children of the container the parser is in
+        return self.raw_mesh == "copy" and self.in_mesh == 1 and self.mesh_kind == kind
+
+    def write_raw(self, block):
+        if len(self.container):
+            # children that came through the parser go first
+            _write_chunk(self.xf, self.output, self.container, self.container[:])
+            self.pending = 0
+        self.stats[self.mesh_kind] += block.count(b"<")
+        if self.mesh_kind == "triangles":
+            self.stats["painted"] += block.count(b' paint_color="')
+        self.xf.flush()
+        self.output.write(_transcode(block))
+
+    def handle(self, event, elem):
+        xf = self.xf
+        stack = self.stack
+        if self.in_mesh:
+            if event == "start":
+                self.in_mesh += 1
+                return
+            self.in_mesh -= 1
+            if self.in_mesh > 1:
+                return
+            if self.in_mesh == 1:
+                # a vertex or triangle has been parsed; everything before it is complete
+                self.stats[self.mesh_kind] += 1
+                if self.mesh_kind == "triangles" and elem.get("paint_color") is not None:
+                    self.stats["painted"] += 1
+                self.pending += 1
+                if self.pending >= CHUNK_SIZE:
+                    # the parser builds a whole fed block before its events are read, so children
+                    # after elem may already be in the container; only the ended ones are written
+                    container = self.container
+                    _write_chunk(xf, self.output, container, container[:container.index(elem) + 1])
+                    self.pending = 0
+                return
+            # the container itself has ended
+            if len(elem):
+                _write_chunk(xf, self.output, elem, elem[:])
+            self.pending = 0
+            self.raw_mesh = None
+            self.container = None
+            stack.pop()[2].__exit__(None, None, None)
+            release(elem)
+            return
+
+        if event == "start":
+            if self.skipping:
+                self.skipping += 1
+                if _is_mesh_container(elem.tag):
+                    self.raw_mesh = "skip"
+            elif stack:
+                parent = stack[-1]
+                if parent[2] is None:
+                    parent[2] = xf.element(parent[0], parent[1])
+                    parent[2].__enter__()
+                stack.append([prusa_tag(elem.tag), prusa_attrib(elem.attrib), None])
+                if _is_mesh_container(elem.tag):
+                    stack[-1][2] = xf.element(stack[-1][0], stack[-1][1])
+                    stack[-1][2].__enter__()
+                    self.in_mesh = 1
+                    self.mesh_kind = local_name(elem.tag)
+                    self.container = elem
+                    self.raw_mesh = "copy"
+            elif _is_resource_object(elem):
+                logging.debug(f"Object type {elem.get('type')} | id {elem.get('id')}: ")
+                #only objects of type "model" are allowed in prusa format
+                if elem.get("type") == "model" and (self.object_filter is None or elem.get("id") in self.object_filter):
+                    self.object_ids.append(elem.get("id"))
+                    stack.append([prusa_tag(elem.tag), prusa_attrib(elem.attrib), None])
+                else:
+                    self.skipping = 1
+            return
+
+        if self.skipping:
+            self.skipping -= 1
+            self.raw_mesh = None
+        elif stack:
+            tag, attrib, context = stack.pop()
+            if context is None:
+                _write_leaf(xf, tag, attrib, elem.text)
+            else:
+                context.__exit__(None, None, None)
+        release(elem)
+
+
+def stream_objects(source, xf, output, stats=None, object_filter=None):
+    # copy every object of type "model" from the Bambu source into the open xmlfile writer;
+    # output is the binary file object underneath xf, used for the pre-serialized mesh chunks
+    # returns the ids of the objects that were written, in document order; when a stats dict is
+    # given, the number of vertices, triangles and painted triangles read from the objects being
+    # copied is added to it. object_filter, a set of
+    # ids, limits the copy to those objects; the others are released without being converted.
+    # The markup is parsed with lxml, but blocks of plain vertices/triangles are transcoded as
+    # bytes without building an element per vertex or triangle, and the meshes of skipped
+    # objects are not parsed at all.
+    if stats is None:
+        stats = {}
+    stats.setdefault("vertices", 0)
+    stats.setdefault("triangles", 0)
+    stats.setdefault("painted", 0)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return stream_objects(f, xf, output, stats, object_filter)
+    copier = _ObjectCopier(xf, output, stats, object_filter)
+    parser = ET.XMLPullParser(events=("start", "end"), huge_tree=True)
+    for block, mesh in _split_mesh_blocks(source):
+        if mesh is not None and copier.raw_mesh == "skip":
+            continue
+        if mesh is not None and copier.accepts_raw(mesh) and _is_plain_mesh_block(block, mesh):
+            copier.write_raw(block)
+            continue
+        parser.feed(block)
+        for event, elem in parser.read_events():
+            copier.handle(event, elem)
+    parser.close()
+    for event, elem in parser.read_events():
+        copier.handle(event, elem)
+    return copier.object_ids
+
+
+class OutputCounter:
+    # binary file object passing writes on to output while counting the objects, vertices,
+    # triangles and painted triangles in the written bytes, so a conversion can be checked against
+    # what it read without parsing its output again
+
+    def __init__(self, output):
+        self.output = output
+        self.counts = dict.fromkeys(OUTPUT_MARKERS, 0)
+        # the end of the previous write, for markers split across two writes
+        self.tail = b""
+
+    def write(self, data):
+        data = bytes(data)
+        for name, marker in OUTPUT_MARKERS.items():
+            # less than a marker on either side of the boundary, so only split markers are found there
+            overlap = len(marker) - 1
+            edge = self.tail[-overlap:] + data[:overlap]
+            self.counts[name] += data.count(marker) + edge.count(marker)
+        self.tail = (self.tail + data)[-MARKER_OVERLAP:]
+        return self.output.write(data)
+
+    def flush(self):
+        if hasattr(self.output, "flush"):
+            self.output.flush()
+
+
+# bytes kept from the end of the previous write
+MARKER_OVERLAP = max(len(marker) for marker in OUTPUT_MARKERS.values()) - 1
+
+
+def write_model_header(xf, template):
+    # opens the <model> element of the template and writes its metadata; returns the open context
+    nsmap = dict(template.nsmap)
+    nsmap["xml"] = XML_NS
+    model = xf.element(template.tag, template.attrib, nsmap=nsmap)
+    model.__enter__()
+    for child in template:
+        if isinstance(child.tag, str) and local_name(child.tag) == "metadata":
+            _write_leaf(xf, child.tag, child.attrib, child.text)
+    return model
+
+
+def write_build(xf, object_ids, transforms=None):
+    # one build item per object and transform; transforms maps object ids to lists of transform
+    # strings, objects without an entry get the default transform
+    transforms = transforms or {}
+    with xf.element("{%s}build" % CORE_NS):
+        for object_id in object_ids:
+            for transform in transforms.get(object_id) or [DEFAULT_TRANSFORM]:
+                _write_leaf(xf, "{%s}item" % CORE_NS, {"objectid": object_id, "transform": transform, "printable": "1"}, None)
+
+
+def convert_model_stream(source, output, template_path, stats=None, object_filter=None, transforms=None):
+    # convert a Bambu .model (path or binary file object) into a Prusa .model written to output
+    # (path or binary file object) in a single forward pass; returns the converted object ids.
+    # stats, if given, receives the object, vertex, triangle and painted triangle counts read from
+    # the input and, as written_*, the same counts found in the written output; transforms, if
+    # given, the build item transforms per object id (see layout.py)
+    logging.debug(f"Streaming model conversion: {source}")
+    template = templates.model(template_path)
+    if isinstance(output, str):
+        with open(output, "wb") as f:
+            return convert_model_stream(source, f, template_path, stats, object_filter, transforms)
+    counter = None
+    if stats is not None:
+        output = counter = OutputCounter(output)
+    try:
+        with ET.xmlfile(output, encoding="utf-8") as xf:
+            xf.write_declaration()
+            model = write_model_header(xf, template)
+            with xf.element("{%s}resources" % CORE_NS):
+                object_ids = stream_objects(source, xf, output, stats, object_filter)
+            write_build(xf, object_ids, transforms)
+            model.__exit__(None, None, None)
+    except ET.LxmlSyntaxError as e:
+        # an error in the middle of an object leaves elements open, and closing the writer then
+        # fails with "inconsistent exit action"; report the error that interrupted the conversion
+        if e.__context__ is not None:
+            raise e.__context__ from None
+        raise
+    if stats is not None:
+        stats["objects"] = len(object_ids)
+        stats.update((f"written_{name}", count) for name, count in counter.counts.items())
+    return object_ids
+
+
+def iter_prusa_objects(source):
+    # yields (id, element) for each converted object of type "model", one object at a time;
+    # used where callers need the lxml subtree rather than a written document
+    for event, elem in ET.iterparse(source, events=("end",), tag="{*}object", huge_tree=True):
+        if not _is_resource_object(elem):
+            continue
+        logging.debug(f"Object type {elem.get('type')} | id {elem.get('id')}: ")
+        if elem.get("type") != "model":
+            release(elem)
+            continue
+        converted = ET.Element(prusa_tag(elem.tag), prusa_attrib(elem.attrib), nsmap={None: CORE_NS, "slic3rpe": SLIC3RPE_NS})
+        _copy_children(elem, converted)
+        release(elem)
+        yield converted.get("id"), converted
+
+
+def _copy_children(src, dst):
+    for child in src:
+        if not isinstance(child.tag, str):
+            continue
+        sub = ET.SubElement(dst, prusa_tag(child.tag), prusa_attrib(child.attrib))
+        if child.text and child.text.strip():
+            sub.text = child.text
+        _copy_children(child, sub)
@@ -0,0 +1,266 @@
+###
+# object_index.py
+# Compact index of the objects in a Bambu .model file.
+# build_object_index() scans the raw bytes of a model file once and keeps, per <object>, only an
+# IndexedObject: id, type, source file, byte range, triangle count and whether it is painted,
+# and on request its bounding box, taken from the vertex coordinates a block of bytes at a time,
+# and a digest of its content for finding duplicate meshes.
+# Nothing is parsed into elements while indexing; an object is read back from its byte range only
+# right before it is written, streamed through model_stream's transcoder or, with materialize(),
+# parsed into a subtree, so peak memory follows the largest object instead of the whole project.
+# LazyModel writes a Prusa model that way.
+# @License: GPL 3.0
+###
+import io
+import os
+import re
+import hashlib
+import logging
+import lxml.etree as ET
+from model_stream import BLOCK_SIZE, MMU_SEGMENTATION, OUTPUT_MARKERS, OutputCounter, iter_prusa_objects, stream_objects, write_model_header, local_name
+
+# object tags, plus the comments and CDATA sections they must not be picked out of; the optional
+# groups are unset when a comment, CDATA section or tag is cut off by the end of the buffer
+TOKEN_RE = re.compile(rb"<!--(?P<comment>.*?-->)?|<!\[CDATA\[(?P<cdata>.*?\]\]>)?|<(?P<close>/?)(?:[\w.-]+:)?object(?=[\s/>])(?P<attrs>[^>]*)(?P<gt>>)?", re.S)
+TRIANGLE_RE = re.compile(rb"<(?:[\w.-]+:)?triangle(?=[\s/>])")
+ATTRIBUTE_RE = re.compile(rb"""\s(id|type)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+# vertex coordinates; inside an object only <vertex> elements have x, y and z attributes. The
+# canonical pattern is much faster and used whenever it accounts for every vertex of a block
+CANONICAL_VERTEX_RE = re.compile(rb'<vertex x="([^"]*)" y="([^"]*)" z="([^"]*)"')
+COORDINATE_RE = {axis: re.compile(rb"""\s%s\s*=\s*["']([^"']*)["']""" % axis) for axis in (b"x", b"y", b"z")}
+
+
+class IndexedObject:
+    __slots__ = ("object_id", "object_type", "source", "start", "end", "triangles", "painted", "bounds", "digest", "nsmap")
+
+    def __init__(self, object_id, object_type, source, start, nsmap):
+        self.object_id = object_id
+        self.object_type = object_type
+        self.source = source
+        # byte range of the <object> element in source, end exclusive
+        self.start = start
+        self.end = start
+        self.triangles = 0
+        self.painted = False
+        # (min x, min y, min z, max x, max y, max z) when indexed with bounds and the object has vertices
+        self.bounds = None
+        # hash of the bytes inside the <object> element when indexed with digest; equal for objects
+        # whose meshes (and paint) are written identically
+        self.digest = None
+        # namespace declarations of the document, shared by every object of the file
+        self.nsmap = nsmap
+
+    def __repr__(self):
+        return f"IndexedObject({self.object_id!r}, {self.object_type!r}, {self.source!r}, {self.start}-{self.end}, triangles={self.triangles})"
+
+    def read_bytes(self):
+        if self.source is None:
+            raise ValueError(f"Object {self.object_id} was indexed from a stream and can't be read back")
+        with open(self.source, 'rb') as f:
+            f.seek(self.start)
+            return f.read(self.end - self.start)
+
+    def read_document(self):
+        # the object's bytes wrapped in a <resources> element carrying the document's namespace
+        # declarations, so the fragment parses on its own
+        wrapper = ET.tostring(ET.Element("resources", nsmap=self.nsmap))
+        return wrapper[:-2] + b">" + self.read_bytes() + b"</resources>"
+
+    def materialize(self):
+        # the converted Prusa <object> element, parsed from the object's bytes
+        logging.debug(f"Materializing object {self.object_id} from {self.source}")
+        for object_id, converted in iter_prusa_objects(io.BytesIO(self.read_document())):
+            return converted
+        raise ValueError(f"Object {self.object_id} of {self.source} could not be read back")
+
+    def stream(self, xf, output, stats=None):
+        # write the converted object into an open xmlfile writer without materializing it; the mesh
+        # goes through the byte-level transcoding of model_stream (output is the file under xf).
+        # stats, if given, receives the counts read, as for stream_objects
+        logging.debug(f"Streaming object {self.object_id} from {self.source}")
+        if not stream_objects(io.BytesIO(self.read_document()), xf, output, stats):
+            raise ValueError(f"Object {self.object_id} of {self.source} could not be read back")
+
+
+def read_nsmap(source):
+    # namespace declarations of the root element; only the start of the file is parsed
+    for event, elem in ET.iterparse(source, events=("start",), huge_tree=True):
+        return dict(elem.nsmap)
+    return {}
+
+
+def build_object_index(source, bounds=False, digest=False):
+    # [IndexedObject, ...] in document order for every <object> in the model file at path source,
+    # or in a binary file object (whose objects have no source path and can't be materialized);
+    # with bounds=True each object's bounding box is computed as well, with digest=True its digest
+    if isinstance(source, (str, os.PathLike)):
+        nsmap = read_nsmap(source)
+        with open(source, 'rb') as f:
+            return _scan_objects(f, str(source), str(source), nsmap, bounds, digest)
+    return _scan_objects(source, None, getattr(source, "name", "stream"), {}, bounds, digest)
+
+
+def _scan_objects(f, source, name, nsmap, bounds, digest):
+    objects = []
+    current = None
+    hasher = None
+    offset = 0
+    buffer = b""
+    end = False
+    while not end:
+        data = f.read(BLOCK_SIZE)
+        end = not data
+        buffer += data
+        # a partial tag at the end of the buffer waits for the next block
+        limit = len(buffer) if end else max(buffer.rfind(b"<"), 0)
+        position = 0
+        while True:
+            match = TOKEN_RE.search(buffer, position, limit)
+            if match is None:
+                break
+            token = match.group(0)
+            if token.startswith(b"<!--"):
+                unfinished = match.group("comment") is None
+            elif token.startswith(b"<![CDATA["):
+                unfinished = match.group("cdata") is None
+            else:
+                unfinished = match.group("gt") is None
+            if unfinished:
+                if end:
+                    raise ValueError(f"Unterminated markup at byte {offset + match.start()} of {name}")
+                # the rest of this comment, CDATA section or tag is in a later block
+                limit = match.start()
+                break
+            if current is not None:
+                _scan_segment(current, buffer[position:match.start()], bounds, hasher)
+            position = match.end()
+            if token.startswith(b"<!"):
+                continue
+            if match.group("close"):
+                if current is None:
+                    raise ValueError(f"Unexpected </object> at byte {offset + match.start()} of {name}")
+                current.end = offset + match.end()
+                if hasher is not None:
+                    current.digest = hasher.digest()
+                current = None
+                continue
+            if current is not None:
+                raise ValueError(f"Nested <object> at byte {offset + match.start()} of {name}")
+            attributes = {}
+            for attribute, double, single in ATTRIBUTE_RE.findall(match.group("attrs")):
+                attributes[attribute.decode("ascii")] = (double or single).decode("utf-8")
+            indexed = IndexedObject(attributes.get("id"), attributes.get("type"), source, offset + match.start(), nsmap)
+            objects.append(indexed)
+            if match.group("attrs").rstrip().endswith(b"/"):
+                indexed.end = offset + match.end()
+                if digest:
+                    indexed.digest = hashlib.blake2b(digest_size=16).digest()
+            else:
+                current = indexed
+                hasher = hashlib.blake2b(digest_size=16) if digest else None
+        if current is not None:
+            _scan_segment(current, buffer[position:limit], bounds, hasher)
+        offset += limit
+        buffer = buffer[limit:]
+    if current is not None:
+        raise ValueError(f"Unterminated <object> {current.object_id} in {name}")
+    logging.debug(f"Indexed {len(objects)} objects in {name}")
+    return objects
+
+
+def _scan_segment(indexed, data, bounds, hasher):
+    # data holds complete tags of one object; plain counting is enough unless tags are prefixed
+    if hasher is not None:
+        hasher.update(data)
+    triangles = data.count(b"<triangle ")
+    if b":triangle" in data or triangles != data.count(b"<triangle") - data.count(b"<triangles"):
+        triangles = len(TRIANGLE_RE.findall(data))
+    indexed.triangles += triangles
+    if not indexed.painted and b"paint_color" in data:
+        indexed.painted = True
+    if bounds:
+        _update_bounds(indexed, data)
+
+
+def _update_bounds(indexed, data):
+    # the coordinates of a whole block are extracted and reduced in one go rather than per vertex
+    # only the stretch between the first and the last vertex is searched, not the triangles
+    first = data.find(b"<vertex")
+    if first < 0 and b":vertex" not in data:
+        return
+    vertices = CANONICAL_VERTEX_RE.findall(data, first, data.rfind(b"<vertex") + 256)
+    if b":vertex" not in data and len(vertices) == data.count(b"<vertex") - data.count(b"<vertices"):
+        columns = list(zip(*vertices))
+    else:
+        columns = [COORDINATE_RE[axis].findall(data) for axis in (b"x", b"y", b"z")]
+    if not columns or not all(columns):
+        return
+    lows = []
+    highs = []
+    for column in columns:
+        values = list(map(float, column))
+        lows.append(min(values))
+        highs.append(max(values))
+    if indexed.bounds is not None:
+        lows = [min(a, b) for a, b in zip(lows, indexed.bounds[:3])]
+        highs = [max(a, b) for a, b in zip(highs, indexed.bounds[3:])]
+    indexed.bounds = tuple(lows + highs)
+
+
+class LazyModel:
+    # a Prusa model template with its build items (and any objects already in <resources>), and
+    # the indexed objects written after them
+
+    def __init__(self, model, objects):
+        self.model = model
+        self.objects = objects
+
+    def write(self, output, pretty_print=False, stats=None):
+        # write the model to a path or binary file object: header and metadata, the objects one at
+        # a time, then the build. Indexed objects are streamed, or materialized when pretty printed.
+        # stats, if given, receives the object, vertex, triangle and painted triangle counts of the
+        # objects written and, as written_*, the counts found in the written bytes
+        if isinstance(output, (str, os.PathLike)):
+            with open(output, 'wb') as f:
+                return self.write(f, pretty_print, stats)
+        counter = None
+        if stats is not None:
+            output = counter = OutputCounter(output)
+            stats.update(dict.fromkeys(OUTPUT_MARKERS, 0))
+        with ET.xmlfile(output, encoding="utf-8") as xf:
+            xf.write_declaration()
+            model = write_model_header(xf, self.model)
+            resources = self.model.find("{*}resources")
+            with xf.element(resources.tag, resources.attrib):
+                for child in resources:
+                    if stats is not None:
+                        _count_object(child, stats)
+                    xf.write(child, pretty_print=pretty_print)
+                for indexed in self.objects:
+                    if pretty_print:
+                        converted = indexed.materialize()
+                        if stats is not None:
+                            _count_object(converted, stats)
+                        xf.write(converted, pretty_print=True)
+                    else:
+                        indexed.stream(xf, output, stats)
+                        if stats is not None:
+                            stats["objects"] += 1
+            for child in self.model:
+                if isinstance(child.tag, str) and local_name(child.tag) == "build":
+                    xf.write(child, pretty_print=pretty_print)
+            model.__exit__(None, None, None)
+        if stats is not None:
+            stats.update((f"written_{name}", count) for name, count in counter.counts.items())
+
+
+def _count_object(elem, stats):
+    # counts of an object that is already a Prusa element
+    if not isinstance(elem.tag, str) or local_name(elem.tag) != "object":
+        return
+    stats["objects"] += 1
+    stats["vertices"] += sum(1 for vertex in elem.iter("{*}vertex"))
+    for triangle in elem.iter("{*}triangle"):
+        stats["triangles"] += 1
+        if triangle.get(MMU_SEGMENTATION) is not None:
+            stats["painted"] += 1
@@ -0,0 +1,148 @@
+###
+# selection.py
+# On-demand object selection for partial conversions ("export this one part").
+# An ObjectSelection holds object ids, object/part names and Bambu plate numbers. It is resolved
+# against the project's 3D/3dmodel.model (which maps top-level objects to the objects inside
+# 3D/Objects/*.model through components) and Metadata/model_settings.config (object and part
+# names, plate contents) into the set of object ids to keep per model file. Model files without
+# a selected object are never opened, and inside the others non-matching objects are skipped
+# by the streaming converter without being converted or serialized.
+# @License: GPL 3.0
+###
+import os
+import fnmatch
+import logging
+import lxml.etree as ET
+from model_stream import local_name, release
+
+MAIN_MODEL = "3D/3dmodel.model"
+MODEL_SETTINGS = "Metadata/model_settings.config"
+# a main model may hold meshes too; their elements are parsed and let go, so no tree builds up
+MESH_ELEMENTS = ("{*}vertex", "{*}triangle")
+
+
+class ObjectSelection:
+
+    def __init__(self, ids=(), names=(), plates=()):
+        self.ids = {str(object_id) for object_id in ids}
+        # names are matched with shell-style wildcards, e.g. "earring*"
+        self.names = list(names)
+        self.plates = {str(plate) for plate in plates}
+
+    def __bool__(self):
+        return bool(self.ids or self.names or self.plates)
+
+    def describe(self):
+        parts = []
+        if self.ids:
+            parts.append("ids " + ", ".join(sorted(self.ids)))
+        if self.names:
+            parts.append("names " + ", ".join(self.names))
+        if self.plates:
+            parts.append("plates " + ", ".join(sorted(self.plates)))
+        return "; ".join(parts)
+
+    def _name_matches(self, name):
+        return name is not None and any(fnmatch.fnmatchcase(name, pattern) for pattern in self.names)
+
+    def resolve(self, names, open_entry):
+        # names: entry names of the project; open_entry(name): binary file object for an entry.
+        # returns {model entry name: set of object ids to keep} for the 3D/Objects/*.model entries
+        # that contain at least one selected object
+        model_entries = [name for name in names if name.startswith("3D/Objects/") and name.endswith(".model")]
+        components = read_components(open_entry) if MAIN_MODEL in names else {}
+        settings = read_model_settings(open_entry) if MODEL_SETTINGS in names else ({}, {}, {})
+        object_names, part_names, plates = settings
+
+        # top-level objects (ids in 3D/3dmodel.model) picked by id, name or plate
+        top_level = {object_id for object_id in self.ids if object_id in components}
+        top_level.update(object_id for object_id, name in object_names.items() if self._name_matches(name))
+        for plate in self.plates:
+            top_level.update(plates.get(plate, ()))
+
+        keep = {}
+        for object_id in top_level:
+            for path, inner_id, transform in components.get(object_id, ()):
+                keep.setdefault(path, set()).add(inner_id)
+        # parts are the objects inside the model files, named per top-level object
+        for (object_id, part_id), name in part_names.items():
+            if self._name_matches(name):
+                for path, inner_id, transform in components.get(object_id, ()):
+                    if inner_id == part_id:
+                        keep.setdefault(path, set()).add(inner_id)
+        # ids that are not top-level objects are taken as object ids inside the model files; the
+        # components tell which files hold them, without them every model file is searched
+        direct_ids = self.ids - set(components)
+        for references in components.values():
+            for path, inner_id, transform in references:
+                if inner_id in direct_ids:
+                    keep.setdefault(path, set()).add(inner_id)
+
+        plan = {}
+        for name in model_entries:
+            ids = keep.get(name, set())
+            if not components:
+                ids = ids | direct_ids
+            if ids:
+                plan[name] = ids
+        logging.debug(f"Selection {self.describe()} resolved to {plan}")
+        return plan
+
+
+def read_components(open_entry):
+    # {top-level object id: [(model entry name, object id inside it, component transform or None), ...]}
+    # from 3D/3dmodel.model
+    components = {}
+    with open_entry(MAIN_MODEL) as f:
+        for event, elem in ET.iterparse(f, events=("end",), tag=("{*}object",) + MESH_ELEMENTS, huge_tree=True):
+            if local_name(elem.tag) == "object":
+                for component in elem.iterfind("{*}components/{*}component"):
+                    path = MAIN_MODEL
+                    for attribute, value in component.attrib.items():
+                        if local_name(attribute) == "path":
+                            path = value.lstrip("/")
+                    components.setdefault(elem.get("id"), []).append((path, component.get("objectid"), component.get("transform")))
+            release(elem)
+    return components
+
+
+def read_model_settings(open_entry):
+    # object names, part names and plate contents from Bambu's Metadata/model_settings.config
+    object_names = {}
+    part_names = {}
+    plates = {}
+    # read one child of the root at a time, each let go once it has been read
+    depth = 0
+    with open_entry(MODEL_SETTINGS) as f:
+        for event, elem in ET.iterparse(f, events=("start", "end"), huge_tree=True):
+            if event == "start":
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            if elem.tag == "object":
+                object_names[elem.get("id")] = _metadata(elem, "name")
+                for part in elem.iterfind("part"):
+                    part_names[(elem.get("id"), part.get("id"))] = _metadata(part, "name")
+            elif elem.tag == "plate":
+                plate_id = _metadata(elem, "plater_id")
+                plates[plate_id] = [_metadata(instance, "object_id") for instance in elem.iterfind("model_instance")]
+            release(elem)
+    return object_names, part_names, plates
+
+
+def _metadata(elem, key):
+    for metadata in elem.iterfind("metadata"):
+        if metadata.get("key") == key:
+            return metadata.get("value")
+    return None
+
+
+def directory_entries(root):
+    # entry names and an opener for an extracted project, matching what a ZipFile provides
+    names = []
+    for foldername, subfolders, filenames in os.walk(root):
+        for filename in filenames:
+            names.append(os.path.relpath(os.path.join(foldername, filename), root).replace(os.sep, "/"))
+    return names, lambda name: open(os.path.join(root, name), 'rb')
@@ -0,0 +1,347 @@
+###
+# service.py
+# Local conversion service: an asyncio HTTP server (TCP or Unix socket) that takes Bambu 3mf
+# bytes and answers with the converted Prusa 3mf, e.g.
+#   python bambu2prusa.py serve --port 8080 -j 4 --queue 8 --timeout 120
+#   curl --data-binary @in.3mf -o out.3mf "http://localhost:8080/convert?plate=1&compression=stored"
+# Conversions run on a process pool that is started and warmed up once, so requests no longer
+# pay interpreter, lxml and template start-up time. At most jobs + queue conversions are admitted
+# at a time; further requests get 429 with Retry-After instead of piling up, and a job that runs
+# longer than the timeout is answered with 504. A pool worker can't be stopped on its own, so a
+# timed-out job retires its pool: new jobs go to a fresh pool, and the old one is terminated as
+# soon as its other jobs are done, which frees the hung job's slot. Uploads that arrive slower than
+# the upload timeout are answered with 408 instead of holding their slot. An upload is streamed into
+# the job's workspace and the worker is only sent its path, so neither process holds it in memory;
+# the converted file is streamed back from the same workspace.
+# @License: GPL 3.0
+###
+import os
+import json
+import time
+import asyncio
+import logging
+import functools
+import contextlib
+import multiprocessing
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from converter import Bambu2PrusaConverter, convert_file
+from templates import templates
+from selection import ObjectSelection
+from compression import Compression
+from limits import LimitExceeded
+from workspace import Workspace
+
+REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 408: "Request Timeout", 411: "Length Required",
+    413: "Payload Too Large", 422: "Unprocessable Entity", 429: "Too Many Requests", 431: "Request Header Fields Too Large",
+    500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout",
+}
+CONTENT_TYPE_3MF = "application/vnd.ms-package.3dmanufacturing-3dmodel+xml"
+MAX_HEADER_LINES = 100
+# bytes read from the socket or the converted file at a time
+TRANSFER_BLOCK = 1 << 20
+
+
+def warm_up():
+    # runs once in every pool worker so the templates are parsed before the first request
+    converter = Bambu2PrusaConverter()
+    templates.model(converter.template_paths['models_template'])
+    templates.read_bytes(converter.template_paths['Content_Types_template'], "content_types")
+    return os.getpid()
+
+
+def terminate_pool(pool):
+    # stop a pool's workers, including one stuck in a conversion; their jobs fail with BrokenProcessPool
+    terminate_workers = getattr(pool, "terminate_workers", None)
+    if terminate_workers is not None:
+        terminate_workers()
+        return
+    # before Python 3.14 the executor has no public way to do this
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def convert_upload(input_file, output_file, settings):
+    # runs in a pool worker: convert an upload the service saved in the job's workspace and return
+    # the number of model files
+    return len(convert_file(input_file, output_file, **settings))
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class ConversionService:
+
+    def __init__(self, settings=None, workers=1, queue_size=8, timeout=120, max_upload=256 * 1024 * 1024, upload_timeout=60):
+        # settings: converter attributes applied to every job, as for convert_file()
+        self.settings = settings or {}
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.max_upload = max_upload
+        # seconds allowed for reading a request's head, and again for its body
+        self.upload_timeout = upload_timeout
+        self.pool = None
+        # {pool: futures of its unfinished jobs}, the jobs whose request timed out, and the pools
+        # waiting for their other jobs before they are terminated
+        self.jobs = {}
+        self.hung = set()
+        self.retired = set()
+        # conversions admitted and not yet finished, including ones whose request timed out
+        self.active = 0
+        self.counters = {"completed": 0, "failed": 0, "rejected": 0, "timed_out": 0}
+        self.latencies = []
+
+    @property
+    def capacity(self):
+        return self.workers + self.queue_size
+
+    async def start(self):
+        logging.debug(f"Starting conversion pool with {self.workers} workers")
+        # workers forked from the server would inherit its open connections (a replacement pool is
+        # started while requests are in flight) and keep them from closing; a fork server has none
+        context = multiprocessing.get_context("forkserver") if "forkserver" in multiprocessing.get_all_start_methods() else None
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*(loop.run_in_executor(self.pool, warm_up) for i in range(self.workers)))
+        logging.info(f"Conversion workers ready: {sorted(set(pids))}")
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    async def retire(self, pool):
+        # move new jobs to a fresh pool and terminate this one once only hung jobs are left on it
+        if pool is self.pool:
+            logging.error("Conversion timed out, replacing the worker pool")
+            self.pool = None
+            self.retired.add(pool)
+            await self.start()
+        self.terminate_if_idle(pool)
+
+    def terminate_if_idle(self, pool):
+        if pool in self.retired and all(future in self.hung for future in self.jobs.get(pool, ())):
+            logging.debug("Terminating the retired worker pool")
+            self.retired.discard(pool)
+            terminate_pool(pool)
+
+    async def serve(self, host="127.0.0.1", port=8080, unix_path=None):
+        await self.start()
+        try:
+            if unix_path:
+                server = await asyncio.start_unix_server(self.handle, path=unix_path)
+                logging.warning(f"Serving conversions on unix socket {unix_path}")
+            else:
+                server = await asyncio.start_server(self.handle, host, port)
+                logging.warning(f"Serving conversions on http://{host}:{port}/convert")
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.stop()
+            # retired pools may hold hung workers that would keep the process from exiting
+            for pool in list(self.retired):
+                terminate_pool(pool)
+            self.retired.clear()
+
+    async def handle(self, reader, writer):
+        # one request per connection; job_files holds the job's workspace until the answer is sent
+        try:
+            with contextlib.ExitStack() as job_files:
+                try:
+                    status, body, headers = await self.respond(reader, writer, job_files)
+                except HTTPError as e:
+                    status, headers = e.status, e.headers
+                    body = json.dumps({"error": str(e)}).encode("utf-8")
+                    headers.setdefault("Content-Type", "application/json")
+                await self.send(writer, status, body, headers)
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logging.debug(f"Connection closed early: {e}")
+        finally:
+            writer.close()
+
+    async def respond(self, reader, writer, job_files):
+        # returns the status, the body (bytes, or the converted file open for reading) and the headers
+        method, target, headers = await self.read_timed(self.read_head(reader), "request head")
+        url = urlsplit(target)
+        if url.path == "/health":
+            return 200, json.dumps(self.status()).encode("utf-8"), {"Content-Type": "application/json"}
+        if url.path != "/convert":
+            raise HTTPError(404, f"Unknown path {url.path}")
+        if method != "POST":
+            raise HTTPError(405, "Use POST with the 3mf file as the request body", {"Allow": "POST"})
+        if "chunked" in headers.get("transfer-encoding", "").lower() or "content-length" not in headers:
+            raise HTTPError(411, "A Content-Length header is required")
+        try:
+            length = int(headers["content-length"])
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length > self.max_upload:
+            raise HTTPError(413, f"Uploads are limited to {self.max_upload} bytes")
+        settings = self.job_settings(parse_qs(url.query))
+
+        # backpressure: refuse before reading the upload when every worker and queue slot is taken
+        if self.active >= self.capacity:
+            self.counters["rejected"] += 1
+            raise HTTPError(429, "Conversion queue is full", {"Retry-After": str(self.retry_after())})
+        self.active += 1
+        try:
+            workspace = job_files.enter_context(Workspace(self.settings.get("workspace_root"), self.settings.get("workspace_in_memory", False)))
+            input_file = os.path.join(workspace.path, "input.3mf")
+            output_file = os.path.join(workspace.path, "output.3mf")
+            if headers.get("expect", "").lower() == "100-continue":
+                # clients waiting for this only start the upload once the job has been admitted
+                writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                await writer.drain()
+            await self.read_timed(self.receive(reader, length, input_file), "upload")
+        except BaseException:
+            self.active -= 1
+            raise
+        models = await self.run_job(input_file, output_file, settings)
+        output = job_files.enter_context(open(output_file, 'rb'))
+        return 200, output, {"Content-Type": CONTENT_TYPE_3MF, "X-Model-Files": str(models)}
+
+    async def receive(self, reader, length, path):
+        # copy the request body into path a block at a time
+        with open(path, 'wb') as f:
+            remaining = length
+            while remaining:
+                block = await reader.read(min(TRANSFER_BLOCK, remaining))
+                if not block:
+                    raise asyncio.IncompleteReadError(b"", remaining)
+                f.write(block)
+                remaining -= len(block)
+
+    async def read_timed(self, read, what):
+        # a client sending slower than the upload timeout is cut off instead of holding a connection or a slot
+        try:
+            return await asyncio.wait_for(read, self.upload_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(408, f"The {what} was not received within {self.upload_timeout} s")
+
+    async def run_job(self, input_file, output_file, settings):
+        # the admission slot is held until the worker is done or, if the request timed out, until
+        # its retired pool is terminated, so a burst of slow jobs cannot overcommit the pool
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        pool = self.pool
+        try:
+            future = loop.run_in_executor(pool, convert_upload, input_file, output_file, settings)
+        except BaseException:
+            self.active -= 1
+            raise
+        self.jobs.setdefault(pool, set()).add(future)
+        future.add_done_callback(functools.partial(self.job_done, pool))
+        try:
+            models = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.counters["timed_out"] += 1
+            self.hung.add(future)
+            await self.retire(pool)
+            raise HTTPError(504, f"Conversion did not finish within {self.timeout} s")
+        except BrokenProcessPool:
+            # a worker died (e.g. killed for memory); replace the pool for the next jobs
+            self.counters["failed"] += 1
+            if self.pool is pool:
+                logging.error("Conversion worker died, restarting the pool")
+                self.stop()
+                await self.start()
+            raise HTTPError(500, "Conversion worker died")
+        except LimitExceeded as e:
+            # the upload itself was small enough, but what it inflates to is not
+            self.counters["failed"] += 1
+            raise HTTPError(413, str(e))
+        except Exception as e:
+            self.counters["failed"] += 1
+            raise HTTPError(422, f"{type(e).__name__}: {e}")
+        self.counters["completed"] += 1
+        self.latencies = (self.latencies + [time.perf_counter() - start])[-100:]
+        return models
+
+    def job_done(self, pool, future):
+        self.active -= 1
+        self.hung.discard(future)
+        jobs = self.jobs.get(pool)
+        if jobs is not None:
+            jobs.discard(future)
+            if not jobs:
+                del self.jobs[pool]
+        if not future.cancelled():
+            # fetch the exception so a timed-out job that failed later is not reported as unhandled
+            future.exception()
+        # the last regular job of a retired pool has finished
+        self.terminate_if_idle(pool)
+
+    def job_settings(self, query):
+        # per-request object selection (object_id, object_name, plate) and output compression
+        # (compression=deflate|stored, level=0-9) from the query string
+        settings = dict(self.settings)
+        if "compression" in query or "level" in query:
+            default = settings.get("compression") or Compression()
+            try:
+                level = int(query["level"][-1]) if "level" in query else default.level
+                settings["compression"] = Compression(query.get("compression", [default.method])[-1], level, default.workers)
+            except ValueError as e:
+                raise HTTPError(400, str(e))
+        selection = ObjectSelection(query.get("object_id", ()), query.get("object_name", ()), query.get("plate", ()))
+        if selection:
+            settings["selection"] = selection
+        return settings
+
+    def retry_after(self):
+        # rough wait until a slot frees up, from the recent average conversion time
+        if not self.latencies:
+            return 1
+        average = sum(self.latencies) / len(self.latencies)
+        return max(1, round(average * (self.active - self.workers + 1) / self.workers))
+
+    def status(self):
+        status = {"workers": self.workers, "capacity": self.capacity, "active": self.active}
+        status.update(self.counters)
+        return status
+
+    async def read_head(self, reader):
+        request_line = await self.read_line(reader, 400, "Request line")
+        parts = request_line.split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            raise HTTPError(400, "Malformed request line")
+        headers = {}
+        for i in range(MAX_HEADER_LINES):
+            line = await self.read_line(reader, 431, "Header line")
+            if not line:
+                return parts[0].upper(), parts[1], headers
+            name, sep, value = line.partition(":")
+            if not sep:
+                raise HTTPError(400, "Malformed header line")
+            headers[name.strip().lower()] = value.strip()
+        raise HTTPError(431, "Too many header lines")
+
+    async def read_line(self, reader, status, what):
+        # a line longer than the reader's buffer limit is answered with status instead of dropping the connection
+        try:
+            line = await reader.readline()
+        except (ValueError, asyncio.LimitOverrunError):
+            raise HTTPError(status, f"{what} too long")
+        return line.decode("latin-1").rstrip("\r\n")
+
+    async def send(self, writer, status, body, headers):
+        # body: bytes, or a binary file that is sent a block at a time
+        length = len(body) if isinstance(body, bytes) else os.fstat(body.fileno()).st_size
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Length: {length}", "Connection: close"]
+        head.extend(f"{name}: {value}" for name, value in headers.items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        if isinstance(body, bytes):
+            writer.write(body)
+        else:
+            for block in iter(lambda: body.read(TRANSFER_BLOCK), b""):
+                writer.write(block)
+                await writer.drain()
+        await writer.drain()
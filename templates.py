@@ -0,0 +1,112 @@
+###
+# templates.py
+# Process-wide registry of the Prusa 3mf templates (model, .rels, [Content_Types].xml, Metadata).
+# Each template is read, parsed and validated once per process; callers get cheap deep copies of
+# the parsed trees or the raw bytes, so long-running workers stop re-reading the templates per job.
+# The static parts ([Content_Types].xml, Metadata) are also kept as a small pre-built zip per
+# compression setting, whose entries are copied into the outputs already compressed.
+# @License: GPL 3.0
+###
+import io
+import os
+import copy
+import logging
+import threading
+import lxml.etree as ET
+
+# root element and required children of each kind of xml template
+TEMPLATE_SHAPES = {
+    "model": ("model", ("resources", "build")),
+    "rels": ("Relationships", ()),
+    "content_types": ("Types", ()),
+}
+
+
+class TemplateRegistry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._trees = {}
+        self._bytes = {}
+        self._listings = {}
+        self._archives = {}
+
+    def _load_tree(self, path, kind):
+        with self._lock:
+            tree = self._trees.get(path)
+            if tree is None:
+                logging.debug(f"Loading {kind} template {path}")
+                tree = ET.parse(path)
+                validate_template(tree.getroot(), kind, path)
+                self._trees[path] = tree
+        return tree
+
+    def model(self, path):
+        # shared, read-only root of the model template; use model_copy() to modify it
+        return self._load_tree(path, "model").getroot()
+
+    def model_copy(self, path):
+        return copy.deepcopy(self.model(path))
+
+    def rels_copy(self, path):
+        return copy.deepcopy(self._load_tree(path, "rels"))
+
+    def read_bytes(self, path, kind=None):
+        # raw template bytes, e.g. for zip_out.writestr(); xml kinds are validated on first use
+        with self._lock:
+            data = self._bytes.get(path)
+            if data is None:
+                logging.debug(f"Loading template bytes {path}")
+                with open(path, 'rb') as f:
+                    data = f.read()
+                if kind is not None:
+                    validate_template(ET.fromstring(data), kind, path)
+                self._bytes[path] = data
+        return data
+
+    def listdir(self, path):
+        # sorted file names in a template directory, empty if the directory does not exist
+        with self._lock:
+            names = self._listings.get(path)
+            if names is None:
+                names = sorted(os.listdir(path)) if os.path.isdir(path) else []
+                self._listings[path] = names
+        return names
+
+    def archive(self, entries, compression):
+        # bytes of a zip holding the templates entries [(arcname, path, kind)], compressed with the
+        # given Compression; built once per process and setting
+        key = (tuple(entries), compression.method, compression.level)
+        with self._lock:
+            data = self._archives.get(key)
+        if data is None:
+            logging.debug(f"Building template archive ({compression.describe()})")
+            buffer = io.BytesIO()
+            with compression.open_zip(buffer) as zip_out:
+                for arcname, path, kind in entries:
+                    zip_out.writestr(compression.zip_info(arcname), self.read_bytes(path, kind))
+            data = buffer.getvalue()
+            with self._lock:
+                data = self._archives.setdefault(key, data)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._trees.clear()
+            self._bytes.clear()
+            self._listings.clear()
+            self._archives.clear()
+
+
+def validate_template(root, kind, path):
+    root_name, required = TEMPLATE_SHAPES[kind]
+    if ET.QName(root).localname != root_name:
+        raise ValueError(f"Template {path} has root <{ET.QName(root).localname}>, expected <{root_name}>")
+    children = {ET.QName(child).localname for child in root if isinstance(child.tag, str)}
+    for name in required:
+        if name not in children:
+            raise ValueError(f"Template {path} is missing <{name}>")
+
+
+# shared by every converter in the process
+templates = TemplateRegistry()
@@ -0,0 +1,9 @@
+###
+# conftest.py
+# The modules live at the top of the repository; make them importable from the tests.
+# @License: GPL 3.0
+###
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
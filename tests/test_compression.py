@@ -0,0 +1,146 @@
+###
+# test_compression.py
+# RawEntryWriter writes entries on zipfile's internals, so the archives it produces are read back
+# with zipfile itself: block-parallel deflate and copy_raw_entry() on seekable and non-seekable
+# outputs, entries over the zip64 threshold, an entry aborted halfway, and the public API fallback.
+# @License: GPL 3.0
+###
+import io
+import os
+import zlib
+import random
+import zipfile
+import pytest
+import compression
+from compression import Compression, RawEntryWriter, copy_raw_entry
+
+
+class Unseekable(io.RawIOBase):
+    # output stream like a pipe or socket: written in order, no seek or tell
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+    def getvalue(self):
+        return self.buffer.getvalue()
+
+
+def payload(size):
+    # compressible but not trivial, so that every deflate block holds real data
+    rng = random.Random(size)
+    words = [b"vertex", b"triangle", b"paint_color", b"4", b"8C", b"0.125", b"-17.5", b" ", b"\n"]
+    return b"".join(rng.choice(words) for _ in range(size // 4))[:size]
+
+
+def open_output(seekable):
+    output = io.BytesIO() if seekable else Unseekable()
+    return output, zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED)
+
+
+def read_back(output):
+    archive = zipfile.ZipFile(io.BytesIO(output.getvalue()))
+    assert archive.testzip() is None
+    return archive
+
+
+@pytest.mark.parametrize("seekable", [True, False])
+def test_parallel_deflate_round_trip(tmp_path, seekable):
+    data = payload(300_000)
+    path = tmp_path / "part.model"
+    path.write_bytes(data)
+    output, zip_out = open_output(seekable)
+    with zip_out:
+        Compression(workers=4, block_size=16_384).write_file(zip_out, str(path), "3D/Objects/part.model")
+        zip_out.writestr("after.txt", b"next entry")
+    archive = read_back(output)
+    info = archive.getinfo("3D/Objects/part.model")
+    assert info.compress_type == zipfile.ZIP_DEFLATED
+    assert info.CRC == zlib.crc32(data) and info.compress_size < len(data)
+    assert archive.read(info) == data
+    assert archive.read("after.txt") == b"next entry"
+
+
+@pytest.mark.parametrize("seekable", [True, False])
+def test_entry_over_zip64_threshold(tmp_path, monkeypatch, seekable):
+    # a small threshold stands in for the 4 GiB one
+    monkeypatch.setattr(zipfile, "ZIP64_LIMIT", 50_000)
+    data = payload(200_000)
+    path = tmp_path / "part.model"
+    path.write_bytes(data)
+    output, zip_out = open_output(seekable)
+    with zip_out:
+        Compression(workers=2, block_size=16_384, level=0).write_file(zip_out, str(path), "big.model")
+    archive = read_back(output)
+    info = archive.getinfo("big.model")
+    assert info.file_size == len(data) and info.compress_size > zipfile.ZIP64_LIMIT
+    assert archive.read(info) == data
+    # the local header carries the zip64 sizes too
+    header = output.getvalue()[info.header_offset:info.header_offset + 30]
+    assert int.from_bytes(header[18:22], "little") == int.from_bytes(header[22:26], "little") == 0xffffffff
+
+
+def test_entry_over_zip64_threshold_without_zip64(monkeypatch):
+    monkeypatch.setattr(zipfile, "ZIP64_LIMIT", 1000)
+    output, zip_out = open_output(True)
+    info = zipfile.ZipInfo("big.model")
+    writer = RawEntryWriter(zip_out, info)
+    writer.write(b"x" * 2000)
+    with pytest.raises(zipfile.LargeZipFile):
+        writer.close(zlib.crc32(b"x" * 2000), 2000)
+    zip_out.writestr("after.txt", b"still writable")
+    zip_out.close()
+    assert read_back(output).namelist() == ["after.txt"]
+
+
+@pytest.mark.parametrize("seekable", [True, False])
+def test_abort_in_the_middle_of_an_entry(seekable):
+    def blocks():
+        yield payload(20_000)
+        yield payload(30_000)
+        raise OSError("input went away")
+
+    output, zip_out = open_output(seekable)
+    with zip_out:
+        zip_out.writestr("before.txt", b"first")
+        info = zipfile.ZipInfo("aborted.model")
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with pytest.raises(OSError, match="input went away"):
+            Compression(workers=2).write_blocks(zip_out, info, blocks())
+        # the archive takes further entries, and the partial one is not listed
+        zip_out.writestr("after.txt", b"last")
+    archive = read_back(output)
+    assert archive.namelist() == ["before.txt", "after.txt"]
+    assert archive.read("after.txt") == b"last"
+
+
+def source_archive(path):
+    with zipfile.ZipFile(path, "w") as zip_ref:
+        zip_ref.writestr("deflated.model", payload(100_000), zipfile.ZIP_DEFLATED)
+        zip_ref.writestr("stored.png", os.urandom(5000), zipfile.ZIP_STORED)
+        zip_ref.writestr("empty.txt", b"", zipfile.ZIP_DEFLATED)
+    return zipfile.ZipFile(path)
+
+
+@pytest.mark.parametrize("raw", [True, False])
+@pytest.mark.parametrize("seekable", [True, False])
+def test_copy_raw_entry(tmp_path, monkeypatch, seekable, raw):
+    if not raw:
+        # a Python whose zipfile lacks the internals
+        monkeypatch.setattr(compression, "supports_raw_entries", lambda zip_out, zip_ref=None: False)
+    zip_ref = source_archive(tmp_path / "in.3mf")
+    output, zip_out = open_output(seekable)
+    with zip_ref, zip_out:
+        for info in zip_ref.infolist():
+            copied = copy_raw_entry(zip_ref, info, zip_out, "copy/" + info.filename)
+            assert copied.CRC == info.CRC and copied.compress_type == info.compress_type
+            if raw:
+                assert copied.compress_size == info.compress_size
+        expected = {"copy/" + info.filename: zip_ref.read(info) for info in zip_ref.infolist()}
+    archive = read_back(output)
+    assert {name: archive.read(name) for name in archive.namelist()} == expected
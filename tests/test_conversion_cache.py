@@ -0,0 +1,29 @@
+###
+# test_conversion_cache.py
+# Entries of an archive share a CRC32 and size key with any input forged to match it; only the entry
+# whose stored digest matches the input being converted may be served.
+# @License: GPL 3.0
+###
+import io
+import zipfile
+from conversion_cache import ConversionCache, DigestReader, entry_digest
+
+
+def test_entry_is_served_only_for_its_digest(tmp_path):
+    cache = ConversionCache(str(tmp_path / "cache"))
+    info = zipfile.ZipInfo("3D/Objects/object_1.model")
+    info.CRC, info.file_size = 0x1234abcd, 6
+    key = cache.key_for_entry(info, "variant")
+    assert cache.get(key, lambda: io.BytesIO(b"first!")) is None
+    reader = DigestReader(io.BytesIO(b"first!"))
+    assert reader.read(2) == b"fi"
+    cache_file = cache.writer(key)
+    cache_file.write(b"converted first")
+    # the part the converter did not read is hashed too
+    cache_file.commit(reader.hexdigest())
+    assert reader.hexdigest() == entry_digest(io.BytesIO(b"first!"))
+    path = cache.get(key, lambda: io.BytesIO(b"first!"))
+    assert path is not None and open(path, "rb").read() == b"converted first"
+    # same key, different bytes
+    assert cache.get(key, lambda: io.BytesIO(b"forged")) is None
+    assert (cache.hits, cache.misses, cache.stores) == (1, 2, 1)
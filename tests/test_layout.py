@@ -0,0 +1,65 @@
+###
+# test_layout.py
+# Objects Bambu placed keep their transforms, and the ones it left unplaced, including the other
+# objects of a model file it placed part of, are packed around them without overlapping.
+# @License: GPL 3.0
+###
+import io
+from layout import Layout, IDENTITY, parse_transform
+from model_stream import CORE_NS
+
+PRODUCTION_NS = "http://schemas.microsoft.com/3dmanufacturing/production/2015/06"
+
+
+def box_object(object_id, width, depth, height=10):
+    vertices = "".join(f'<vertex x="{x}" y="{y}" z="{z}"/>' for x in (0, width) for y in (0, depth) for z in (0, height))
+    return f'<object id="{object_id}" type="model"><mesh><vertices>{vertices}</vertices><triangles><triangle v1="0" v2="1" v3="2"/></triangles></mesh></object>'
+
+
+def project(placed_items):
+    # object_1.model holds objects 1 to 3; placed_items: {main model object id: build transform}
+    objects = box_object(1, 40, 30) + box_object(2, 60, 50) + box_object(3, 20, 20)
+    components = "".join(f'<object id="{10 + index}" type="model"><components><component p:path="/3D/Objects/object_1.model" objectid="{index}"/></components></object>'
+                         for index in (1, 2, 3))
+    items = "".join(f'<item objectid="{object_id}" transform="{transform}"/>' for object_id, transform in placed_items.items())
+    return {
+        "3D/3dmodel.model": f'<model xmlns="{CORE_NS}" xmlns:p="{PRODUCTION_NS}"><resources>{components}</resources><build>{items}</build></model>'.encode(),
+        "3D/Objects/object_1.model": f'<model xmlns="{CORE_NS}"><resources>{objects}</resources><build/></model>'.encode(),
+    }
+
+
+def footprints(plan, sizes):
+    # (x0, y0, x1, y1) on the bed of every planned object
+    result = []
+    for object_id, transforms in plan["3D/Objects/object_1.model"].items():
+        width, depth = sizes[object_id]
+        for transform in transforms:
+            values = parse_transform(transform)
+            assert values[:9] == IDENTITY[:9]
+            result.append((values[9], values[10], values[9] + width, values[10] + depth))
+    return result
+
+
+def test_partly_placed_model_file_packs_around_placed_objects():
+    entries = project({"11": "1 0 0 0 1 0 0 0 1 2 3 0", "12": "1 0 0 0 1 0 0 0 1 100 0 0"})
+    plan = Layout(spacing=5).plan(list(entries), lambda name: io.BytesIO(entries[name]), ["3D/Objects/object_1.model"])
+    transforms = plan["3D/Objects/object_1.model"]
+    # Bambu's placements are kept and object 3 is placed too
+    assert transforms["1"] == ["1 0 0 0 1 0 0 0 1 2 3 0"]
+    assert transforms["2"] == ["1 0 0 0 1 0 0 0 1 100 0 0"]
+    assert len(transforms["3"]) == 1
+    boxes = footprints(plan, {"1": (40, 30), "2": (60, 50), "3": (20, 20)})
+    for index, first in enumerate(boxes):
+        for second in boxes[index + 1:]:
+            # at least the spacing apart on one axis
+            assert first[2] + 5 <= second[0] or second[2] + 5 <= first[0] or first[3] + 5 <= second[1] or second[3] + 5 <= first[1]
+    assert all(0 <= box[0] and box[2] <= 250 and 0 <= box[1] and box[3] <= 210 for box in boxes)
+
+
+def test_pack_splits_shelves_around_obstacles():
+    layout = Layout(bed_width=100, bed_depth=100, spacing=0)
+    positions = layout.pack([(30, 20), (30, 20), (30, 20)], [(20, 0, 50, 30)])
+    assert positions == [(50, 0), (50, 20), (0, 40)]
+    # nothing fits beside an obstacle across the whole row: the shelf moves past it
+    assert layout.pack([(30, 20)], [(0, 0, 90, 40)]) == [(0, 40)]
+    assert layout.pack([(30, 20)]) == [(0, 0)]
@@ -0,0 +1,49 @@
+###
+# test_limits.py
+# The parse limit applies to every stretch without markup, wherever it falls between the reads,
+# and the main model pre-passes read projects whose main model holds meshes as well.
+# @License: GPL 3.0
+###
+import io
+import pytest
+from limits import ResourceLimits, LimitExceeded
+from selection import read_components
+from layout import read_build_transforms
+from model_stream import CORE_NS
+
+PRODUCTION_NS = "http://schemas.microsoft.com/3dmanufacturing/production/2015/06"
+
+
+def read_all(data, max_parse_bytes, size):
+    reader = ResourceLimits(max_parse_bytes=max_parse_bytes).reader(io.BytesIO(data), "3D/Objects/object_1.model")
+    while reader.read(size):
+        pass
+
+
+@pytest.mark.parametrize("size", [7, 64, 1000, -1])
+def test_long_run_anywhere_is_refused(size):
+    # within the limit: stretches of 20 bytes after each "<", some of them cut across reads
+    read_all(b"<a>" + (b"x" * 17 + b"<b/>") * 10, 20, size)
+    # one stretch of 21 bytes in the middle of the data
+    with pytest.raises(LimitExceeded):
+        read_all(b"<a>" + b"x" * 10 + b"<b/>" + b"y" * 18 + b"<c/>" + b"z" * 10 + b"</a>", 20, size)
+
+
+def test_run_before_the_first_markup_counts_the_earlier_reads():
+    with pytest.raises(LimitExceeded):
+        read_all(b"x" * 15 + b"y" * 15 + b"<a/>", 20, 15)
+
+
+def test_main_model_with_meshes():
+    vertices = "".join(f'<vertex x="{index}" y="0" z="0"/>' for index in range(1000))
+    triangles = "".join(f'<triangle v1="{index}" v2="{index + 1}" v3="{index + 2}"/>' for index in range(998))
+    main_model = (f'<model xmlns="{CORE_NS}" xmlns:p="{PRODUCTION_NS}"><resources>'
+                  f'<object id="1" type="model"><mesh><vertices>{vertices}</vertices><triangles>{triangles}</triangles></mesh></object>'
+                  f'<object id="2" type="model"><components><component p:path="/3D/Objects/object_1.model" objectid="5" transform="1 0 0 0 1 0 0 0 1 1 2 3"/></components></object>'
+                  f'</resources><build><item objectid="1"/><item objectid="2" transform="1 0 0 0 1 0 0 0 1 10 0 0"/></build></model>').encode()
+
+    def open_entry(name):
+        return io.BytesIO(main_model)
+
+    assert read_components(open_entry) == {"2": [("3D/Objects/object_1.model", "5", "1 0 0 0 1 0 0 0 1 1 2 3")]}
+    assert read_build_transforms(open_entry) == {("3D/Objects/object_1.model", "5"): [(1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0, 11.0, 2.0, 3.0)]}
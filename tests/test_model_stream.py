@@ -0,0 +1,91 @@
+###
+# test_model_stream.py
+# The byte-level fast path and the lxml fallback of stream_objects must write the same meshes,
+# at the default chunk and block sizes and at sizes small enough to cut every run into pieces.
+# @License: GPL 3.0
+###
+import io
+import zipfile
+import lxml.etree as ET
+import pytest
+import model_stream
+from model_stream import CORE_NS, MMU_SEGMENTATION, convert_model_stream
+from converter import TEMPLATE_DIR
+
+TEMPLATE = f"{TEMPLATE_DIR}/3D/3dmodel_template.xml"
+
+
+def bambu_model(triangles=20000, painted_every=500):
+    # one object whose painted triangles carry paint_supports, paint_seam, paint_color in the
+    # order Bambu Studio writes them
+    out = io.BytesIO()
+    out.write(b'<?xml version="1.0" encoding="UTF-8"?>\n<model unit="millimeter" xml:lang="en-US" xmlns="%s">\n'
+              b' <resources>\n  <object id="1" type="model">\n   <mesh>\n    <vertices>\n' % CORE_NS.encode())
+    for index in range(triangles + 2):
+        out.write(b'     <vertex x="%d.5" y="%d" z="-1.25e-3"/>\n' % (index, index % 7))
+    out.write(b'    </vertices>\n    <triangles>\n')
+    for index in range(triangles):
+        paint = b""
+        if index % painted_every == 0:
+            paint = b' paint_supports="4" paint_seam="8" paint_color="%X"' % (index % 16 + 4)
+        elif index % painted_every == 1:
+            paint = b' paint_seam="4"'
+        out.write(b'     <triangle v1="%d" v2="%d" v3="%d"%s/>\n' % (index, index + 1, index + 2, paint))
+    out.write(b'    </triangles>\n   </mesh>\n  </object>\n </resources>\n <build/>\n</model>\n')
+    return out.getvalue()
+
+
+def bambu_3mf(path, models=2, triangles=200):
+    # a minimal Bambu project: model files with painted objects next to the package parts
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_out:
+        zip_out.writestr("[Content_Types].xml", b"<Types/>")
+        zip_out.writestr("3D/3dmodel.model", b"<model/>")
+        for index in range(1, models + 1):
+            zip_out.writestr(f"3D/Objects/object_{index}.model", bambu_model(triangles, 50))
+    return path
+
+
+def mesh(data):
+    # (tag, attributes) of every vertex and triangle written
+    root = ET.fromstring(data, ET.XMLParser(huge_tree=True))
+    return [(ET.QName(elem).localname, dict(elem.attrib)) for elem in root.iter("{*}vertex", "{*}triangle")]
+
+
+def convert(data, fast=True):
+    stats = {}
+    output = io.BytesIO()
+    if fast:
+        convert_model_stream(io.BytesIO(data), output, TEMPLATE, stats)
+    else:
+        plain = model_stream._is_plain_mesh_block
+        model_stream._is_plain_mesh_block = lambda block, kind: False
+        try:
+            convert_model_stream(io.BytesIO(data), output, TEMPLATE, stats)
+        finally:
+            model_stream._is_plain_mesh_block = plain
+    return output.getvalue(), stats
+
+
+def test_bambu_order_takes_the_fast_path():
+    line = b'<triangle v1="1" v2="2" v3="3" paint_supports="4" paint_seam="8" paint_color="C"/>'
+    assert model_stream._is_plain_mesh_block(line, "triangles")
+
+
+@pytest.mark.parametrize("chunk_size, block_size", [(model_stream.CHUNK_SIZE, model_stream.BLOCK_SIZE), (7, 1000), (3, 64)])
+def test_fast_path_matches_fallback(monkeypatch, chunk_size, block_size):
+    monkeypatch.setattr(model_stream, "CHUNK_SIZE", chunk_size)
+    monkeypatch.setattr(model_stream, "BLOCK_SIZE", block_size)
+    data = bambu_model()
+    fast, fast_stats = convert(data)
+    fallback, fallback_stats = convert(data, fast=False)
+    written = mesh(fast)
+    assert written == mesh(fallback)
+    assert fast_stats == fallback_stats
+    triangles = [attrib for tag, attrib in written if tag == "triangle"]
+    assert len(triangles) == 20000
+    assert sum(MMU_SEGMENTATION in attrib for attrib in triangles) == 40
+    assert not any("paint_seam" in attrib or "paint_color" in attrib for attrib in triangles)
+    for stats in (fast_stats, fallback_stats):
+        assert stats["triangles"] == stats["written_triangles"] == 20000
+        assert stats["vertices"] == stats["written_vertices"] == 20002
+        assert stats["painted"] == stats["written_painted"] == 40
@@ -0,0 +1,41 @@
+###
+# test_object_index.py
+# LazyModel.write streams indexed objects unless it pretty prints, which materializes them; both
+# must write the same meshes as the input holds.
+# @License: GPL 3.0
+###
+import lxml.etree as ET
+import pytest
+import model_stream
+from converter import Bambu2PrusaConverter
+from object_index import build_object_index
+from test_model_stream import bambu_model, mesh
+
+
+@pytest.mark.parametrize("fast", [True, False])
+@pytest.mark.parametrize("chunk_size, block_size", [(model_stream.CHUNK_SIZE, model_stream.BLOCK_SIZE), (7, 1000)])
+def test_streamed_write_matches_materialized(tmp_path, monkeypatch, chunk_size, block_size, fast):
+    monkeypatch.setattr(model_stream, "CHUNK_SIZE", chunk_size)
+    monkeypatch.setattr(model_stream, "BLOCK_SIZE", block_size)
+    if not fast:
+        # every mesh goes through the lxml chunks, as non-canonical input does
+        monkeypatch.setattr(model_stream, "_is_plain_mesh_block", lambda block, kind: False)
+    source = tmp_path / "object_1.model"
+    source.write_bytes(bambu_model())
+    converter = Bambu2PrusaConverter()
+    objects = {indexed.object_id: indexed for indexed in build_object_index(str(source))}
+    written = {}
+    for pretty_print in (False, True):
+        stats = {}
+        path = tmp_path / f"pretty_{pretty_print}.model"
+        converter.inject_bobject2pobject(objects).write(str(path), pretty_print=pretty_print, stats=stats)
+        written[pretty_print] = mesh(path.read_bytes())
+        assert stats["objects"] == stats["written_objects"] == 1
+        assert stats["vertices"] == stats["written_vertices"] == 20002
+        assert stats["triangles"] == stats["written_triangles"] == 20000
+        assert stats["painted"] == stats["written_painted"] == 40
+    assert written[False] == written[True]
+    triangles = [attrib for tag, attrib in written[False] if tag == "triangle"]
+    assert len(triangles) == 20000
+    assert ET.parse(str(tmp_path / "pretty_False.model")).getroot().find("{*}build") is not None
+    converter.cleanup()
@@ -0,0 +1,138 @@
+###
+# test_service.py
+# The conversion service over a unix socket, on a real process pool: a conversion round trip,
+# heads over the reader limit, upload limits and timeouts, and the slot of a timed-out job being
+# freed once its retired pool is terminated.
+# @License: GPL 3.0
+###
+import io
+import json
+import time
+import asyncio
+import zipfile
+import pytest
+import service
+from service import ConversionService
+from test_model_stream import bambu_3mf
+
+convert_upload = service.convert_upload
+
+
+def hanging_upload(input_file, output_file, settings):
+    # runs in a pool worker: uploads starting with "hang" never finish
+    with open(input_file, 'rb') as f:
+        if f.read(4) == b"hang":
+            time.sleep(600)
+    return convert_upload(input_file, output_file, settings)
+
+
+async def request(path, data):
+    reader, writer = await asyncio.open_unix_connection(path)
+    try:
+        writer.write(data)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    headers = dict(line.split(": ", 1) for line in lines[1:])
+    return int(lines[0].split()[1]), headers, body
+
+
+def post(body, length=None, query=""):
+    length = len(body) if length is None else length
+    return f"POST /convert{query} HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode() + body
+
+
+async def health(path):
+    status, headers, body = await request(path, b"GET /health HTTP/1.1\r\n\r\n")
+    return json.loads(body)
+
+
+def run(tmp_path, conversation, **options):
+    # serve on a unix socket while conversation(service, path) runs
+    conversion_service = ConversionService({"workspace_root": str(tmp_path / "workspaces")}, **options)
+    path = str(tmp_path / "service.sock")
+
+    async def main():
+        await conversion_service.start()
+        try:
+            server = await asyncio.start_unix_server(conversion_service.handle, path=path)
+            async with server:
+                return await conversation(conversion_service, path)
+        finally:
+            conversion_service.stop()
+            for pool in list(conversion_service.retired):
+                service.terminate_pool(pool)
+    return asyncio.run(main())
+
+
+def test_convert_round_trip(tmp_path):
+    upload = bambu_3mf(tmp_path / "in.3mf").read_bytes()
+
+    async def conversation(conversion_service, path):
+        status, headers, body = await request(path, post(upload, query="?compression=stored"))
+        assert status == 200 and headers["X-Model-Files"] == "2"
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            assert archive.testzip() is None
+            assert archive.getinfo("3D/Objects/object_1.model").compress_type == zipfile.ZIP_STORED
+        status, headers, body = await request(path, post(b"not a zip"))
+        assert status == 422
+        return await health(path)
+
+    counters = run(tmp_path, conversation)
+    assert (counters["completed"], counters["failed"], counters["active"]) == (1, 1, 0)
+    # the uploads and results are removed with their workspaces
+    assert not list((tmp_path / "workspaces").iterdir())
+
+
+def test_oversized_request_heads(tmp_path):
+    async def conversation(conversion_service, path):
+        # the reader's default limit is 64 KiB per line
+        long_target = b"GET /" + b"x" * 100_000 + b" HTTP/1.1\r\n\r\n"
+        long_header = b"GET /health HTTP/1.1\r\nX-Padding: " + b"x" * 100_000 + b"\r\n\r\n"
+        many_headers = b"GET /health HTTP/1.1\r\n" + b"X-Header: 1\r\n" * 200 + b"\r\n"
+        return [(await request(path, data))[0] for data in (long_target, long_header, many_headers)]
+
+    assert run(tmp_path, conversation) == [400, 431, 431]
+
+
+def test_upload_limits(tmp_path):
+    async def conversation(conversion_service, path):
+        statuses = [(await request(path, post(b"", length=2000)))[0]]
+        statuses.append((await request(path, b"POST /convert HTTP/1.1\r\n\r\n"))[0])
+        statuses.append((await request(path, post(b"", length="many")))[0])
+        # the body stops arriving halfway
+        statuses.append((await request(path, post(b"x" * 10, length=100)))[0])
+        return statuses, await health(path)
+
+    statuses, counters = run(tmp_path, conversation, max_upload=1000, upload_timeout=0.5)
+    assert statuses == [413, 411, 400, 408]
+    assert counters["active"] == 0
+
+
+def test_timed_out_job_frees_its_slot(tmp_path, monkeypatch):
+    monkeypatch.setattr(service, "convert_upload", hanging_upload)
+    upload = bambu_3mf(tmp_path / "in.3mf").read_bytes()
+
+    async def conversation(conversion_service, path):
+        hung = asyncio.ensure_future(request(path, post(b"hang")))
+        while (await health(path))["active"] < 1:
+            await asyncio.sleep(0.05)
+        # the only slot is taken
+        status, headers, body = await request(path, post(upload))
+        assert status == 429 and int(headers["Retry-After"]) >= 1
+        status, headers, body = await hung
+        assert status == 504
+        # the hung worker is terminated with its retired pool, which frees the slot
+        for attempt in range(100):
+            if (await health(path))["active"] == 0:
+                break
+            await asyncio.sleep(0.05)
+        status, headers, body = await request(path, post(upload))
+        assert status == 200
+        return await health(path)
+
+    counters = run(tmp_path, conversation, workers=1, queue_size=0, timeout=1)
+    assert (counters["timed_out"], counters["rejected"], counters["completed"], counters["active"]) == (1, 1, 1, 0)
@@ -0,0 +1,70 @@
+###
+# test_watch.py
+# The watch daemon in --once mode: converted and failed files are recorded in the state index, a
+# restart only converts what changed since, and a file that kills its worker is given up on while
+# the files converted next to it are not.
+# @License: GPL 3.0
+###
+import os
+import json
+import zipfile
+import watch
+from watch import FolderWatcher, STATE_FILE, MAX_ATTEMPTS
+from test_model_stream import bambu_3mf
+
+
+def test_once_converts_new_and_changed_files(tmp_path):
+    incoming = tmp_path / "incoming"
+    converted = tmp_path / "converted"
+    incoming.mkdir()
+    bambu_3mf(incoming / "good.3mf")
+    # a zip without model files converts to nothing and fails validation
+    with zipfile.ZipFile(incoming / "empty.3mf", "w") as zip_out:
+        zip_out.writestr("[Content_Types].xml", b"<Types/>")
+    (incoming / "notes.txt").write_text("not a project")
+
+    counters = FolderWatcher(str(incoming), str(converted)).run(once=True)
+    assert counters == {"converted": 1, "failed": 1}
+    with zipfile.ZipFile(converted / "good.3mf") as archive:
+        assert archive.testzip() is None
+    state = json.loads((converted / STATE_FILE).read_text())
+    assert sorted(state) == ["empty.3mf", "good.3mf"]
+    assert state["good.3mf"]["ok"] and not state["empty.3mf"]["ok"]
+    assert sorted(os.listdir(converted)) == [STATE_FILE, "good.3mf"]
+
+    # nothing changed: a restart converts nothing, failed files included
+    assert FolderWatcher(str(incoming), str(converted)).run(once=True) == {"converted": 0, "failed": 0}
+    # a new version is converted again
+    bambu_3mf(incoming / "good.3mf", models=3)
+    os.utime(incoming / "good.3mf", ns=(1, 1))
+    assert FolderWatcher(str(incoming), str(converted)).run(once=True) == {"converted": 1, "failed": 0}
+    with zipfile.ZipFile(converted / "good.3mf") as archive:
+        assert "3D/Objects/object_3.model" in archive.namelist()
+
+
+convert_atomically = watch.convert_atomically
+
+
+def dying_conversion(input_file, output_file, settings):
+    # runs in a pool worker, which the poisoned file kills as running out of memory would
+    if "poison" in input_file:
+        os._exit(9)
+    return convert_atomically(input_file, output_file, settings)
+
+
+def test_file_that_kills_workers_is_recorded_as_failed(tmp_path, monkeypatch):
+    monkeypatch.setattr(watch, "convert_atomically", dying_conversion)
+    incoming = tmp_path / "incoming"
+    converted = tmp_path / "converted"
+    incoming.mkdir()
+    for name in ("a.3mf", "poison.3mf", "b.3mf", "c.3mf"):
+        bambu_3mf(incoming / name)
+
+    counters = FolderWatcher(str(incoming), str(converted), workers=2).run(once=True)
+    assert counters == {"converted": 3, "failed": 1}
+    state = json.loads((converted / STATE_FILE).read_text())
+    assert state["poison.3mf"]["ok"] is False
+    assert state["poison.3mf"]["message"] == f"The conversion worker died {MAX_ATTEMPTS} times"
+    assert all(state[name]["ok"] for name in ("a.3mf", "b.3mf", "c.3mf"))
+    # it stays failed until it changes
+    assert FolderWatcher(str(incoming), str(converted)).run(once=True) == {"converted": 0, "failed": 0}
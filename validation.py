@@ -0,0 +1,91 @@
+###
+# validation.py
+# Validation of a conversion against its input, from counts taken during the conversion itself.
+# While a model is streamed, the converter counts the objects, vertices, triangles and painted
+# triangles it reads from the objects it copies, and OutputCounter (model_stream.py) counts the
+# same things in the bytes it writes; nothing is parsed a second time. A ValidationReport collects
+# both sides per model file. The job fails when any model file differs or when no object was
+# written at all, so a broken conversion (e.g. an empty template) is rejected instead of shipped.
+# The report can be appended to a JSON-lines file for automatic checks.
+# @License: GPL 3.0
+###
+import os
+import json
+import time
+import logging
+
+COUNTS = ("objects", "vertices", "triangles", "painted")
+
+
+class ValidationError(ValueError):
+    pass
+
+
+class ValidationReport:
+
+    def __init__(self, input_file, output_file):
+        self.input_file = input_file
+        self.output_file = output_file
+        # one record per model file, in conversion order
+        self.models = []
+
+    def add(self, entry, stats):
+        # stats of a conversion: the counts read, and the written_* counts found in the output;
+        # returns whether they match
+        read = {name: stats.get(name, 0) for name in COUNTS}
+        written = {name: stats.get(f"written_{name}", 0) for name in COUNTS}
+        record = {"entry": entry, "input": read, "output": written, "ok": read == written}
+        if not record["ok"]:
+            record["mismatch"] = [name for name in COUNTS if read[name] != written[name]]
+            logging.error(f"Validation of {entry} failed: read {read}, wrote {written}")
+        self.models.append(record)
+        return record["ok"]
+
+    def add_reused(self, entry, source):
+        # parts copied from the conversion cache or a previous output were validated when written
+        self.models.append({"entry": entry, "reused": source, "ok": True})
+
+    def add_error(self, entry, message):
+        # the input could not be read completely, so its counts are unknown
+        logging.error(f"Validation of {entry} failed: {message}")
+        self.models.append({"entry": entry, "error": message, "ok": False})
+
+    def totals(self, side):
+        totals = dict.fromkeys(COUNTS, 0)
+        for record in self.models:
+            for name, count in record.get(side, {}).items():
+                totals[name] += count
+        return totals
+
+    def problems(self):
+        problems = []
+        for record in self.models:
+            if "error" in record:
+                problems.append(f"{record['entry']}: {record['error']}")
+            elif not record["ok"]:
+                differences = ", ".join(f"{name} {record['input'][name]} read, {record['output'][name]} written" for name in record["mismatch"])
+                problems.append(f"{record['entry']}: {differences}")
+        compared = [record for record in self.models if "output" in record]
+        if compared and len(compared) == len(self.models) and not self.totals("output")["objects"]:
+            problems.append("no objects were written")
+        return problems
+
+    @property
+    def ok(self):
+        return not self.problems()
+
+    def as_dict(self):
+        return {"input": self.input_file, "output": self.output_file, "ok": self.ok, "problems": self.problems(),
+                "totals": {"input": self.totals("input"), "output": self.totals("output")}, "models": self.models}
+
+
+def append_report(path, report):
+    # one JSON line per job, written with a single append so processes can share the file
+    record = report.as_dict()
+    record["time"] = round(time.time(), 3)
+    line = (json.dumps(record) + "\n").encode("utf-8")
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
@@ -0,0 +1,228 @@
+###
+# watch.py
+# Watch-folder daemon: converts Bambu 3mf exports as they land in a directory, e.g.
+#   python bambu2prusa.py watch /farm/incoming -o /farm/prusa -j 4
+# The input directory is polled, which works the same on local disks and network shares. A file is
+# only converted once its size and modification time have not changed for the settle time, so
+# exports still being copied are left alone, and once it opens as a zip. Conversions run on a
+# process pool that is warmed up once (interpreter, lxml and templates), and each result is
+# written to a partial file next to its final name and renamed into place, so readers of the
+# output directory never see half a file. A small JSON state index in the output directory
+# records what was converted from which version of each input, so a restart only converts files
+# that are new or changed since. When a worker dies, the pool is replaced and the files it was
+# converting are tried again, each on its own so the one that kills workers can be told apart; a
+# file whose conversion dies MAX_ATTEMPTS times is recorded as failed.
+# @License: GPL 3.0
+###
+import os
+import json
+import time
+import signal
+import logging
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from converter import convert_file
+
+STATE_FILE = ".bambu2prusa-watch.json"
+MAX_ATTEMPTS = 3
+
+
+def convert_atomically(input_file, output_file, settings):
+    # runs in a pool worker; the output only appears under its name once it is complete
+    partial = os.path.join(os.path.dirname(output_file), f".{os.path.basename(output_file)}.{os.getpid()}.part")
+    try:
+        models = convert_file(input_file, partial, **settings)
+        os.replace(partial, output_file)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return len(models)
+
+
+def warm_up():
+    # pool initializer: import and parse everything a conversion needs before the first file.
+    # Ctrl-C is left to the daemon, which lets the running conversions finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from service import warm_up
+    warm_up()
+
+
+class FolderWatcher:
+
+    def __init__(self, input_dir, output_dir, settings=None, workers=1, interval=2.0, settle=5.0, state_file=None):
+        # settings: converter attributes applied to every job, as for convert_file()
+        if os.path.exists(output_dir) and os.path.samefile(input_dir, output_dir):
+            raise ValueError("The output directory must not be the watched directory")
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.settings = settings or {}
+        self.workers = workers
+        self.interval = interval
+        self.settle = settle
+        self.state_file = state_file or os.path.join(output_dir, STATE_FILE)
+        # {file name: {"size", "mtime_ns", "ok", "message", "converted_at"}} of the converted inputs
+        self.state = {}
+        # {file name: (signature, time the signature was first seen)} of files waiting to settle
+        self.pending = {}
+        # {file name: (signature, future)} of conversions on the pool
+        self.running = {}
+        # {file name: (signature, conversions of it a dead worker interrupted)}, and the interrupted
+        # files waiting to be tried again on their own: {file name: signature}
+        self.attempts = {}
+        self.suspects = {}
+        self.pool = None
+        self.broken = False
+        self.counters = {"converted": 0, "failed": 0}
+
+    def load_state(self):
+        try:
+            with open(self.state_file, encoding="utf-8") as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            self.state = {}
+        except (ValueError, OSError) as e:
+            # a damaged index only costs a reconversion of everything
+            logging.error(f"Ignoring unreadable watch state {self.state_file}: {e}")
+            self.state = {}
+
+    def save_state(self):
+        # written to a temporary file and renamed, so a crash leaves the old or the new index
+        temp_path = f"{self.state_file}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.state_file)
+
+    def scan(self):
+        # {file name: (size, mtime_ns)} of the 3mf files in the watched directory
+        found = {}
+        with os.scandir(self.input_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.name.lower().endswith(".3mf"):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                found[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return found
+
+    def is_converted(self, name, signature):
+        record = self.state.get(name)
+        return record is not None and (record["size"], record["mtime_ns"]) == signature
+
+    def ready(self, found, now, settle=None):
+        # names whose current version is new, has settled and is not being converted yet
+        if settle is None:
+            settle = self.settle
+        ready = []
+        for name, signature in found.items():
+            if name in self.running or name in self.suspects or self.is_converted(name, signature):
+                self.pending.pop(name, None)
+                continue
+            seen = self.pending.get(name)
+            if seen is None or seen[0] != signature:
+                # new or still being written; the settle time starts over
+                self.pending[name] = (signature, now)
+                if settle > 0:
+                    continue
+                seen = self.pending[name]
+            if now - seen[1] < settle:
+                continue
+            if not zipfile.is_zipfile(os.path.join(self.input_dir, name)):
+                # the size stopped changing but the central directory isn't there (yet)
+                logging.debug(f"{name} is not a complete zip yet")
+                continue
+            del self.pending[name]
+            ready.append((name, signature))
+        for name in list(self.pending):
+            if name not in found:
+                del self.pending[name]
+        return ready
+
+    def start_pool(self):
+        if self.pool is not None:
+            logging.error("A conversion worker died, replacing the worker pool")
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up)
+        self.broken = False
+
+    def submit(self, name, signature):
+        logging.info(f"Converting {name}")
+        input_file = os.path.join(self.input_dir, name)
+        output_file = os.path.join(self.output_dir, name)
+        try:
+            future = self.pool.submit(convert_atomically, input_file, output_file, self.settings)
+        except BrokenProcessPool:
+            # a worker died since the last results were collected
+            self.start_pool()
+            future = self.pool.submit(convert_atomically, input_file, output_file, self.settings)
+        self.running[name] = (signature, future)
+
+    def collect(self, wait=False):
+        # record the finished conversions; returns whether any finished
+        finished = [name for name, (signature, future) in self.running.items() if wait or future.done()]
+        for name in finished:
+            signature, future = self.running.pop(name)
+            try:
+                message = f"{future.result()} model files"
+                ok = True
+            except BrokenProcessPool:
+                # a worker died (killed for memory, crashed, or on shutdown) and took the pool with it
+                self.broken = True
+                previous, attempts = self.attempts.get(name, (signature, 0))
+                attempts = attempts + 1 if previous == signature else 1
+                if attempts < MAX_ATTEMPTS:
+                    logging.error(f"Conversion of {name} was interrupted, trying it again")
+                    self.attempts[name] = (signature, attempts)
+                    self.suspects[name] = signature
+                    continue
+                message = f"The conversion worker died {attempts} times"
+                ok = False
+            except Exception as e:
+                message = f"{type(e).__name__}: {e}"
+                ok = False
+            self.attempts.pop(name, None)
+            self.counters["converted" if ok else "failed"] += 1
+            # failed files are recorded too and only tried again once they change
+            self.state[name] = {"size": signature[0], "mtime_ns": signature[1], "ok": ok, "message": message, "converted_at": time.time()}
+            if ok:
+                print(f"OK      {name} -> {os.path.join(self.output_dir, name)} ({message})", flush=True)
+            else:
+                print(f"FAILED  {name}: {message}", flush=True)
+        if finished:
+            self.save_state()
+        return bool(finished)
+
+    def run(self, once=False):
+        # poll until interrupted; with once, convert what is there now, wait for it and return
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.load_state()
+        logging.info(f"Watching {self.input_dir} with {self.workers} workers, {len(self.state)} files already converted")
+        self.start_pool()
+        try:
+            while True:
+                if self.broken:
+                    self.start_pool()
+                if self.suspects:
+                    # interrupted files go one at a time, and before any new file
+                    if not self.running:
+                        name = next(iter(self.suspects))
+                        self.submit(name, self.suspects.pop(name))
+                else:
+                    for name, signature in self.ready(self.scan(), time.monotonic(), 0 if once else None):
+                        self.submit(name, signature)
+                if once:
+                    self.collect(wait=True)
+                    if not self.suspects:
+                        return self.counters
+                    continue
+                self.collect()
+                time.sleep(self.interval)
+        finally:
+            # conversions already on the pool are finished and recorded before leaving
+            self.collect(wait=True)
+            self.pool.shutdown()
+            self.pool = None
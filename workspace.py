@@ -0,0 +1,69 @@
+###
+# workspace.py
+# Per-job scratch space.
+# Every conversion gets its own Workspace: a fresh directory from mkdtemp, so any number of jobs
+# can run at once in one process (threads, the service, the watch daemon) without sharing paths.
+# It holds the extracted input, the output tree of the extract-to-disk path and part files, and it
+# is removed as a whole when the job ends, whether it succeeded or not. The directory can be put
+# on a given file system, such as a fast scratch disk, or in memory: memory=True places it on a
+# tmpfs (/dev/shm on Linux) when there is one.
+# @License: GPL 3.0
+###
+import os
+import shutil
+import logging
+import tempfile
+
+# tmpfs mounts tried, in order, for in-memory workspaces
+MEMORY_ROOTS = ("/dev/shm", "/run/shm")
+
+
+def memory_root():
+    # a writable tmpfs directory, or None where there is none (e.g. on Windows or macOS)
+    for root in MEMORY_ROOTS:
+        if os.path.isdir(root) and os.access(root, os.W_OK):
+            return root
+    return None
+
+
+class Workspace:
+
+    def __init__(self, root=None, memory=False, prefix="bambu2prusa-"):
+        # root: directory the workspace is created in (default: the system temporary directory)
+        if memory and root is None:
+            root = memory_root()
+            if root is None:
+                logging.warning("No tmpfs found for an in-memory workspace, using the temporary directory")
+        if root is not None:
+            os.makedirs(root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=root)
+        logging.debug(f"Created workspace {self.path}")
+
+    def __repr__(self):
+        return f"Workspace({self.path!r})"
+
+    @property
+    def closed(self):
+        return self.path is None
+
+    def subdir(self, *names):
+        # a directory inside the workspace, created on first use
+        if self.path is None:
+            raise ValueError("The workspace has been removed")
+        path = os.path.join(self.path, *names)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def close(self):
+        # remove everything in the workspace; safe to call more than once
+        if self.path is None:
+            return
+        logging.debug(f"Removing workspace {self.path}")
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()